@@ -0,0 +1,11 @@
+from blog_to_epub_serializer.registry import load_serializer
+from blog_to_epub_serializer.scraper import Scraper
+
+
+def load_scraper(serializer_path: str) -> Scraper:
+    """
+    :param serializer_path: the path to one of the serializers/*.py files
+    :return: the scraper of the (first) book it registers.  Its cover is
+        downloaded now, if it has a cover_img_url.
+    """
+    return load_serializer(serializer_path)[0].scraper()
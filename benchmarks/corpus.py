@@ -0,0 +1,184 @@
+"""
+Record the pages and images a serializer downloads, so it can be benchmarked
+offline against the same content.
+
+A build is run from scratch (in a temporary directory, nothing is reused
+from local_cache) and every response is saved under benchmarks/corpus/,
+which is not tracked by git.
+
+Usage:
+    python -m benchmarks.corpus serializers/innkeeper.py
+    python -m benchmarks.corpus serializers/*.py
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from blog_to_epub_serializer.cli import configure_logging
+from blog_to_epub_serializer.http_client import HttpClient
+from blog_to_epub_serializer.scraper import Scraper
+
+logger = logging.getLogger("benchmarks")
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+
+
+class Corpus:
+    """
+    Recorded responses, by url, plus any local files the serializer expects
+    to find in local_cache (e.g. a cover that is not downloaded).
+    """
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self):
+        # url -> (body, content type)
+        self.responses: Dict[str, Tuple[bytes, str]] = {}
+        # path relative to the working directory -> content
+        self.files: Dict[str, bytes] = {}
+
+    def add(self, url: str, body: bytes, content_type: str) -> None:
+        self.responses[url] = body, content_type
+
+    def get(self, url: str) -> Optional[Tuple[bytes, str]]:
+        """
+        :param url: the original url
+        :return: the recorded body and content type, None if not recorded
+        """
+        return self.responses.get(url)
+
+    @classmethod
+    def load(cls, directory: str) -> "Corpus":
+        """
+        :param directory: a directory written by `save`
+        :return: the corpus stored there
+        """
+        corpus = cls()
+        with open(os.path.join(directory, cls.INDEX_NAME), "r") as f:
+            index = json.load(f)
+        for url, entry in index["responses"].items():
+            with open(
+                os.path.join(directory, "blobs", entry["file"]), "rb"
+            ) as f:
+                corpus.add(url, f.read(), entry["content_type"])
+        for path in index["files"]:
+            with open(os.path.join(directory, "files", path), "rb") as f:
+                corpus.files[path] = f.read()
+        return corpus
+
+    def save(self, directory: str) -> None:
+        """
+        :param directory: where to store the corpus, one file per distinct
+            body plus an index
+        """
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        responses = {}
+        for url, (body, content_type) in self.responses.items():
+            digest = hashlib.sha256(body).hexdigest()
+            with open(os.path.join(directory, "blobs", digest), "wb") as f:
+                f.write(body)
+            responses[url] = {"file": digest, "content_type": content_type}
+        for path, content in self.files.items():
+            file_path = os.path.join(directory, "files", path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "wb") as f:
+                f.write(content)
+        with open(os.path.join(directory, self.INDEX_NAME), "w") as f:
+            json.dump(
+                {"responses": responses, "files": sorted(self.files)},
+                f,
+                indent=1,
+            )
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body, _ in self.responses.values())
+
+
+class RecordingClient(HttpClient):
+    """
+    An HttpClient that adds every successful response to a Corpus.
+    """
+
+    def __init__(self, corpus: Corpus, **kwargs):
+        super().__init__(**kwargs)
+        self.corpus = corpus
+
+    def get(self, url: str, **kwargs):
+        response = super().get(url, **kwargs)
+        if response.status_code == 200:
+            # read the body now, iter_content replays it for streamed
+            # downloads
+            self.corpus.add(
+                url,
+                response.content,
+                response.headers.get(
+                    "Content-Type", "application/octet-stream"
+                ),
+            )
+        return response
+
+
+def corpus_dir(serializer_path: str) -> str:
+    """
+    :param serializer_path: the path to one of the serializers/*.py files
+    :return: where its corpus is recorded
+    """
+    name = os.path.splitext(os.path.basename(serializer_path))[0]
+    return os.path.join(CORPUS_DIR, name)
+
+
+def record(serializer_path: str) -> Corpus:
+    """
+    Build a serializer from scratch, recording everything it downloads.
+
+    :param serializer_path: the path to one of the serializers/*.py files
+    :return: the recorded corpus, also saved to `corpus_dir`
+    """
+    # imported here, standin imports this module
+    from benchmarks.common import load_scraper
+    from benchmarks.standin import isolated_build
+
+    serializer_path = os.path.abspath(serializer_path)
+    origin = os.getcwd()
+    corpus = Corpus()
+    client = RecordingClient(
+        corpus, pool_maxsize=Scraper.MAX_REQUESTS_PER_HOST
+    )
+    with isolated_build(client):
+        scraper = load_scraper(serializer_path)
+        cover = scraper.cover_img_path
+        if cover and not os.path.isfile(cover):
+            # a cover kept in local_cache by hand, rather than downloaded
+            with open(os.path.join(origin, cover), "rb") as f:
+                corpus.files[cover] = f.read()
+            os.makedirs(os.path.dirname(cover), exist_ok=True)
+            with open(cover, "wb") as f:
+                f.write(corpus.files[cover])
+        scraper.run(use_cache=False, stream=True)
+
+    corpus.save(corpus_dir(serializer_path))
+    return corpus
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "serializers", nargs="+", help="paths to serializers/*.py files"
+    )
+    args = parser.parse_args(argv)
+    configure_logging()
+    for serializer_path in args.serializers:
+        corpus = record(serializer_path)
+        print(
+            f"{serializer_path}: {len(corpus.responses)} responses "
+            f"({corpus.size / 1024 / 1024:.1f} MiB) recorded to "
+            f"{corpus_dir(serializer_path)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Compare the BeautifulSoup parser backends on a serializer's cached pages.
+
+Every cached page of the serializer is parsed with each backend, timed, and
+run through the serializer's parse_chapter_text.  The chapters are compared
+to the ones "html.parser" produces, so a backend is only worth switching to
+(Scraper.HTML_PARSER) if it is faster and its chapters are identical.
+
+Usage:
+    python -m benchmarks.parser_backends serializers/innkeeper.py
+    python -m benchmarks.parser_backends serializers/innkeeper.py \
+        --parsers html.parser lxml --repeat 5
+"""
+import argparse
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bs4 import FeatureNotFound
+
+from benchmarks.common import load_scraper
+from blog_to_epub_serializer.cli import configure_logging
+from blog_to_epub_serializer.scraper import Scraper
+
+logger = logging.getLogger("benchmarks")
+
+# a cached page and its declared charset
+Page = Tuple[bytes, Optional[str]]
+
+BASELINE_PARSER = "html.parser"
+DEFAULT_PARSERS = [BASELINE_PARSER, "lxml", "html5lib"]
+
+
+def cached_pages(scraper: Scraper) -> Dict[float, Page]:
+    """
+    :param scraper: the serializer's scraper
+    :return: the html of every chapter that is cached locally, by key
+    """
+    pages = {}
+    for key in scraper.blog_map:
+        try:
+            html = scraper.read_page_from_file(key)
+            pages[key] = html, scraper.page_encoding(key)
+        except FileNotFoundError:
+            logger.warning(f"No cached page for {key}, skipping it")
+    return pages
+
+
+def render(scraper: Scraper, page: Page, key: float, parser: str) -> str:
+    """
+    :return: the title and html of the chapter, as they end up in the epub
+    """
+    html, encoding = page
+    soup = scraper.make_soup(html, parser, encoding)
+    chapter = scraper.parse_chapter_text(soup, key)
+    return f"{chapter.title}\n{chapter.html_content}"
+
+
+def benchmark(
+    scraper: Scraper, parser: str, pages: Dict[float, Page], repeat: int
+) -> Optional[Tuple[float, List[float]]]:
+    """
+    :param scraper: the serializer's scraper
+    :param parser: the backend to time
+    :param pages: the cached html, by chapter key
+    :param repeat: how many times every page is parsed, the fastest run
+        is kept
+    :return: the seconds needed to parse all the pages and the keys of the
+        chapters that differ from the baseline, or None if the backend is
+        not installed
+    """
+    try:
+        scraper.make_soup("<p></p>", parser)
+    except FeatureNotFound:
+        return None
+
+    elapsed = 0.0
+    for html, encoding in pages.values():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            scraper.make_soup(html, parser, encoding)
+            timings.append(time.perf_counter() - start)
+        elapsed += min(timings)
+
+    mismatched = [
+        key
+        for key, page in pages.items()
+        if render(scraper, page, key, parser)
+        != render(scraper, page, key, BASELINE_PARSER)
+    ]
+    return elapsed, mismatched
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("serializer", help="path to a serializers/*.py file")
+    parser.add_argument("--parsers", nargs="+", default=DEFAULT_PARSERS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    scraper = load_scraper(args.serializer)
+    pages = cached_pages(scraper)
+    if not pages:
+        raise SystemExit(
+            f"No cached pages under {scraper.SCRAPER_CACHE}, run the "
+            f"serializer once first"
+        )
+
+    results = {}
+    for name in dict.fromkeys([BASELINE_PARSER] + args.parsers):
+        results[name] = benchmark(scraper, name, pages, args.repeat)
+
+    baseline = results[BASELINE_PARSER][0]
+    print(f"{len(pages)} cached pages, best of {args.repeat}")
+    print(f"{'parser':<12} {'seconds':>9} {'speedup':>8}  chapters")
+    for name, result in results.items():
+        if result is None:
+            print(f"{name:<12} {'not installed':>18}")
+            continue
+        elapsed, mismatched = result
+        if mismatched:
+            keys = ", ".join(str(key) for key in mismatched)
+            outcome = f"{len(mismatched)} differ ({keys})"
+        else:
+            outcome = "identical"
+        print(
+            f"{name:<12} {elapsed:>9.3f} {baseline / elapsed:>7.1f}x  "
+            f"{outcome}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Time every stage of a build, offline, to catch performance regressions.
+
+The real serializers are built against the corpus recorded for them (see
+benchmarks.corpus), served by a local http stand-in, and a synthetic serial
+with thousands of chapters shows how the pipeline scales.  Each build is a
+plain `Scraper.run` starting from an empty local_cache, and reports the
+stages its BuildMetrics recorded:
+
+    fetch               download the chapter pages
+    image_fetch         download the images (inside parse_chapter_text)
+    parse               build the soup of every page
+    parse_chapter_text  the serializer's parsing, with its image downloads
+    image_encode        encode the cover and chapter images for the profile
+    book                create the Book and add the chapters
+    write_epub          write the epub
+
+Stage times are summed across the worker threads and nest, so they add up
+to more than the wall clock time, reported as "total".
+
+Usage:
+    python -m benchmarks.pipeline --synthetic
+    python -m benchmarks.pipeline serializers/innkeeper.py --profile e-ink
+    python -m benchmarks.pipeline serializers/*.py --synthetic \
+        --json after.json --baseline before.json
+"""
+import argparse
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from benchmarks.common import load_scraper
+from benchmarks.corpus import Corpus, corpus_dir
+from benchmarks.standin import offline
+from benchmarks.synthetic import synthetic_book
+from blog_to_epub_serializer.cli import configure_logging
+from blog_to_epub_serializer.scraper import LOCAL_CACHE, Scraper
+
+logger = logging.getLogger("benchmarks")
+
+STAGES = (
+    "fetch",
+    "image_fetch",
+    "parse",
+    "parse_chapter_text",
+    "image_encode",
+    "book",
+    "write_epub",
+)
+
+
+@dataclass
+class BuildResult:
+    name: str
+    # stage -> seconds, see BuildMetrics.stages
+    stages: Dict[str, float] = field(default_factory=dict)
+    # wall clock seconds of the whole build
+    total: float = 0.0
+    chapters: int = 0
+    images: int = 0
+    epub_size: int = 0
+
+
+def build(
+    scraper: Scraper,
+    name: str,
+    profile: str = "original",
+    image_workers: int = 1,
+    stream: bool = False,
+) -> BuildResult:
+    """
+    Build the scraper's book with `Scraper.run`.  Must run inside `offline`.
+
+    :param scraper: the book to build
+    :param name: the name of the build in the results
+    :param profile: the image profile
+    :param image_workers: processes used to transcode the images
+    :param stream: whether to stream the chapters into the epub
+    :return: the timings
+    """
+    build_metrics = scraper.run(
+        image_workers=image_workers, profile=profile, stream=stream
+    )
+    counters = build_metrics.counters
+    return BuildResult(
+        name,
+        stages={
+            stage: build_metrics.stages.get(stage, 0.0) for stage in STAGES
+        },
+        total=build_metrics.wall_seconds,
+        chapters=counters["chapters_parsed"] + counters["chapters_cached"],
+        # the build starts cold, every distinct image is downloaded once
+        images=counters["images_downloaded"],
+        epub_size=os.path.getsize(f"{LOCAL_CACHE}/{scraper.epub_name}"),
+    )
+
+
+def run_serializer(
+    serializer_path: str, latency: float, **kwargs
+) -> BuildResult:
+    """
+    Build a real serializer against its recorded corpus.
+    """
+    serializer_path = os.path.abspath(serializer_path)
+    corpus = Corpus.load(corpus_dir(serializer_path))
+    with offline(corpus, latency):
+        # created inside, serializers download their cover when it is created
+        scraper = load_scraper(serializer_path)
+        name = os.path.splitext(os.path.basename(serializer_path))[0]
+        return build(scraper, name, **kwargs)
+
+
+def run_synthetic(
+    chapters: int, images: int, latency: float, **kwargs
+) -> BuildResult:
+    """
+    Build the generated serial.
+    """
+    scraper, corpus = synthetic_book(chapters, images)
+    with offline(corpus, latency):
+        name = f"synthetic-{chapters}x{images}"
+        return build(scraper, name, **kwargs)
+
+
+def report(
+    results: List[BuildResult], baseline: Optional[Dict[str, Dict]] = None
+) -> None:
+    """
+    Print one row per build, with the change from the baseline run (a
+    --json file) in brackets.
+    """
+    baseline = baseline or {}
+    columns = STAGES + ("total",)
+    print(
+        f"{'build':<28}"
+        + "".join(f"{column:>20}" for column in columns)
+        + f"{'chapters':>10}{'images':>8}{'epub MiB':>10}"
+    )
+    for result in results:
+        timings = dict(result.stages, total=result.total)
+        before = baseline.get(result.name, {})
+        if before:
+            # results written before the builds were timed by Scraper.run
+            # have other stages, and no total
+            before = dict(before["stages"], total=before.get("total"))
+        row = f"{result.name:<28}"
+        for column in columns:
+            cell = f"{timings.get(column, 0.0):.3f}s"
+            if before.get(column):
+                change = timings[column] / before[column] - 1
+                cell += f" ({change:+.0%})"
+            row += f"{cell:>20}"
+        row += (
+            f"{result.chapters:>10}{result.images:>8}"
+            f"{result.epub_size / 1024 / 1024:>10.1f}"
+        )
+        print(row)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "serializers",
+        nargs="*",
+        help="paths to serializers/*.py files with a recorded corpus",
+    )
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="also build a generated serial",
+    )
+    parser.add_argument("--chapters", type=int, default=2000)
+    parser.add_argument("--images", type=int, default=300)
+    parser.add_argument("--profile", default="original")
+    parser.add_argument("--image-workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream the chapters into the epub, see Scraper.run",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="seconds the stand-in waits before every response",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument(
+        "--baseline", help="a --json file from an earlier run to compare to"
+    )
+    args = parser.parse_args(argv)
+    configure_logging()
+    if not args.serializers and not args.synthetic:
+        parser.error("give serializers to build, --synthetic, or both")
+
+    options = dict(
+        latency=args.latency,
+        profile=args.profile,
+        image_workers=args.image_workers or 1,
+        stream=args.stream,
+    )
+    results = [
+        run_serializer(serializer_path, **options)
+        for serializer_path in args.serializers
+    ]
+    if args.synthetic:
+        results.append(run_synthetic(args.chapters, args.images, **options))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {result.name: asdict(result) for result in results},
+                f,
+                indent=1,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+A local http stand-in for the blogs, serving a recorded (or synthetic)
+Corpus, and the plumbing to point every Scraper at it.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+from urllib.parse import quote, unquote
+
+from benchmarks.corpus import Corpus
+from blog_to_epub_serializer.cache import DerivedImageCache, ImageStore
+from blog_to_epub_serializer.http_client import HttpClient
+from blog_to_epub_serializer.scheduler import CrawlScheduler, HostPolicy
+from blog_to_epub_serializer.scraper import LOCAL_CACHE, Scraper
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # keep connections alive, like the real blogs
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are separate writes, don't let them wait on
+    # a delayed ack
+    disable_nagle_algorithm = True
+    server: "StandInServer"
+
+    def log_message(self, format, *args) -> None:
+        # one line per request would drown the results
+        pass
+
+    def do_GET(self) -> None:
+        url = unquote(self.path[1:])
+        recorded = self.server.corpus.get(url)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if recorded is None:
+            self.send_error(404, f"{url} was not recorded")
+            return
+        body, content_type = recorded
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Serves a Corpus on localhost.  The original url of a request is the
+    (quoted) path, see `StandInClient`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, corpus: Corpus, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.corpus = corpus
+        # seconds added to every response, to simulate the network
+        self.latency = latency
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StandInServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class StandInClient(HttpClient):
+    """
+    An HttpClient that sends every request to a StandInServer instead of the
+    real host.
+    """
+
+    def __init__(self, server_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.server_url = server_url
+
+    def get(self, url: str, **kwargs):
+        return super().get(
+            f"{self.server_url}/{quote(url, safe='')}", **kwargs
+        )
+
+
+@contextmanager
+def isolated_build(
+    client: HttpClient,
+    corpus: Optional[Corpus] = None,
+    scheduler: Optional[CrawlScheduler] = None,
+) -> Iterator[str]:
+    """
+    Run the block in an empty temporary working directory, so local_cache
+    starts out cold, with every Scraper downloading through the client and
+    storing into fresh image caches.  Everything is restored afterwards.
+
+    :param client: the HttpClient every Scraper should use
+    :param corpus: its local files are written into the directory
+    :param scheduler: the CrawlScheduler every Scraper should use, defaults
+        to a fresh one with Scraper.CRAWL_SCHEDULER's policies
+    :return: the temporary working directory
+    """
+    origin = os.getcwd()
+    saved = {
+        name: vars(Scraper)[name]
+        for name in (
+            "HTTP_CLIENT",
+            "CRAWL_SCHEDULER",
+            "IMAGE_STORE",
+            "DERIVED_IMAGE_CACHE",
+        )
+    }
+    work_dir = tempfile.mkdtemp(prefix="blog-to-epub-bench-")
+    try:
+        os.chdir(work_dir)
+        # like a checkout, where local_cache is tracked
+        os.makedirs(LOCAL_CACHE)
+        for path, content in (corpus.files if corpus else {}).items():
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(content)
+        Scraper.HTTP_CLIENT = client
+        Scraper.CRAWL_SCHEDULER = scheduler or CrawlScheduler(
+            Scraper.CRAWL_SCHEDULER.default, Scraper.CRAWL_SCHEDULER.hosts
+        )
+        Scraper.IMAGE_STORE = ImageStore(f"{LOCAL_CACHE}/images")
+        Scraper.DERIVED_IMAGE_CACHE = DerivedImageCache(
+            f"{LOCAL_CACHE}/derived"
+        )
+        yield work_dir
+    finally:
+        for name, value in saved.items():
+            setattr(Scraper, name, value)
+        client.close()
+        os.chdir(origin)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+@contextmanager
+def offline(corpus: Corpus, latency: float = 0.0) -> Iterator[str]:
+    """
+    An `isolated_build` whose downloads are all served from the corpus.
+
+    :param corpus: the recorded responses
+    :param latency: seconds added to every response
+    :return: the temporary working directory
+    """
+    with StandInServer(corpus, latency) as server:
+        client = StandInClient(
+            server.url, pool_maxsize=Scraper.MAX_REQUESTS_PER_HOST
+        )
+        # the stand-in is not the blogs, only the concurrency is kept
+        scheduler = CrawlScheduler(
+            HostPolicy(rate=None, concurrency=Scraper.MAX_REQUESTS_PER_HOST)
+        )
+        with isolated_build(client, corpus, scheduler) as work_dir:
+            yield work_dir
@@ -0,0 +1,127 @@
+"""
+A generated serial, far bigger than the real ones, to see how the pipeline
+scales: thousands of chapters sharing a few hundred images.
+"""
+import io
+import random
+from typing import Dict, Tuple
+
+from bs4 import BeautifulSoup
+from PIL import Image, ImageDraw
+
+from benchmarks.corpus import Corpus
+from blog_to_epub_serializer.book_utils import Chapter
+from blog_to_epub_serializer.scraper import LOCAL_CACHE, Scraper
+
+BASE_URL = "https://synthetic.example.com"
+
+WORDS = (
+    "the innkeeper opened gate and looked out over sea of wind shore maze "
+    "kingdom 風の海 迷宮の岸 魔性の子 silver ruin pitch black moon"
+).split()
+
+
+class SyntheticScraper(Scraper):
+    SCRAPER_CACHE = f"{LOCAL_CACHE}/synthetic"
+    PARSE_ONLY = {"name": "article"}
+
+    def parse_chapter_text(
+        self, soup: BeautifulSoup, chapter_idx: float
+    ) -> Chapter:
+        article = soup.article
+        chapter_content = article.find(class_="entry-content")
+        local_srcs = []
+        for img in chapter_content.find_all("img"):
+            local_src = self.fetch_and_save_img(img.attrs["src"], chapter_idx)
+            img.attrs["src"] = local_src
+            local_srcs.append(local_src)
+
+        # drop the pager, like the blogspot serializers do
+        chapter_content.find("p", align="center").replace_with("")
+        return Chapter(
+            idx=chapter_idx,
+            title=article.h1.text,
+            html_content=chapter_content,
+            image_paths=local_srcs,
+        )
+
+
+def image_url(index: int) -> str:
+    # every fourth image is a PNG (a map), the rest are JPEGs
+    return f"{BASE_URL}/images/{index}{'.png' if index % 4 == 0 else '.jpg'}"
+
+
+def make_image(rng: random.Random, index: int) -> bytes:
+    """
+    :return: a JPEG or PNG of a few hundred KiB, like a scanned illustration
+        or a map
+    """
+    size = (rng.randint(600, 1600), rng.randint(800, 2200))
+    image = Image.new("RGB", size, (rng.randint(0, 255), 240, 230))
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.randint(0, size[0]), rng.randint(0, size[1])
+        draw.rectangle(
+            (x, y, x + rng.randint(5, 200), y + rng.randint(5, 200)),
+            fill=tuple(rng.randint(0, 255) for _ in range(3)),
+        )
+    b = io.BytesIO()
+    image.save(b, "png" if index % 4 == 0 else "jpeg")
+    return b.getvalue()
+
+
+def make_page(rng: random.Random, key: int, images: int) -> str:
+    paragraphs = "".join(
+        f"<p>{' '.join(rng.choices(WORDS, k=rng.randint(40, 120)))}</p>"
+        for _ in range(rng.randint(10, 30))
+    )
+    imgs = "".join(
+        f'<img src="{image_url(rng.randrange(images))}"/>'
+        for _ in range(rng.choice((0, 0, 1, 2)))
+    )
+    sidebar = "".join(
+        f'<li><a href="{BASE_URL}/chapter-{i}/">Chapter {i}</a></li>'
+        for i in range(max(key - 50, 1), key)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Chapter {key}</title>
+<script>{"var x = 1;" * 200}</script></head>
+<body><nav><ul>{sidebar}</ul></nav>
+<article><h1>Chapter {key}</h1><div class="entry-content">
+{imgs}{paragraphs}
+<p align="center"><a href="{BASE_URL}/chapter-{key + 1}/">Next &gt;&gt;</a></p>
+</div></article>
+<section class="comments">{paragraphs}</section></body></html>"""
+
+
+def synthetic_book(
+    chapters: int = 2000, images: int = 300, seed: int = 0
+) -> Tuple[SyntheticScraper, Corpus]:
+    """
+    :param chapters: how many chapters the serial has
+    :param images: how many distinct images they share
+    :param seed: the same seed always generates the same book
+    :return: the scraper for the book, and the corpus to serve it from
+    """
+    rng = random.Random(seed)
+    corpus = Corpus()
+    for index in range(images):
+        body = make_image(rng, index)
+        content_type = "image/png" if index % 4 == 0 else "image/jpeg"
+        corpus.add(image_url(index), body, content_type)
+
+    blog_map: Dict[float, str] = {}
+    for key in range(1, chapters + 1):
+        url = f"{BASE_URL}/chapter-{key}/"
+        blog_map[float(key)] = url
+        page = make_page(rng, key, images)
+        corpus.add(url, page.encode("utf-8"), "text/html; charset=utf-8")
+
+    scraper = SyntheticScraper(
+        title="Synthetic Serial",
+        author="Benchmark",
+        blog_map=blog_map,
+        epub_name="Synthetic Serial.epub",
+        cover_img_path=None,
+    )
+    return scraper, corpus
@@ -0,0 +1,5 @@
+import sys
+
+from blog_to_epub_serializer.cli import main
+
+sys.exit(main())
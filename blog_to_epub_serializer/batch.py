@@ -0,0 +1,209 @@
+"""
+Build many serializers in one process.
+
+The books share the HTTP_CLIENT, the image store and derived image cache
+(shared by every Scraper already), one thread pool that fetches and parses
+the chapters of every book and one process pool that transcodes their
+images.  Books are built concurrently, except for books that would write to
+the same cache directory or epub, which are built one after the other.
+
+Usage:
+    python -m blog_to_epub_serializer.batch serializers/*.py
+    python -m blog_to_epub_serializer.batch serializers/*.py --books 2 \
+        --profile e-ink --stream
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Type, Union
+
+from blog_to_epub_serializer.cli import build_serializers, configure_logging
+from blog_to_epub_serializer.image_utils import ImageProfile
+from blog_to_epub_serializer.metrics import BuildMetrics
+from blog_to_epub_serializer.registry import Serializer, load_serializer
+from blog_to_epub_serializer.scraper import LOCAL_CACHE, Scraper
+
+logger = logging.getLogger("batch")
+
+# books built at the same time by `build_all`
+BATCH_BOOKS = 4
+
+# a book `build_all` can build: a Scraper, or a registered Serializer whose
+# Scraper is only created (and its cover downloaded) when the book is built
+Buildable = Union[Scraper, Serializer]
+
+
+def _scraper_class(book: Buildable) -> Type[Scraper]:
+    """
+    :param book: a book to build
+    :return: the Scraper subclass that builds it
+    """
+    if isinstance(book, Serializer):
+        return book.scraper_class
+    return type(book)
+
+
+def _conflict_groups(books: Iterable[Buildable]) -> List[List[Buildable]]:
+    """
+    Group the books that must not be built at the same time: the ones whose
+    scrapers share a SCRAPER_CACHE (pages and parsed chapters are cached
+    there by chapter number) or an epub.
+
+    :param books: the books to build
+    :return: the groups, each built one book after the other
+    """
+    groups: List[List[Buildable]] = []
+    # SCRAPER_CACHE or epub path -> the group using it
+    owners: Dict[str, List[Buildable]] = {}
+    for book in books:
+        resources = (
+            os.path.abspath(_scraper_class(book).SCRAPER_CACHE),
+            os.path.abspath(f"{LOCAL_CACHE}/{book.epub_name}"),
+        )
+        group = next((owners[r] for r in resources if r in owners), None)
+        if group is None:
+            group = []
+            groups.append(group)
+        group.append(book)
+        for resource in resources:
+            owners[resource] = group
+    return groups
+
+
+def build_all(
+    books_to_build: Iterable[Buildable],
+    books: int = BATCH_BOOKS,
+    use_cache: bool = True,
+    workers: Optional[int] = None,
+    image_workers: Optional[int] = None,
+    profile: Union[str, ImageProfile, None] = None,
+    stream: bool = False,
+    discover: bool = False,
+    update: bool = False,
+) -> Dict[str, Union[BuildMetrics, Exception]]:
+    """
+    Build every book's epub, up to `books` at the same time, on shared
+    worker pools.  A book that fails (including downloading the cover of a
+    Serializer) is logged and does not stop the others.
+
+    The http and derived image cache stats in each book's metrics are
+    process wide, so they include the books built alongside it.
+
+    :param books_to_build: the scrapers, or serializers, to build
+    :param books: how many books to build at the same time
+    :param use_cache: whether to use locally downloaded files
+    :param workers: how many chapters (of any book) to fetch and parse at
+        the same time.  Defaults to FETCH_WORKERS per concurrent book.
+    :param image_workers: how many processes transcode images for all the
+        books.  Defaults to IMAGE_WORKERS, or one per cpu.
+    :param profile: the output profile for the images, defaults to each
+        scraper's IMAGE_PROFILE
+    :param stream: write each chapter into its epub as soon as it is parsed
+    :param discover: look for new chapters of each serial first
+    :param update: only add the new chapters to the epubs built before
+    :return: epub name -> the build's metrics, or the exception it raised
+    """
+    books_to_build = list(books_to_build)
+    scraper_classes = [_scraper_class(book) for book in books_to_build]
+    if not scraper_classes:
+        return {}
+    groups = _conflict_groups(books_to_build)
+    books = max(1, min(books, len(groups)))
+    workers = workers or books * max(c.FETCH_WORKERS for c in scraper_classes)
+    image_workers = (
+        image_workers
+        or max(c.IMAGE_WORKERS or 0 for c in scraper_classes)
+        or os.cpu_count()
+        or 1
+    )
+    results: Dict[str, Union[BuildMetrics, Exception]] = {}
+
+    def build_group(group: List[Buildable]) -> None:
+        for book in group:
+            try:
+                scraper = book
+                if isinstance(book, Serializer):
+                    scraper = book.scraper()
+                results[book.epub_name] = scraper.run(
+                    use_cache=use_cache,
+                    image_workers=image_workers,
+                    profile=profile,
+                    stream=stream,
+                    discover=discover,
+                    update=update,
+                    fetch_executor=fetch_executor,
+                    image_executor=image_executor,
+                )
+            except Exception as e:
+                logger.exception(f"Could not build {book.epub_name}")
+                results[book.epub_name] = e
+
+    image_executor = None
+    if image_workers > 1:
+        image_executor = ProcessPoolExecutor(image_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as fetch_executor:
+            with ThreadPoolExecutor(max_workers=books) as book_executor:
+                # list() re-raises anything build_group did not catch
+                list(book_executor.map(build_group, groups))
+    finally:
+        if image_executor is not None:
+            image_executor.shutdown()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "serializers", nargs="+", help="paths to serializers/*.py files"
+    )
+    parser.add_argument(
+        "--books",
+        type=int,
+        default=BATCH_BOOKS,
+        help="how many books to build at the same time",
+    )
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--image-workers", type=int)
+    parser.add_argument("--profile")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument(
+        "--discover",
+        action="store_true",
+        help="look for chapters published since the last build",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="only add the new chapters to an epub built before",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="download every page and image again",
+    )
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    serializers = [
+        serializer
+        for serializer_path in args.serializers
+        for serializer in load_serializer(serializer_path)
+    ]
+    return build_serializers(
+        serializers,
+        books=args.books,
+        use_cache=not args.no_cache,
+        workers=args.workers,
+        image_workers=args.image_workers,
+        profile=args.profile,
+        stream=args.stream,
+        discover=args.discover,
+        update=args.update,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,45 +1,188 @@
-import io
-from dataclasses import dataclass
-from typing import List, Optional, Union
+import os
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import (
+    TYPE_CHECKING,
+    AbstractSet,
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Type,
+    Union,
+)
+
+from blog_to_epub_serializer import metrics
+from blog_to_epub_serializer.cache import DerivedImageCache
+from blog_to_epub_serializer.image_utils import (
+    MEDIA_TYPE_EXTENSIONS,
+    ImageProfile,
+    PreparedImage,
+    get_profile,
+    open_file,
+    prepare_images,
+    read_file,
+)
+
+# ebooklib and bs4 are only imported once a Book is built, so serializers
+# (and the registry listing them) can import Chapter cheaply
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+    from bs4.element import Tag
+    from ebooklib import epub
+
+    from blog_to_epub_serializer.contents import ChapterEntry
+    from blog_to_epub_serializer.epub_writer import (
+        FileItem,
+        StreamingEpubWriter,
+    )
+
+
+def image_uid(image_path: str) -> str:
+    """
+    :param image_path: the local path of an image
+    :return: the id of the image in the epub.  Stored images are named by
+        their content hash, so this is unique per distinct image.
+    """
+    return "img_" + os.path.splitext(os.path.basename(image_path))[0]
 
-from PIL import Image
-from bs4 import BeautifulSoup
-from bs4.element import Tag
-from ebooklib import epub
 
-
-@dataclass
 class Chapter:
-    idx: float
-    title: str
-    html_content: Union[BeautifulSoup, Tag, str]
-    image_paths: Optional[List[str]] = None
-    no_title_header: bool = False
-    add_to_table_of_contents: bool = True
+    """
+    A chapter of the Book.  The html is rendered to a string once, when the
+    chapter is created, so the soup it came from (and the whole page it
+    belongs to) can be freed; only what the epub needs is kept.
+    """
+
+    __slots__ = (
+        "idx",
+        "title",
+        "image_paths",
+        "no_title_header",
+        "add_to_table_of_contents",
+        "_html",
+        "_echapter",
+        "_eimgs",
+    )
+
+    def __init__(
+        self,
+        idx: float,
+        title: str,
+        html_content: Union["BeautifulSoup", "Tag", str],
+        image_paths: Optional[List[str]] = None,
+        no_title_header: bool = False,
+        add_to_table_of_contents: bool = True,
+    ):
+        self.idx = idx
+        self.title = title
+        self.image_paths = image_paths
+        self.no_title_header = no_title_header
+        self.add_to_table_of_contents = add_to_table_of_contents
+        self._html = str(html_content)
+        self._create_echapter()
+        # the images are encoded when first needed, which lets a Book encode
+        # the images of all its chapters at once
+        self._eimgs: Optional[List["epub.EpubItem"]] = None
 
-    # should not be set by the user directly
-    _echapter: Optional[epub.EpubHtml] = None
-    _eimgs: Optional[List[epub.EpubItem]] = None
+    def __repr__(self) -> str:
+        return f"Chapter(idx={self.idx!r}, title={self.title!r})"
 
-    def __post_init__(self):
+    @property
+    def html_content(self) -> str:
         """
-        Runs after the initializer.  Will create the chapter itself to be
-        used in the Book
+        The rendered html of the chapter, without the title header
         """
-        self._create_echapter()
-        self._eimgs = []
-        if self.image_paths:
-            for image_path in self.image_paths:
-                self._create_eimg(image_path)
+        return self._html
+
+    @html_content.setter
+    def html_content(self, value: Union["BeautifulSoup", "Tag", str]) -> None:
+        self._html = str(value)
+
+    @property
+    def document(self) -> str:
+        """
+        The content of the chapter's epub document: the title header (unless
+        no_title_header) and the html
+        """
+        if self.no_title_header:
+            return f"<div>{self._html}</div>"
+        return f"<h1>{self.title}</h1>{self._html}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        The chapter as a json serializable dict.  Used to cache parsed
+        chapters.
+
+        :return: the public fields of the chapter
+        """
+        return {
+            "idx": self.idx,
+            "title": self.title,
+            "html_content": self._html,
+            "image_paths": self.image_paths,
+            "no_title_header": self.no_title_header,
+            "add_to_table_of_contents": self.add_to_table_of_contents,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Chapter":
+        """
+        :param data: a dict created by `to_dict`
+        :return: the chapter it describes
+        """
+        return cls(**data)
 
     @property
-    def echapter(self) -> Optional[epub.EpubHtml]:
+    def echapter(self) -> Optional["epub.EpubHtml"]:
         return self._echapter
 
     @property
-    def eimgs(self) -> Optional[epub.EpubItem]:
+    def eimgs(self) -> Optional[List["epub.EpubItem"]]:
+        if self._eimgs is None:
+            self.create_eimgs()
         return self._eimgs
 
+    def create_eimgs(
+        self,
+        items: Optional[Dict[str, "epub.EpubItem"]] = None,
+        skip: AbstractSet[str] = frozenset(),
+    ) -> None:
+        """
+        Creates the ebook version of every image of the chapter.
+
+        :param items: the epub items the Book prepared for the images, any
+            image missing from it is loaded and encoded here
+        :param skip: images the Book already holds, they are left out
+        """
+        items = items or {}
+        self._eimgs = []
+        if self.image_paths:
+            # the same image may appear more than once in a chapter
+            for image_path in dict.fromkeys(self.image_paths):
+                if image_path in skip:
+                    continue
+                if image_path in items:
+                    self._eimgs.append(items[image_path])
+                else:
+                    self._create_eimg(image_path)
+
+    def release(self) -> None:
+        """
+        Drop the html and the image bytes once the chapter has been written
+        to the epub.  Only what the book's spine and table of contents need
+        is kept.
+        """
+        self._html = ""
+        for eimg in self._eimgs or []:
+            eimg.content = b""
+
     @property
     def xhtml(self) -> str:
         """
@@ -61,40 +204,35 @@ class Chapter:
 
     def _create_echapter(self) -> None:
         """
-        Adds title to the beginning of the html, and then the html content
+        Creates the epub document of the chapter, see `document`
         """
-        ch = epub.EpubHtml(title=self.title, file_name=self.xhtml)
-        if self.no_title_header:
-            ch.content = f"<div>{self.html_content}</div>"
-        else:
-            ch.content = f"<h1>{self.title}</h1>{self.html_content}"
-        self._echapter = ch
+        from blog_to_epub_serializer.epub_writer import ChapterHtml
+
+        self._echapter = ChapterHtml(
+            self, title=self.title, file_name=self.xhtml
+        )
 
     def _create_eimg(self, image_path: str) -> None:
         """
-        Creates the ebook version of an image by loading it into binary, then
-        appends an epub image to the attributes list.
+        Creates the ebook version of an image, then appends it to the
+        attributes list.  Images already in a format epub readers support
+        are embedded without being re-encoded, and only read from disk when
+        the epub is written.
 
         :param image_path:  the local path to the image
         """
-        raw_img = Image.open(image_path)
-        b = io.BytesIO()
-        raw_img.save(b, "jpeg")
-        bin_img = b.getvalue()
-
-        uid = (
-            image_path.split("/")[0].split(".")[0]
-            if "/" in image_path
-            else image_path.split(".")[0]
-        )
-        self._eimgs.append(
-            epub.EpubItem(
-                uid=uid,
-                file_name=image_path,
-                media_type="image/jpeg",
-                content=bin_img,
-            )
+        from blog_to_epub_serializer.epub_writer import FileItem
+
+        prepared = prepare_images([image_path])[image_path]
+        item = FileItem(
+            image_path,
+            uid=image_uid(image_path),
+            file_name=image_path,
+            media_type=prepared.media_type,
         )
+        if prepared.content is not None:
+            item.content = prepared.content
+        self._eimgs.append(item)
 
 
 @dataclass
@@ -104,22 +242,46 @@ class Book:
     cover_img_path: Optional[str] = ""
     language: str = "en"
     chapters: Optional[List[Chapter]] = None
+    # processes used to transcode the chapter images, 1 keeps it all on the
+    # calling thread
+    image_workers: int = 1
+    # an ImageProfile, or the name of one of image_utils.PROFILES ("original",
+    # "tablet", "e-ink"), applied to the chapter images and the cover
+    image_profile: Union[str, ImageProfile, None] = None
+    # where transcoded images are kept between builds, if anywhere
+    image_cache: Optional[DerivedImageCache] = None
+    # loads the raw bytes of an image path (the cover and the chapters'
+    # image_paths), e.g. the `read` of the image store they came from
+    read_image: Callable[[str], bytes] = read_file
+    # opens an image path for reading, used to copy the images into the epub
+    # when it is written, e.g. the `open` of the image store
+    open_image: Callable[[str], BinaryIO] = open_file
+    # a process pool shared with other books to transcode the images on,
+    # instead of one started for this book.  It is not shut down by the book.
+    image_executor: Optional[Executor] = None
 
     # should not be set by the user directly
-    _ebook: Optional[epub.EpubBook] = None
+    _ebook: Optional["epub.EpubBook"] = None
+    # file names of the images already added to the ebook
+    _image_names: Set[str] = field(default_factory=set)
+    # only set while streaming, see `stream_to`
+    _writer: Optional["StreamingEpubWriter"] = None
+    _executor: Optional[Executor] = None
 
     def __post_init__(self) -> None:
         """
         Runs after the initializer.  Will create the bones of the book
         and add all the chapters.
         """
+        self.image_profile = get_profile(self.image_profile)
         self._create_ebook()
         if self.chapters:
+            self._encode_chapter_images(self.chapters)
             for chapter in self.chapters:
                 self._add_chapter_to_ebook(chapter)
 
     @property
-    def ebook(self) -> Optional[epub.EpubBook]:
+    def ebook(self) -> Optional["epub.EpubBook"]:
         return self._ebook
 
     def _create_ebook(self) -> None:
@@ -127,6 +289,8 @@ class Book:
         Sets up the basic metadata of the book. Including the title, author
         and cover. It also creates an empty (to be filled) table of contents.
         """
+        from ebooklib import epub
+
         self._ebook = epub.EpubBook()
         self._ebook.set_title(self.title)
         self._ebook.set_language(self.language)
@@ -138,12 +302,26 @@ class Book:
         self._ebook.toc = []
 
     def _add_cover(self):
-        # sets the cover when closed/on hover
-        self._ebook.set_cover(
-            "image.jpg",
-            open(self.cover_img_path, "rb").read(),
-            # setting to False here to manually add the page
-            create_page=False,
+        from ebooklib import epub
+
+        from blog_to_epub_serializer.epub_writer import FileCover
+
+        prepared = self._prepare_images([self.cover_img_path])[
+            self.cover_img_path
+        ]
+
+        # sets the cover when closed/on hover, like EpubBook.set_cover but
+        # without loading the image.  The page is added manually below.
+        self._ebook.add_item(
+            self._image_item(
+                self.cover_img_path,
+                prepared,
+                FileCover,
+                file_name=f"image{MEDIA_TYPE_EXTENSIONS[prepared.media_type]}",
+            )
+        )
+        self._ebook.add_metadata(
+            None, "meta", "", {"name": "cover", "content": "cover-img"}
         )
 
         # create the cover html manually, so we can change the linear value
@@ -156,23 +334,146 @@ class Book:
         cover_html.is_linear = True
 
         # and then manually add the image for the html page
-        raw_img = Image.open(self.cover_img_path)
-        b = io.BytesIO()
-        raw_img.save(b, "jpeg")
-        bin_img = b.getvalue()
-        img_item = epub.EpubItem(
+        img_item = self._image_item(
+            self.cover_img_path,
+            prepared,
             uid="cover_image",
             file_name=self.cover_img_path,
-            media_type="image/jpeg",
-            content=bin_img,
+            media_type=prepared.media_type,
         )
 
         # finally add them to the book and the cover page to the spine
         self._ebook.add_item(cover_html)
         self._ebook.add_item(img_item)
+        self._image_names.add(img_item.file_name)
         self._ebook.spine.append("cover")
 
+    def _encode_chapter_images(self, chapters: List[Chapter]) -> None:
+        """
+        Prepares the images of all the chapters together, so the ones that
+        need transcoding can be spread over image_workers processes.
+
+        :param chapters: the chapters whose images should be encoded
+        """
+        prepared = self._prepare_images(
+            image_path
+            for chapter in chapters
+            for image_path in chapter.image_paths or []
+            if image_path not in self._image_names
+        )
+        items = {
+            image_path: self._image_item(
+                image_path,
+                image,
+                uid=image_uid(image_path),
+                file_name=image_path,
+                media_type=image.media_type,
+            )
+            for image_path, image in prepared.items()
+        }
+        for chapter in chapters:
+            chapter.create_eimgs(items, skip=self._image_names)
+
+    def _prepare_images(
+        self, image_paths: Iterable[str]
+    ) -> Dict[str, PreparedImage]:
+        """
+        Prepares images with this book's profile, workers and cache.
+
+        :param image_paths: the local paths of the images
+        :return: how to embed each path
+        """
+        with metrics.timed("image_encode"):
+            return prepare_images(
+                image_paths,
+                workers=self.image_workers,
+                profile=self.image_profile,
+                cache=self.image_cache,
+                executor=self._executor or self.image_executor,
+                read=self.read_image,
+                open_image=self.open_image,
+            )
+
+    def _image_item(
+        self,
+        image_path: str,
+        prepared: PreparedImage,
+        item_class: Optional[Type["FileItem"]] = None,
+        **kwargs,
+    ) -> "FileItem":
+        """
+        The epub item of a prepared image.  Its bytes are only read (from
+        the derived image cache, or with open_image) when the epub is
+        written.
+
+        :param image_path: the local path of the image
+        :param prepared: how to embed it
+        :param item_class: FileItem (the default), or a subclass of it
+        :param kwargs: the item's arguments, e.g. uid and file_name
+        :return: the item
+        """
+        if item_class is None:
+            from blog_to_epub_serializer.epub_writer import FileItem
+
+            item_class = FileItem
+        if prepared.derived_path is not None:
+            item = item_class(prepared.derived_path, **kwargs)
+        else:
+            item = item_class(image_path, self.open_image, **kwargs)
+        if prepared.content is not None:
+            # transcoded without a cache to keep it in
+            item.content = prepared.content
+        return item
+
+    @contextmanager
+    def stream_to(self, file_name: str) -> Iterator["Book"]:
+        """
+        Write the book to an epub as it is being built.  Every chapter given
+        to `add_chapter` inside the block is written straight away and its
+        html and images are released; the table of contents is written when
+        the block exits.  If the block raises, the partial file is removed.
+
+        :param file_name: the epub to create
+        :return: this book
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        from blog_to_epub_serializer.epub_writer import StreamingEpubWriter
+
+        self._writer = StreamingEpubWriter(file_name, self.ebook)
+        if self.image_executor is None and self.image_workers > 1:
+            # one pool for the whole book, rather than one per chapter
+            self._executor = ProcessPoolExecutor(self.image_workers)
+        try:
+            self._writer.open()
+            self._flush_chapters(self.chapters or [])
+            yield self
+            self.finish_book()
+            with metrics.timed("write_epub"):
+                self._writer.close()
+        except BaseException:
+            self._writer.abort()
+            raise
+        finally:
+            self._writer = None
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _flush_chapters(self, chapters: List[Chapter]) -> None:
+        """
+        Write everything added to the ebook so far and release the chapters.
+
+        :param chapters: the chapters that were just written
+        """
+        with metrics.timed("write_epub"):
+            self._writer.flush()
+        for chapter in chapters:
+            chapter.release()
+
     def finish_book(self):
+        from ebooklib import epub
+
         # add default NCX and Nav file
         self.ebook.add_item(epub.EpubNcx())
         self.ebook.add_item(epub.EpubNav())
@@ -200,7 +501,61 @@ class Book:
         if not self.chapters:
             self.chapters = []
         self.chapters.append(chapter)
+        self._encode_chapter_images([chapter])
         self._add_chapter_to_ebook(chapter)
+        if self._writer is not None:
+            self._flush_chapters([chapter])
+
+    def add_chapters(self, chapters: List[Chapter]) -> None:
+        """
+        Add several chapters at once, in order.  Their images are encoded
+        together, so transcoding can use all the image_workers.
+
+        :param chapters: The chapters to be added
+        """
+        if not self.chapters:
+            self.chapters = []
+        self.chapters.extend(chapters)
+        self._encode_chapter_images(chapters)
+        for chapter in chapters:
+            self._add_chapter_to_ebook(chapter)
+        if self._writer is not None:
+            self._flush_chapters(chapters)
+
+    def add_previous_chapters(self, entries: Iterable["ChapterEntry"]) -> None:
+        """
+        Add the chapters of an earlier epub of this book, ahead of the new
+        ones.  Only their manifest items and table of contents entries are
+        created, without any content: the book must be written with
+        `epub_writer.update_epub`, which copies them from the earlier epub.
+
+        :param entries: the chapters, from the earlier epub's BookContents
+        """
+        from ebooklib import epub
+
+        from blog_to_epub_serializer.epub_writer import RELEASED_DOCUMENT
+
+        for entry in entries:
+            document = epub.EpubHtml(
+                title=entry.title,
+                file_name=entry.file_name,
+                content=RELEASED_DOCUMENT,
+            )
+            self.ebook.add_item(document)
+            self.ebook.spine.append(document)
+            if entry.add_to_table_of_contents:
+                self.ebook.toc.append(document)
+            for image in entry.images:
+                if image.file_name in self._image_names:
+                    continue
+                self._image_names.add(image.file_name)
+                self.ebook.add_item(
+                    epub.EpubItem(
+                        uid=image.uid,
+                        file_name=image.file_name,
+                        media_type=image.media_type,
+                    )
+                )
 
     def _add_chapter_to_ebook(self, chapter: Chapter) -> None:
         """
@@ -216,4 +571,8 @@ class Book:
             self.ebook.toc.append(chapter.echapter)
 
         for ch_eimg in chapter.eimgs:
+            # images shared between chapters are only added once
+            if ch_eimg.file_name in self._image_names:
+                continue
+            self._image_names.add(ch_eimg.file_name)
             self.ebook.add_item(ch_eimg)
@@ -0,0 +1,618 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from functools import partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Optional,
+    Tuple,
+)
+from urllib.parse import urlparse
+
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger("cache")
+
+
+@dataclass
+class Validators:
+    """
+    The http validators of a cached response, stored in a json file next to
+    the cached page (images keep theirs in the ImageStore index).  Used to
+    ask the server whether the cached copy is still current instead of
+    downloading it again.
+    """
+
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # unix timestamp of the last time the server confirmed this copy
+    fetched_at: float = 0.0
+    # the charset the server declared for the response, if any.  Pages are
+    # cached as the bytes they were sent as, this is how to decode them.
+    encoding: Optional[str] = None
+
+    @staticmethod
+    def path_for(cached_path: str) -> str:
+        """
+        The location of the validators file for a cached file.
+
+        :param cached_path: the local path of the cached page or image
+        :return: the path of its validators file
+        """
+        return f"{cached_path}.meta.json"
+
+    @classmethod
+    def from_response(cls, response: "requests.Response") -> "Validators":
+        """
+        Pull the validators out of a fresh response.
+
+        :param response: the 200 response that was just cached
+        :return: the validators to save next to it
+        """
+        return cls(
+            url=response.url,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            fetched_at=time.time(),
+            encoding=declared_charset(response),
+        )
+
+    @classmethod
+    def load(cls, cached_path: str) -> Optional["Validators"]:
+        """
+        Read the validators stored for a cached file.
+
+        :param cached_path: the local path of the cached page or image
+        :return: the validators, or None if there are none stored
+        """
+        try:
+            with open(cls.path_for(cached_path), "r") as f:
+                return cls(**json.load(f))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+    def save(self, cached_path: str) -> None:
+        """
+        Store the validators next to the cached file.
+
+        :param cached_path: the local path of the cached page or image
+        """
+        with open(self.path_for(cached_path), "w") as f:
+            json.dump(asdict(self), f)
+
+    def touch(self, cached_path: str) -> None:
+        """
+        Record that the server just confirmed the cached copy (a 304).
+
+        :param cached_path: the local path of the cached page or image
+        """
+        self.fetched_at = time.time()
+        self.save(cached_path)
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """
+        :return: the request headers asking for the resource only if it
+            changed since it was cached
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def is_stale(self, max_age: Optional[float]) -> bool:
+        """
+        :param max_age: seconds a cached copy is trusted for.  None means it
+            is trusted forever.
+        :return: True if the copy was confirmed longer than max_age ago
+        """
+        if max_age is None:
+            return False
+        return time.time() - self.fetched_at >= max_age
+
+
+def declared_charset(response: "requests.Response") -> Optional[str]:
+    """
+    The charset parameter of the response's Content-Type.  Unlike
+    `response.encoding` this is None when the server did not send one,
+    rather than the ISO-8859-1 default http gives text, so the parser can
+    look for a <meta charset> instead.
+
+    :param response: the response
+    :return: the declared charset, or None
+    """
+    content_type = response.headers.get("Content-Type", "")
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            return value.strip().strip("'\"") or None
+    return None
+
+
+def is_stale(cached_path: str, max_age: Optional[float]) -> bool:
+    """
+    Whether a cached file should be revalidated with the server.
+
+    :param cached_path: the local path of the cached page or image
+    :param max_age: seconds a cached copy is trusted for.  None means it is
+        trusted forever.
+    :return: True if the cached copy is older than max_age
+    """
+    if max_age is None or not os.path.isfile(cached_path):
+        return False
+    validators = Validators.load(cached_path) or Validators(url="")
+    return validators.is_stale(max_age)
+
+
+class PageStore:
+    """
+    The cached html of a Scraper's chapters, one soup_{key}.html file per
+    chapter with its Validators next to it.  Pages are kept as the bytes the
+    server sent, the Validators record their charset.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, key: float) -> str:
+        """
+        :param key: the chapter number the page represents
+        :return: the local path the page is cached at
+        """
+        return f"{self.directory}/soup_{key}.html"
+
+    def read(self, key: float) -> bytes:
+        """
+        :param key: the chapter number the page represents
+        :return: the cached html, undecoded
+        :raises FileNotFoundError: if the page is not cached
+        """
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def exists(self, key: float) -> bool:
+        """
+        :param key: the chapter number the page represents
+        :return: True if the page is cached, with or without validators
+        """
+        return os.path.isfile(self.path(key))
+
+    def validators(self, key: float) -> Optional[Validators]:
+        """
+        :param key: the chapter number the page represents
+        :return: the http validators the page was cached with
+        """
+        return Validators.load(self.path(key))
+
+    def is_stale(self, key: float, max_age: Optional[float]) -> bool:
+        """
+        :param key: the chapter number the page represents
+        :param max_age: seconds a cached page is trusted for
+        :return: True if the page is cached and older than max_age
+        """
+        return is_stale(self.path(key), max_age)
+
+    def write(
+        self, url: str, key: float, html: bytes, validators: Validators
+    ) -> None:
+        """
+        Cache a freshly downloaded page.
+
+        :param url: the url the page was downloaded from
+        :param key: the chapter number the page represents
+        :param html: the page, as sent by the server
+        :param validators: the http validators of the response
+        """
+        # confirm the directory exists, creating any intermediates required
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+            logger.info(f"Created directory path {self.directory}")
+        with open(self.path(key), "wb") as f:
+            f.write(html)
+        validators.save(self.path(key))
+
+    def touch(self, key: float) -> None:
+        """
+        Record that the server just confirmed the cached page (a 304).
+
+        :param key: the chapter number the page represents
+        """
+        validators = self.validators(key)
+        if validators is not None:
+            validators.touch(self.path(key))
+
+
+class ImageStore:
+    """
+    Content addressed storage for downloaded images, shared by every Scraper.
+
+    Each distinct image is stored once, named by the sha256 of its bytes,
+    no matter how many urls, chapters or books reference it.  An append only
+    index maps each url (and its http validators) to the stored file.
+    """
+
+    INDEX_NAME = "index.jsonl"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._index: Optional[Dict[str, Dict]] = None
+        self._lock = threading.Lock()
+        self._url_locks: Dict[str, threading.Lock] = {}
+
+    @property
+    def index_path(self) -> str:
+        return f"{self.directory}/{self.INDEX_NAME}"
+
+    @property
+    def index(self) -> Dict[str, Dict]:
+        """
+        The url -> stored image index, read from disk on first use.  Later
+        lines win, so updating an entry is just appending it again.
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = {}
+                if os.path.isfile(self.index_path):
+                    with open(self.index_path, "r") as f:
+                        for line in f:
+                            try:
+                                entry = json.loads(line)
+                            except ValueError:
+                                # a partially written last line, ignore it
+                                continue
+                            self._index[entry["url"]] = entry
+            return self._index
+
+    def url_lock(self, url: str) -> threading.Lock:
+        """
+        A lock per url, so concurrent chapters referencing the same image
+        only download it once.
+
+        :param url: the image url
+        :return: the lock guarding that url
+        """
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def lookup(self, url: str) -> Optional[str]:
+        """
+        :param url: the image url
+        :return: the local path of the stored image, or None if the url was
+            never stored (or its file has since been deleted)
+        """
+        entry = self.index.get(url)
+        if entry and os.path.isfile(entry["path"]):
+            return entry["path"]
+        return None
+
+    def validators(self, url: str) -> Optional[Validators]:
+        """
+        :param url: the image url
+        :return: the http validators the image was stored with
+        """
+        entry = self.index.get(url)
+        if not entry:
+            return None
+        return Validators(
+            url=url,
+            etag=entry.get("etag"),
+            last_modified=entry.get("last_modified"),
+            fetched_at=entry.get("fetched_at", 0.0),
+        )
+
+    def blob_path(self, digest: str, url: str) -> str:
+        """
+        :param digest: the sha256 hex digest of the image bytes
+        :param url: the image url, only used for the file extension
+        :return: the path the image with that digest is stored at
+        """
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        return f"{self.directory}/{digest[:2]}/{digest}{ext}"
+
+    def put(
+        self, url: str, content: bytes, validators: Optional[Validators]
+    ) -> str:
+        """
+        Store the image bytes (if no identical image is stored yet) and
+        point the url at them.
+
+        :param url: the url the image was downloaded from
+        :param content: the image bytes
+        :param validators: the http validators of the response, if any
+        :return: the local path of the stored image
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest, url)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temp name first so a crash never leaves a
+            # truncated image behind under its final name
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        else:
+            logger.info(f"{url} is identical to the stored {path}")
+        self._point(url, path, digest, validators)
+        return path
+
+    def put_file(
+        self, url: str, tmp_path: str, validators: Optional[Validators]
+    ) -> str:
+        """
+        Store a fully downloaded temp file, moving it into place rather than
+        copying it.  Point the url at it.
+
+        :param url: the url the image was downloaded from
+        :param tmp_path: the downloaded file, inside `directory` so it can be
+            renamed atomically.  It no longer exists afterwards.
+        :param validators: the http validators of the response, if any
+        :return: the local path of the stored image
+        """
+        digest = hashlib.sha256()
+        with open(tmp_path, "rb") as f:
+            for chunk in iter(partial(f.read, 1024 * 1024), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+
+        path = self.blob_path(digest, url)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        else:
+            logger.info(f"{url} is identical to the stored {path}")
+            os.remove(tmp_path)
+        self._point(url, path, digest, validators)
+        return path
+
+    def _point(
+        self,
+        url: str,
+        path: str,
+        digest: str,
+        validators: Optional[Validators],
+    ) -> None:
+        """
+        Record in the index that the url is stored at path.
+        """
+        validators = validators or Validators(url=url, fetched_at=time.time())
+        self._write_entry(
+            {
+                "url": url,
+                "path": path,
+                "sha256": digest,
+                "etag": validators.etag,
+                "last_modified": validators.last_modified,
+                "fetched_at": validators.fetched_at,
+            }
+        )
+
+    def touch(self, url: str) -> None:
+        """
+        Record that the server just confirmed the stored image (a 304).
+
+        :param url: the image url
+        """
+        entry = dict(self.index[url])
+        entry["fetched_at"] = time.time()
+        self._write_entry(entry)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        """
+        :param path: a path returned by `put` or `lookup`
+        :return: True if the image is still stored
+        """
+        return os.path.isfile(path)
+
+    @staticmethod
+    def read(path: str) -> bytes:
+        """
+        :param path: a path returned by `put` or `lookup`
+        :return: the image bytes
+        """
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def open(path: str) -> BinaryIO:
+        """
+        :param path: a path returned by `put` or `lookup`
+        :return: the image, opened for reading in binary
+        """
+        return open(path, "rb")
+
+    def _write_entry(self, entry: Dict) -> None:
+        index = self.index
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            index[entry["url"]] = entry
+
+
+class DerivedImageCache:
+    """
+    Persistent cache of transcoded images.  Entries are keyed by the sha256
+    of the source image plus every setting that changes the output (the
+    image profile), so a rebuild only transcodes images that are new or
+    whose settings changed.
+    """
+
+    # bump when the transcoding code changes its output
+    VERSION = 1
+
+    EXTENSION_MEDIA_TYPES = {
+        ".jpg": "image/jpeg",
+        ".png": "image/png",
+        ".gif": "image/gif",
+        ".svg": "image/svg+xml",
+    }
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, source_digest: str, settings: str) -> str:
+        """
+        :param source_digest: the sha256 hex digest of the source image
+        :param settings: a description of every setting the output depends
+            on (format, quality, size...)
+        :return: the cache key of the transcoded image
+        """
+        return hashlib.sha256(
+            f"{self.VERSION}:{source_digest}:{settings}".encode()
+        ).hexdigest()
+
+    def locate(
+        self, source_digest: str, settings: str
+    ) -> Optional[Tuple[str, str]]:
+        """
+        :param source_digest: the sha256 hex digest of the source image
+        :param settings: the transcoding settings
+        :return: the path of the cached image and its media type, or None
+            on a miss
+        """
+        key = self.key(source_digest, settings)
+        for ext, media_type in self.EXTENSION_MEDIA_TYPES.items():
+            path = f"{self.directory}/{key[:2]}/{key}{ext}"
+            if os.path.isfile(path):
+                with self._lock:
+                    self.hits += 1
+                return path, media_type
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(
+        self,
+        source_digest: str,
+        settings: str,
+        content: bytes,
+        media_type: str,
+    ) -> str:
+        """
+        Store a transcoded image.
+
+        :param source_digest: the sha256 hex digest of the source image
+        :param settings: the transcoding settings
+        :param content: the transcoded bytes
+        :param media_type: their media type
+        :return: the path it is stored at
+        """
+        key = self.key(source_digest, settings)
+        ext = {v: k for k, v in self.EXTENSION_MEDIA_TYPES.items()}[media_type]
+        path = f"{self.directory}/{key[:2]}/{key}{ext}"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        return path
+
+    @property
+    def stats(self) -> str:
+        with self._lock:
+            return f"{self.hits} hits, {self.misses} misses"
+
+
+class ChapterCache:
+    """
+    Cache of parsed chapters, one json file per chapter key.  An entry is
+    only used while both the chapter's html and the parsing code are the
+    same as when it was written.  It also records the image urls the
+    chapter was parsed with, so they can still be revalidated when the
+    parsing is skipped.
+    """
+
+    # bump when Chapter changes what it renders
+    VERSION = 1
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def key(self, html: bytes, fingerprint: str) -> str:
+        """
+        :param html: the raw html of the page
+        :param fingerprint: the hash of the Scraper's parsing code
+        :return: the key the parsed output is valid for
+        """
+        digest = hashlib.sha256(f"{self.VERSION}:{fingerprint}:".encode())
+        digest.update(html)
+        return digest.hexdigest()
+
+    def path(self, chapter_key: float) -> str:
+        return f"{self.directory}/{chapter_key}.json"
+
+    def get(
+        self,
+        chapter_key: float,
+        key: str,
+        image_exists: Callable[[str], bool] = os.path.isfile,
+        image_current: Optional[Callable[[str, str], bool]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        :param chapter_key: the chapter number
+        :param key: the key the entry must have been written with
+        :param image_exists: checks an image path is still valid, e.g. the
+            `exists` of the image store it came from
+        :param image_current: checks an image url still holds the image
+            stored at a path, e.g. by revalidating it.  Entries that did not
+            record their image urls are not used when it is given.
+        :return: the cached chapter, or None if there is none, it is out of
+            date, or one of its images has gone missing or changed
+        """
+        try:
+            with open(self.path(chapter_key), "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get("key") != key:
+            return None
+        chapter = entry["chapter"]
+        if not all(image_exists(p) for p in chapter["image_paths"] or []):
+            return None
+        if image_current is not None:
+            images = entry.get("images")
+            if images is None:
+                return None
+            for url, path in images.items():
+                if not image_current(url, path):
+                    return None
+        return chapter
+
+    def put(
+        self,
+        chapter_key: float,
+        key: str,
+        chapter: Dict[str, Any],
+        images: Optional[Dict[str, str]] = None,
+    ):
+        """
+        :param chapter_key: the chapter number
+        :param key: the key the parsed output is valid for
+        :param chapter: the parsed chapter, as a json serializable dict
+        :param images: the urls of the images the chapter was parsed with
+            -> where they were stored
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(chapter_key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"key": key, "chapter": chapter, "images": images or {}}, f
+            )
+        os.replace(tmp_path, path)
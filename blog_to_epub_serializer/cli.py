@@ -0,0 +1,219 @@
+"""
+List, inspect and build the registered serializers.
+
+Usage:
+    python -m blog_to_epub_serializer list
+    python -m blog_to_epub_serializer show innkeeper
+    python -m blog_to_epub_serializer build innkeeper demonchild --stream
+    python -m blog_to_epub_serializer build --all --dry-run
+    python -m blog_to_epub_serializer build innkeeper --discover --update
+"""
+import argparse
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from blog_to_epub_serializer import registry
+from blog_to_epub_serializer.discovery import DiscoveryState
+from blog_to_epub_serializer.registry import Serializer
+
+logger = logging.getLogger("cli")
+
+
+def configure_logging() -> None:
+    """
+    Log everything from INFO up to stderr.  Called by the entry points, not
+    on import, so a program using the library keeps its own logging setup.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+
+def cached_pages(
+    serializer: Serializer, chapter_map: Optional[Dict[float, str]] = None
+) -> int:
+    """
+    :param serializer: a registered serializer
+    :param chapter_map: its chapters, by default its Serializer.chapter_map
+    :return: how many of its chapters have a cached page
+    """
+    if chapter_map is None:
+        chapter_map = serializer.chapter_map()
+    page_store = serializer.scraper_class.page_store()
+    # pages cached before validators were kept have none, count the pages
+    return sum(page_store.exists(key) for key in chapter_map)
+
+
+def list_serializers(serializers: List[Serializer]) -> None:
+    print(f"{'name':<24}{'chapters':>9}  {'title':<44}author")
+    for serializer in serializers:
+        print(
+            f"{serializer.name:<24}{len(serializer.blog_map):>9}  "
+            f"{serializer.title:<44}{serializer.author}"
+        )
+
+
+def show_serializer(serializer: Serializer) -> None:
+    chapter_map = serializer.chapter_map()
+    keys = list(chapter_map)
+    epub_path = serializer.epub_path
+    scraper_class = serializer.scraper_class
+    print(f"name:      {serializer.name}")
+    print(f"title:     {serializer.title}")
+    print(f"author:    {serializer.author}")
+    print(
+        f"scraper:   {scraper_class.__module__}.{scraper_class.__qualname__}"
+    )
+    print(f"cache:     {scraper_class.SCRAPER_CACHE}")
+    print(
+        f"cover:     {serializer.cover_img_url or serializer.cover_img_path}"
+    )
+    if keys:
+        print(f"chapters:  {len(keys)} ({keys[0]} to {keys[-1]})")
+    else:
+        print("chapters:  0")
+    print(f"cached:    {cached_pages(serializer, chapter_map)} pages")
+    if scraper_class.DISCOVERY:
+        discovered = DiscoveryState.load(scraper_class.SCRAPER_CACHE)
+        print(
+            f"discovery: {scraper_class.DISCOVERY}, "
+            f"{len(discovered.chapters)} chapters found so far"
+        )
+    built = "built" if os.path.isfile(epub_path) else "not built"
+    print(f"epub:      {epub_path} ({built})")
+
+
+def plan_builds(serializers: List[Serializer], use_cache: bool) -> None:
+    for serializer in serializers:
+        chapter_map = serializer.chapter_map()
+        chapters = len(chapter_map)
+        cached = cached_pages(serializer, chapter_map) if use_cache else 0
+        print(
+            f"{serializer.name}: {chapters} chapters, "
+            f"{chapters - cached} to download -> {serializer.epub_path}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m blog_to_epub_serializer",
+        description=__doc__.split("\n\n")[0],
+    )
+    parser.add_argument(
+        "--serializers",
+        default=registry.SERIALIZERS_DIR,
+        help="the directory the serializer modules are in",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list the serializers")
+    show = commands.add_parser("show", help="describe a serializer")
+    show.add_argument("name")
+    build = commands.add_parser("build", help="build serializers")
+    build.add_argument("names", nargs="*")
+    build.add_argument("--all", action="store_true", help="build them all")
+    build.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only print what would be built",
+    )
+    build.add_argument(
+        "--books", type=int, help="how many books to build at the same time"
+    )
+    build.add_argument("--workers", type=int)
+    build.add_argument("--image-workers", type=int)
+    build.add_argument("--profile")
+    build.add_argument("--stream", action="store_true")
+    build.add_argument(
+        "--discover",
+        action="store_true",
+        help="look for chapters published since the last build",
+    )
+    build.add_argument(
+        "--update",
+        action="store_true",
+        help="only add the new chapters to an epub built before",
+    )
+    build.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="download every page and image again",
+    )
+    args = parser.parse_args(argv)
+
+    registry.discover(args.serializers)
+    try:
+        if args.command == "list":
+            list_serializers(registry.all_serializers())
+            return 0
+        if args.command == "show":
+            show_serializer(registry.get(args.name))
+            return 0
+        if args.all:
+            serializers = registry.all_serializers()
+        else:
+            serializers = [registry.get(name) for name in args.names]
+    except KeyError as e:
+        parser.error(f"no serializer named {e}")
+    if not serializers:
+        parser.error("give serializers to build, or --all")
+    if args.dry_run:
+        plan_builds(serializers, use_cache=not args.no_cache)
+        return 0
+
+    configure_logging()
+    return build_serializers(
+        serializers,
+        books=args.books,
+        use_cache=not args.no_cache,
+        workers=args.workers,
+        image_workers=args.image_workers,
+        profile=args.profile,
+        stream=args.stream,
+        discover=args.discover,
+        update=args.update,
+    )
+
+
+def build_serializers(
+    serializers: List[Serializer], books: Optional[int] = None, **kwargs
+) -> int:
+    """
+    Build serializers together, see `batch.build_all`.
+
+    :param serializers: what to build
+    :param books: how many books to build at the same time
+    :param kwargs: the other `batch.build_all` arguments
+    :return: the exit status, 1 if any book failed
+    """
+    from blog_to_epub_serializer.batch import BATCH_BOOKS, build_all
+
+    start = time.perf_counter()
+    # each scraper is created (downloading its cover) inside the build of
+    # its book, so a failed download only fails that book
+    results = build_all(serializers, books=books or BATCH_BOOKS, **kwargs)
+    failed = [
+        name
+        for name, result in results.items()
+        if isinstance(result, Exception)
+    ]
+    logger.info(
+        f"Built {len(results) - len(failed)} of {len(results)} books in "
+        f"{time.perf_counter() - start:.2f}s"
+    )
+    for name in failed:
+        logger.error(f"Failed: {name}: {results[name]}")
+    return 1 if failed else 0
+
+
+def build_one(serializer: Serializer) -> None:
+    """
+    Build a single serializer with logging on, for serializer modules that
+    are run as scripts.
+
+    :param serializer: the registered serializer
+    """
+    configure_logging()
+    serializer.build()
@@ -0,0 +1,167 @@
+"""
+What an epub written by `Scraper.run` holds, kept next to it as
+{epub name}.contents.json, so a later build can add its new chapters to the
+epub instead of writing the whole book again (`Scraper.run(update=True)`).
+"""
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+if TYPE_CHECKING:
+    from blog_to_epub_serializer.book_utils import Chapter
+
+
+@dataclass
+class ImageEntry:
+    """
+    An image in the epub's manifest
+    """
+
+    uid: str
+    file_name: str
+    media_type: str
+
+
+@dataclass
+class ChapterEntry:
+    """
+    A chapter in the epub, with the images it added to it (images shared
+    with an earlier chapter are listed with that chapter only)
+    """
+
+    idx: float
+    title: str
+    file_name: str
+    add_to_table_of_contents: bool = True
+    images: List[ImageEntry] = field(default_factory=list)
+    # the post the chapter was parsed from, None for the preface chapters
+    url: Optional[str] = None
+
+    @classmethod
+    def from_chapter(
+        cls, chapter: "Chapter", url: Optional[str] = None
+    ) -> "ChapterEntry":
+        """
+        :param chapter: a chapter that was added to the book
+        :param url: the post it was parsed from, if any
+        :return: its entry
+        """
+        return cls(
+            idx=chapter.idx,
+            title=chapter.title,
+            file_name=chapter.xhtml,
+            add_to_table_of_contents=chapter.add_to_table_of_contents,
+            images=[
+                ImageEntry(eimg.id, eimg.file_name, eimg.media_type)
+                for eimg in chapter.eimgs
+            ],
+            url=url,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ChapterEntry":
+        images = [ImageEntry(**image) for image in data.pop("images")]
+        return cls(images=images, **data)
+
+
+@dataclass
+class BookContents:
+    """
+    The chapters of an epub, in spine order, and the settings it was built
+    with.
+    """
+
+    # see `Scraper.contents_settings`, an epub is only added to by a build
+    # with the same settings
+    settings: str
+    chapters: List[ChapterEntry] = field(default_factory=list)
+
+    # bump when the layout of the epub changes
+    VERSION = 1
+
+    @staticmethod
+    def path_for(epub_path: str) -> str:
+        """
+        :param epub_path: the epub
+        :return: where its contents are kept
+        """
+        return f"{os.path.splitext(epub_path)[0]}.contents.json"
+
+    @classmethod
+    def load(cls, epub_path: str) -> Optional["BookContents"]:
+        """
+        :param epub_path: the epub
+        :return: its contents, None if there are none stored (or they were
+            stored by another VERSION)
+        """
+        try:
+            with open(cls.path_for(epub_path), "r") as f:
+                stored = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if stored.get("version") != cls.VERSION:
+            return None
+        return cls(
+            settings=stored["settings"],
+            chapters=[
+                ChapterEntry.from_dict(chapter)
+                for chapter in stored["chapters"]
+            ],
+        )
+
+    def save(self, epub_path: str) -> None:
+        """
+        :param epub_path: the epub these are the contents of
+        """
+        path = self.path_for(epub_path)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "settings": self.settings,
+                    "chapters": [asdict(c) for c in self.chapters],
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def remove(epub_path: str) -> None:
+        """
+        Forget the contents of an epub that is about to be written again
+
+        :param epub_path: the epub
+        """
+        path = BookContents.path_for(epub_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+    @property
+    def file_names(self) -> Set[str]:
+        """
+        :return: the file names of every chapter and image of the epub
+        """
+        names = set()
+        for chapter in self.chapters:
+            names.add(chapter.file_name)
+            names.update(image.file_name for image in chapter.images)
+        return names
+
+    def new_chapters(
+        self, chapter_map: Dict[float, str]
+    ) -> Optional[Dict[float, str]]:
+        """
+        :param chapter_map: the chapters the book should have, chapter
+            number -> url, in order
+        :return: the chapters that come after the ones in the epub.  None if
+            the epub's chapters are not the start of chapter_map (one was
+            removed, moved or now has another url).
+        """
+        posts = [(c.idx, c.url) for c in self.chapters if c.url is not None]
+        wanted = list(chapter_map.items())
+        if wanted[: len(posts)] != posts:
+            return None
+        return dict(wanted[len(posts) :])
@@ -0,0 +1,265 @@
+"""
+Find the chapters a serial published after its blog_map was written, from
+the blog's feed, its sitemap, or the "Next" links between posts.  See
+`Scraper.DISCOVERY` and `Scraper.discover_chapters`.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urljoin, urlparse
+from xml.etree import ElementTree
+
+from blog_to_epub_serializer.cache import Validators
+
+logger = logging.getLogger("discovery")
+
+# the ways `Scraper.discover_chapters` can look for new chapters
+STRATEGIES = ("feed", "sitemap", "next")
+
+
+@dataclass
+class Post:
+    """
+    A post listed by a feed or sitemap, or linked from another post.
+    """
+
+    url: str
+    title: str = ""
+    # when a sitemap says the post last changed, as an ISO 8601 date.  Not
+    # when it was published: editing an old chapter updates it.
+    modified: str = ""
+
+
+def normalize_url(url: str) -> str:
+    """
+    :param url: a post url
+    :return: the url without the parts that differ between links to the same
+        post: scheme, "www.", trailing slash and fragment
+    """
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    if host.startswith("www."):
+        host = host[len("www.") :]
+    path = parsed.path.rstrip("/")
+    query = f"?{parsed.query}" if parsed.query else ""
+    return f"{host}{path}{query}"
+
+
+def default_source(strategy: str, url: str) -> str:
+    """
+    :param strategy: "feed" or "sitemap"
+    :param url: any post of the blog
+    :return: where WordPress (or Blogger, on blogspot.com) serves the blog's
+        feed or sitemap
+    """
+    parsed = urlparse(url)
+    site = f"{parsed.scheme}://{parsed.netloc}"
+    blogger = parsed.hostname and parsed.hostname.endswith("blogspot.com")
+    if strategy == "feed":
+        return f"{site}/feeds/posts/default" if blogger else f"{site}/feed/"
+    return f"{site}/sitemap.xml"
+
+
+def _local_name(element: ElementTree.Element) -> str:
+    """
+    :return: the tag of the element, without its xml namespace
+    """
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def _children(
+    element: ElementTree.Element, name: str
+) -> Iterator[ElementTree.Element]:
+    return (child for child in element if _local_name(child) == name)
+
+
+def _text(element: ElementTree.Element, name: str) -> str:
+    child = next(_children(element, name), None)
+    return (child.text or "").strip() if child is not None else ""
+
+
+def parse_feed(xml: bytes) -> List[Post]:
+    """
+    :param xml: an RSS 2.0 (WordPress) or Atom (Blogger) feed
+    :return: its posts, oldest first
+    """
+    root = ElementTree.fromstring(xml)
+    posts = []
+    if _local_name(root) == "feed":
+        for entry in _children(root, "entry"):
+            links = list(_children(entry, "link"))
+            # atom entries link to their comments and edit urls too
+            link = next(
+                (
+                    link
+                    for link in links
+                    if link.get("rel", "alternate") == "alternate"
+                ),
+                None,
+            )
+            if link is not None and link.get("href"):
+                posts.append(Post(link.get("href"), _text(entry, "title")))
+    else:
+        channel = next(_children(root, "channel"), root)
+        for item in _children(channel, "item"):
+            url = _text(item, "link")
+            if url:
+                posts.append(Post(url, _text(item, "title")))
+    # feeds list the newest post first
+    posts.reverse()
+    return posts
+
+
+def parse_sitemap(xml: bytes) -> Tuple[List[Post], List[str]]:
+    """
+    :param xml: a sitemap, or a sitemap index
+    :return: the pages it lists, in its order, and the sitemaps it points to
+    """
+    root = ElementTree.fromstring(xml)
+    entries = [
+        (_text(entry, "lastmod"), _text(entry, "loc"))
+        for entry in root
+        if _local_name(entry) in ("url", "sitemap")
+    ]
+    entries = [(lastmod, loc) for lastmod, loc in entries if loc]
+    if _local_name(root) == "sitemapindex":
+        return [], [loc for _, loc in entries]
+    return [Post(loc, modified=lastmod) for lastmod, loc in entries], []
+
+
+def publication_order(post: Post) -> Tuple[int, ...]:
+    """
+    :param post: a post of a serial
+    :return: the numbers of its url's last path segment (e.g. (12, 2) for
+        /chapter-12-part-2/), or of its title if that has none.  Empty if
+        neither has a number.
+    """
+    slug = urlparse(post.url).path.rstrip("/").rsplit("/", 1)[-1]
+    numbers = re.findall(r"\d+", slug) or re.findall(r"\d+", post.title)
+    return tuple(int(number) for number in numbers)
+
+
+def new_posts(
+    posts: Iterable[Post], known: Set[str], pattern: Optional[str] = None
+) -> List[Post]:
+    """
+    :param posts: the posts of a feed or sitemap
+    :param known: the normalized urls of the chapters already in the book
+    :param pattern: a regex the url or title of a chapter matches, None if
+        every post is a chapter
+    :return: every chapter that is not known yet, in publication order:
+        by `publication_order`, then in the order they were listed.  Posts
+        without a number come last.  (A sitemap's lastmod is when a post
+        last changed, so the order of the listing says nothing about which
+        chapters are newer.)
+    """
+    found: Dict[str, Post] = {}
+    for post in posts:
+        url = normalize_url(post.url)
+        if url in known or url in found:
+            continue
+        if pattern and not (
+            re.search(pattern, post.url, re.IGNORECASE)
+            or re.search(pattern, post.title, re.IGNORECASE)
+        ):
+            continue
+        found[url] = post
+
+    def order(post: Post) -> Tuple[bool, Tuple[int, ...]]:
+        numbers = publication_order(post)
+        return not numbers, numbers
+
+    # sorted is stable, posts numbered alike keep their listing order
+    return sorted(found.values(), key=order)
+
+
+def find_next_link(
+    html: bytes, base_url: str, text_pattern: str, parser: str = "html.parser"
+) -> Optional[str]:
+    """
+    :param html: a post
+    :param base_url: the url of the post, relative links are resolved
+        against it
+    :param text_pattern: a regex matching the text of the "Next" link, for
+        pages without an <a rel="next">
+    :param parser: the BeautifulSoup tree builder to use
+    :return: the url the post's next link points to, if it has one
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    # only the links are needed, not the rest of the page
+    soup = BeautifulSoup(html, parser, parse_only=SoupStrainer("a"))
+    link = soup.find("a", rel="next", href=True)
+    if link is None:
+        link = soup.find(
+            "a",
+            href=True,
+            string=re.compile(text_pattern, re.IGNORECASE),
+        )
+    if link is None:
+        return None
+    return urljoin(base_url, link["href"])
+
+
+@dataclass
+class DiscoveryState:
+    """
+    The chapters found by earlier discovery runs, and the validators of the
+    feeds and sitemaps read, so an unchanged feed costs a single 304.
+    Stored as json in the Scraper's SCRAPER_CACHE.
+    """
+
+    path: str
+    # chapter number -> post url, of every chapter discovered so far
+    chapters: Dict[float, str] = field(default_factory=dict)
+    # feed or sitemap url -> its validators
+    sources: Dict[str, Validators] = field(default_factory=dict)
+
+    FILE_NAME = "discovered.json"
+
+    @classmethod
+    def load(cls, directory: str) -> "DiscoveryState":
+        """
+        :param directory: the SCRAPER_CACHE of the serial
+        :return: its state, empty if nothing was discovered yet
+        """
+        path = f"{directory}/{cls.FILE_NAME}"
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return cls(path)
+        return cls(
+            path,
+            chapters={
+                float(key): url for key, url in stored["chapters"].items()
+            },
+            sources={
+                url: Validators(**validators)
+                for url, validators in stored.get("sources", {}).items()
+            },
+        )
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "chapters": {
+                        str(key): url
+                        for key, url in sorted(self.chapters.items())
+                    },
+                    "sources": {
+                        url: asdict(validators)
+                        for url, validators in self.sources.items()
+                    },
+                },
+                f,
+                indent=1,
+            )
+        os.replace(tmp_path, self.path)
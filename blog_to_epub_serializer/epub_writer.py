@@ -0,0 +1,388 @@
+import copy
+import os
+import shutil
+import struct
+import zipfile
+from typing import (
+    TYPE_CHECKING,
+    AbstractSet,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Set,
+)
+
+from ebooklib import epub
+from ebooklib.utils import get_pages
+
+from blog_to_epub_serializer.image_utils import open_file
+
+if TYPE_CHECKING:
+    from blog_to_epub_serializer.book_utils import Chapter
+
+# what a released document is left with, the nav still parses every document
+# looking for page markers
+RELEASED_DOCUMENT = "<div></div>"
+
+# bytes copied at a time from a FileItem's source into the zip
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# set in a zip entry's flags when its crc and sizes follow the data, rather
+# than being in its local header
+DATA_DESCRIPTOR_FLAG = 0x08
+
+
+class FileItem(epub.EpubItem):
+    """
+    An EpubItem whose content stays where it is stored (a file, or the image
+    store) until the epub is written.  The writers below copy it into the zip
+    in chunks, so it is never held in memory; reading `content` loads it.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        open_source: Callable[[str], BinaryIO] = open_file,
+        **kwargs,
+    ):
+        """
+        :param source: where the content is stored
+        :param open_source: opens the source for reading, in binary
+        :param kwargs: the EpubItem arguments, except the content
+        """
+        self.source = source
+        self.open_source = open_source
+        super().__init__(**kwargs)
+        self._content: Optional[bytes] = None
+
+    def open(self) -> BinaryIO:
+        """
+        :return: the content, opened for reading
+        """
+        return self.open_source(self.source)
+
+    @property
+    def is_loaded(self) -> bool:
+        """
+        :return: True once a content was assigned (e.g. released), instead
+            of being read from the source
+        """
+        return self._content is not None
+
+    @property
+    def content(self) -> bytes:
+        if self._content is not None:
+            return self._content
+        with self.open() as f:
+            return f.read()
+
+    @content.setter
+    def content(self, value: bytes) -> None:
+        self._content = value
+
+
+class FileCover(FileItem, epub.EpubCover):
+    """
+    The cover image of the book (see EpubBook.set_cover), as a FileItem
+    """
+
+
+class ChapterHtml(epub.EpubHtml):
+    """
+    The EpubHtml of a Chapter.  Its content is put together from the
+    chapter's html whenever it is read, so the text of a chapter is only held
+    once.  Assigning a content (e.g. when the writer releases it) replaces it.
+    """
+
+    def __init__(self, chapter: "Chapter", **kwargs):
+        self._chapter = chapter
+        self._content: Optional[str] = None
+        super().__init__(**kwargs)
+
+    @property
+    def content(self) -> str:
+        if self._content is not None:
+            return self._content
+        return self._chapter.document
+
+    @content.setter
+    def content(self, value: Optional[str]) -> None:
+        self._content = value
+
+
+class EpubFileWriter(epub.EpubWriter):
+    """
+    An EpubWriter that copies FileItems into the zip from their source in
+    chunks, rather than loading each of them into memory.
+    """
+
+    def _write_items(self) -> None:
+        for item in self.book.get_items():
+            self._write_book_item(item)
+
+    def _write_book_item(self, item: epub.EpubItem) -> None:
+        if isinstance(item, epub.EpubNcx):
+            self.out.writestr(
+                f"{self.book.FOLDER_NAME}/{item.file_name}", self._get_ncx()
+            )
+        elif isinstance(item, epub.EpubNav):
+            self.out.writestr(
+                f"{self.book.FOLDER_NAME}/{item.file_name}",
+                self._get_nav(item),
+            )
+        else:
+            self._write_item(item)
+
+    def _write_item(self, item: epub.EpubItem) -> None:
+        if item.manifest:
+            name = f"{self.book.FOLDER_NAME}/{item.file_name}"
+        else:
+            name = item.file_name
+        if isinstance(item, FileItem) and not item.is_loaded:
+            with item.open() as source, self.out.open(name, "w") as target:
+                shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+        else:
+            self.out.writestr(name, item.get_content())
+
+
+def write_epub(
+    name: str, book: epub.EpubBook, options: Optional[Dict] = None
+) -> None:
+    """
+    epub.write_epub, with FileItems copied into the zip in chunks
+
+    :param name: the epub to create
+    :param book: the book to write
+    :param options: the EpubWriter options
+    """
+    writer = EpubFileWriter(name, book, options)
+    writer.process()
+    writer.write()
+
+
+def copy_zip_entry(
+    source: zipfile.ZipFile, target: zipfile.ZipFile, name: str
+) -> None:
+    """
+    Copy an entry from one zip into another as it is stored, without
+    decompressing and compressing it again.
+
+    :param source: the zip to copy from, opened for reading
+    :param target: the zip to copy into, opened for writing
+    :param name: the name of the entry
+    """
+    info = source.getinfo(name)
+    # the data starts after the entry's local header, whose name and extra
+    # field can differ in length from the central directory's
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    source.fp.seek(name_length + extra_length, os.SEEK_CUR)
+
+    copied = copy.copy(info)
+    # the crc and sizes are known, they go in the local header
+    copied.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+    # the way ZipFile.write adds a directory, which has no data to compress
+    target.fp.seek(target.start_dir)
+    copied.header_offset = target.fp.tell()
+    target.filelist.append(copied)
+    target.NameToInfo[name] = copied
+    target.fp.write(copied.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.fp.read(min(remaining, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(f"{name} is truncated")
+        target.fp.write(chunk)
+        remaining -= len(chunk)
+    target.start_dir = target.fp.tell()
+
+
+def missing_items(
+    name: str, file_names: Iterable[str], folder_name: str = "EPUB"
+) -> Set[str]:
+    """
+    :param name: an epub
+    :param file_names: the file names of manifest items
+    :param folder_name: the folder the epub keeps its items in, see
+        EpubBook.FOLDER_NAME
+    :return: the file names the epub does not hold.  All of them if it is
+        not a zip.
+    """
+    try:
+        with zipfile.ZipFile(name) as z:
+            names = set(z.namelist())
+    except (OSError, zipfile.BadZipFile):
+        return set(file_names)
+    return {f for f in file_names if f"{folder_name}/{f}" not in names}
+
+
+class UpdatingEpubWriter(EpubFileWriter):
+    """
+    Writes a book over an earlier epub of it.  The items named in `copied`
+    are copied across from the earlier epub still compressed, their content
+    is never read; only the other items, the manifest, spine, NCX and nav are
+    written.  The epub is written next to the earlier one and replaces it
+    once it is complete.
+
+    Usage:
+        writer = UpdatingEpubWriter("book.epub", ebook, {"ch_1.html"})
+        writer.process()
+        writer.write()
+    """
+
+    def __init__(
+        self,
+        name: str,
+        book: epub.EpubBook,
+        copied: AbstractSet[str],
+        options: Optional[Dict] = None,
+    ):
+        """
+        :param name: the earlier epub, replaced by the new one
+        :param book: the book to write
+        :param copied: the file names of the items to copy from the earlier
+            epub
+        :param options: the EpubWriter options
+        """
+        super().__init__(name, book, options)
+        self.copied = copied
+        self._previous: Optional[zipfile.ZipFile] = None
+
+    def write(self) -> None:
+        epub_path = self.file_name
+        self.file_name = f"{epub_path}.{os.getpid()}.tmp"
+        try:
+            with zipfile.ZipFile(epub_path) as previous:
+                self._previous = previous
+                super().write()
+            os.replace(self.file_name, epub_path)
+        finally:
+            out = getattr(self, "out", None)
+            if out is not None and out.fp is not None:
+                # it failed part way
+                out.close()
+            if os.path.exists(self.file_name):
+                os.remove(self.file_name)
+            self._previous = None
+            self.file_name = epub_path
+
+    def _write_item(self, item: epub.EpubItem) -> None:
+        if item.file_name not in self.copied:
+            super()._write_item(item)
+            return
+        if item.manifest:
+            name = f"{self.book.FOLDER_NAME}/{item.file_name}"
+        else:
+            name = item.file_name
+        copy_zip_entry(self._previous, self.out, name)
+
+
+def update_epub(
+    name: str,
+    book: epub.EpubBook,
+    copied: AbstractSet[str],
+    options: Optional[Dict] = None,
+) -> None:
+    """
+    `write_epub` over an earlier epub of the book, see UpdatingEpubWriter
+
+    :param name: the earlier epub, replaced by the new one
+    :param book: the book to write
+    :param copied: the file names of the items to copy from the earlier epub
+    :param options: the EpubWriter options
+    """
+    writer = UpdatingEpubWriter(name, book, copied, options)
+    writer.process()
+    writer.write()
+
+
+class StreamingEpubWriter(EpubFileWriter):
+    """
+    Writes an epub while its book is still being built.  Items are written
+    to the zip as soon as they are flushed and their content is released,
+    only the manifest, spine, NCX and nav are written when the writer is
+    closed.  Memory use no longer grows with the size of the book.
+
+    Usage:
+        writer = StreamingEpubWriter("book.epub", ebook)
+        writer.open()
+        ... add items to ebook, writer.flush() ...
+        writer.close()
+    """
+
+    def __init__(
+        self, name: str, book: epub.EpubBook, options: Optional[Dict] = None
+    ):
+        super().__init__(name, book, options)
+        self.out: Optional[zipfile.ZipFile] = None
+        # book.items is only ever appended to, everything before this index
+        # has been written already
+        self._flushed = 0
+
+    def open(self) -> None:
+        """
+        Create the zip and write the entries that do not depend on the book
+        contents.
+        """
+        self.process()
+        self.out = zipfile.ZipFile(self.file_name, "w", zipfile.ZIP_DEFLATED)
+        self.out.writestr(
+            "mimetype",
+            "application/epub+zip",
+            compress_type=zipfile.ZIP_STORED,
+        )
+        self._write_container()
+
+    def flush(self) -> None:
+        """
+        Write every item added to the book since the last flush, and release
+        their content.  The NCX and nav describe the whole book, so they are
+        left for `close`.
+        """
+        items = self.book.items
+        while self._flushed < len(items):
+            item = items[self._flushed]
+            if isinstance(item, (epub.EpubNcx, epub.EpubNav)):
+                # nothing after these can be flushed until the book is done
+                return
+            self._write_item(item)
+            self._release(item)
+            self._flushed += 1
+
+    def close(self) -> None:
+        """
+        Write the remaining items, the NCX, the nav and the manifest/spine,
+        then close the zip.
+        """
+        for item in self.book.items[self._flushed :]:
+            self._write_book_item(item)
+        self._flushed = len(self.book.items)
+        self._write_opf()
+        self.out.close()
+        self.out = None
+
+    def abort(self) -> None:
+        """
+        Close the zip and remove the unfinished file.
+        """
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+        if os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+
+    def _release(self, item: epub.EpubItem) -> None:
+        """
+        Drop the content of an item that has been written.
+
+        :param item: the written item
+        """
+        if not isinstance(item, epub.EpubHtml):
+            item.content = b""
+        elif not (self.options.get("epub3_pages") and get_pages(item)):
+            # documents with page markers keep their content, the nav lists
+            # them in its page-list
+            item.content = RELEASED_DOCUMENT
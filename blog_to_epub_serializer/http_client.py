@@ -0,0 +1,249 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("http_client")
+
+
+class ResponseTooLarge(requests.RequestException):
+    """
+    Raised by `HttpClient.download` when a response is bigger than its
+    max_size.
+    """
+
+
+@dataclass
+class DownloadStats:
+    url: str
+    size: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Bytes per second, from the request until the last chunk.
+        """
+        return self.size / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.size / 1024:.1f} KiB in {self.seconds:.2f}s "
+            f"({self.throughput / 1024:.1f} KiB/s)"
+        )
+
+
+@dataclass
+class HttpStats:
+    requests: int = 0
+    retries: int = 0
+    connections_opened: int = 0
+    # streamed by `HttpClient.download`
+    downloads: int = 0
+    downloaded_bytes: int = 0
+
+    @property
+    def connections_reused(self) -> int:
+        """
+        Every request that did not need a fresh connection was served over
+        a pooled (kept alive) one.
+        """
+        return max(self.requests - self.connections_opened, 0)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests over {self.connections_opened} "
+            f"connections ({self.connections_reused} reused), "
+            f"{self.retries} retries, {self.downloads} downloads streamed "
+            f"({self.downloaded_bytes / 1024 / 1024:.1f} MiB)"
+        )
+
+
+class HttpClient:
+    """
+    A pooled http session shared by the Scrapers.  Keeps connections to each
+    host alive between requests, negotiates compression, applies connect and
+    read timeouts to every request and retries transient failures with an
+    exponential backoff.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int = 4,
+        pool_connections: int = 16,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 30.0,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504),
+        user_agent: Optional[str] = None,
+    ):
+        # max kept-alive connections per host
+        self.pool_maxsize = pool_maxsize
+        # max number of hosts to keep a pool for
+        self.pool_connections = pool_connections
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=retry_statuses,
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            # urllib3 retries any 413/429/503 that has a Retry-After, even
+            # when it is not in retry_statuses; leave those to the caller
+            # (e.g. scheduler.CrawlScheduler) when they are not
+            respect_retry_after_header=bool(
+                set(retry_statuses) & Retry.RETRY_AFTER_STATUS_CODES
+            ),
+            # let the final failed response through to raise_for_status
+            raise_on_status=False,
+        )
+        self.user_agent = user_agent
+
+        self._session: Optional[requests.Session] = None
+        self._adapter: Optional[HTTPAdapter] = None
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._retries = 0
+        self._downloads = 0
+        self._downloaded_bytes = 0
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The underlying session, created on first use.
+        """
+        with self._lock:
+            if self._session is None:
+                self._adapter = HTTPAdapter(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize,
+                    max_retries=self.retry,
+                )
+                session = requests.Session()
+                session.mount("http://", self._adapter)
+                session.mount("https://", self._adapter)
+                session.headers["Accept-Encoding"] = "gzip, deflate"
+                if self.user_agent:
+                    session.headers["User-Agent"] = self.user_agent
+                self._session = session
+        return self._session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        GET the url over a pooled connection.  Raises for any error status
+        left over once the retries are used up.
+
+        :param url: the url to request
+        :param kwargs: any extra arguments accepted by `requests.get`
+        :return: the response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.get(url, **kwargs)
+
+        retries = response.raw.retries
+        with self._lock:
+            self._requests += 1
+            if retries is not None:
+                self._retries += len(retries.history)
+        response.raise_for_status()
+        return response
+
+    def download(
+        self,
+        url: str,
+        file: BinaryIO,
+        max_size: Optional[int] = None,
+        chunk_size: int = 64 * 1024,
+        **kwargs,
+    ) -> Tuple[requests.Response, Optional[DownloadStats]]:
+        """
+        GET the url and stream the body into a file chunk by chunk, so it is
+        never held in memory in full.
+
+        :param url: the url to request
+        :param file: where the body is written, opened in binary mode
+        :param max_size: the most bytes accepted, None for no limit
+        :param chunk_size: bytes read from the connection at a time
+        :param kwargs: any extra arguments accepted by `requests.get`
+        :return: the response (its body already consumed) and how the
+            download went, None if there was no body (a 304)
+        :raises ResponseTooLarge: once the body grows past max_size, the
+            file is left partially written
+        """
+        start = time.perf_counter()
+        try:
+            response = self.get(url, stream=True, **kwargs)
+        except requests.HTTPError as e:
+            # the error body was never read, free its connection
+            e.response.close()
+            raise
+        # closing the response hands the connection back to the pool
+        with response:
+            if response.status_code == 304:
+                return response, None
+
+            length = response.headers.get("Content-Length")
+            if max_size is not None and length and int(length) > max_size:
+                raise ResponseTooLarge(
+                    f"{url} is {length} bytes, more than the {max_size} "
+                    f"allowed",
+                    response=response,
+                )
+
+            download = DownloadStats(url)
+            for chunk in response.iter_content(chunk_size):
+                download.size += len(chunk)
+                if max_size is not None and download.size > max_size:
+                    raise ResponseTooLarge(
+                        f"{url} is more than the {max_size} bytes allowed",
+                        response=response,
+                    )
+                file.write(chunk)
+        download.seconds = time.perf_counter() - start
+
+        with self._lock:
+            self._downloads += 1
+            self._downloaded_bytes += download.size
+        logger.info(f"Downloaded {url}: {download}")
+        return response, download
+
+    @property
+    def stats(self) -> HttpStats:
+        """
+        Snapshot of how many requests, retries and connections this client
+        has made so far.
+        """
+        connections = 0
+        if self._adapter is not None:
+            pools = self._adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    connections += pool.num_connections
+        with self._lock:
+            return HttpStats(
+                requests=self._requests,
+                retries=self._retries,
+                connections_opened=connections,
+                downloads=self._downloads,
+                downloaded_bytes=self._downloaded_bytes,
+            )
+
+    def close(self) -> None:
+        """
+        Close every pooled connection.  The client can still be used
+        afterwards, it will simply open new connections.
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._adapter = None
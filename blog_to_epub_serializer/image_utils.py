@@ -0,0 +1,373 @@
+import hashlib
+import io
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from blog_to_epub_serializer.cache import DerivedImageCache
+
+# the bytes to embed in the epub, and their media type
+EncodedImage = Tuple[bytes, str]
+
+# images read and transcoded at a time per worker by `prepare_images`
+TRANSCODE_BATCH_SIZE = 4
+
+# how much of an image `sniff_format` looks at
+SNIFF_SIZE = 256
+
+# the chunks `prepare_images` hashes images in
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# the image formats epub readers are required to support (EPUB 3 core media
+# types), these are embedded as is
+EPUB_MEDIA_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "SVG": "image/svg+xml",
+}
+
+MEDIA_TYPE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/svg+xml": ".svg",
+}
+
+
+@dataclass(frozen=True)
+class ImageProfile:
+    """
+    How the images of a book are prepared for the device it will be read on.
+    The default values leave every image as it is.
+    """
+
+    name: str
+    # images are scaled down (never up) to fit inside (width, height)
+    max_size: Optional[Tuple[int, int]] = None
+    # quality JPEGs are (re)saved at, None leaves JPEGs untouched
+    jpeg_quality: Optional[int] = None
+    grayscale: bool = False
+    optimize_png: bool = False
+
+    @property
+    def is_original(self) -> bool:
+        """
+        :return: True if this profile does not change any image
+        """
+        return (
+            self.max_size is None
+            and self.jpeg_quality is None
+            and not self.grayscale
+            and not self.optimize_png
+        )
+
+    @property
+    def settings(self) -> str:
+        """
+        :return: every setting that changes the output, used to key the
+            DerivedImageCache (the name is left out on purpose, renaming a
+            profile does not change its images)
+        """
+        return (
+            f"max_size={self.max_size}:jpeg_quality={self.jpeg_quality}:"
+            f"grayscale={self.grayscale}:optimize_png={self.optimize_png}"
+        )
+
+
+ORIGINAL_PROFILE = ImageProfile("original")
+
+PROFILES: Dict[str, ImageProfile] = {
+    profile.name: profile
+    for profile in (
+        ORIGINAL_PROFILE,
+        ImageProfile(
+            "tablet",
+            max_size=(1536, 2048),
+            jpeg_quality=85,
+            optimize_png=True,
+        ),
+        ImageProfile(
+            "e-ink",
+            max_size=(1072, 1448),
+            jpeg_quality=70,
+            grayscale=True,
+            optimize_png=True,
+        ),
+    )
+}
+
+
+def get_profile(profile: Union[str, ImageProfile, None]) -> ImageProfile:
+    """
+    :param profile: a profile, or the name of one of the PROFILES
+    :return: the matching ImageProfile, ORIGINAL_PROFILE if None
+    """
+    if profile is None:
+        return ORIGINAL_PROFILE
+    if isinstance(profile, ImageProfile):
+        return profile
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError(
+            f"Unknown image profile {profile!r}, "
+            f"expected one of {', '.join(PROFILES)}"
+        )
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """
+    Identify an image from its leading bytes, without decoding it.
+
+    :param data: the raw image file, or at least its first SNIFF_SIZE
+        bytes
+    :return: the format name (as used by PIL) or None if it is not one of
+        the epub core formats
+    """
+    if data.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    head = data[:SNIFF_SIZE].lstrip()
+    if head.startswith(b"<svg") or (
+        head.startswith(b"<?xml") and b"<svg" in head
+    ):
+        return "SVG"
+    return None
+
+
+def needs_transcoding(
+    image_format: Optional[str], profile: ImageProfile
+) -> bool:
+    """
+    :param image_format: the sniffed format of the image
+    :param profile: how the image should be prepared
+    :return: False if the image can be embedded exactly as it is
+    """
+    if image_format == "SVG":
+        # vector images never need resizing
+        return False
+    return image_format not in EPUB_MEDIA_TYPES or not profile.is_original
+
+
+def transcode_image(
+    data: bytes, profile: ImageProfile = ORIGINAL_PROFILE
+) -> EncodedImage:
+    """
+    Decode an image, apply the profile and re-save it in an epub core format.
+    PNGs, GIFs and images with transparency are saved as PNG (maps and line
+    art do not survive JPEG well), everything else as JPEG.
+
+    :param data: the raw image file
+    :param profile: how the image should be prepared
+    :return: the re-encoded bytes and their media type
+    """
+    # imported here, so the rest of the module works without loading Pillow
+    from PIL import Image
+
+    raw_img = Image.open(io.BytesIO(data))
+    source_format = sniff_format(data)
+    if getattr(raw_img, "is_animated", False) and source_format == "GIF":
+        # resizing would drop every frame but the first
+        return data, EPUB_MEDIA_TYPES[source_format]
+
+    has_alpha = (
+        raw_img.mode in ("RGBA", "LA", "PA") or "transparency" in raw_img.info
+    )
+    if raw_img.mode not in ("RGB", "L", "RGBA", "LA"):
+        raw_img = raw_img.convert("RGBA" if has_alpha else "RGB")
+
+    original_size = raw_img.size
+    if profile.max_size:
+        raw_img.thumbnail(profile.max_size, Image.LANCZOS)
+    if profile.grayscale and raw_img.mode not in ("L", "LA"):
+        raw_img = raw_img.convert("LA" if has_alpha else "L")
+
+    b = io.BytesIO()
+    if has_alpha or source_format in ("PNG", "GIF"):
+        raw_img.save(b, "png", optimize=profile.optimize_png)
+        media_type = "image/png"
+    else:
+        if raw_img.mode not in ("RGB", "L"):
+            raw_img = raw_img.convert("RGB")
+        options = {}
+        if profile.jpeg_quality is not None:
+            options = {"quality": profile.jpeg_quality, "optimize": True}
+        raw_img.save(b, "jpeg", **options)
+        media_type = "image/jpeg"
+    bin_img = b.getvalue()
+
+    # recompressing an image that was not resized or converted can make it
+    # bigger, keep the original in that case
+    unchanged = raw_img.size == original_size and not profile.grayscale
+    if (
+        unchanged
+        and EPUB_MEDIA_TYPES.get(source_format) == media_type
+        and len(bin_img) >= len(data)
+    ):
+        return data, media_type
+    return bin_img, media_type
+
+
+def read_file(image_path: str) -> bytes:
+    """
+    :param image_path: the local path to the image
+    :return: the raw image file
+    """
+    with open(image_path, "rb") as f:
+        return f.read()
+
+
+def open_file(path: str) -> BinaryIO:
+    """
+    :param path: a local file
+    :return: the file, opened for reading in binary
+    """
+    return open(path, "rb")
+
+
+def _transcode_all(
+    to_transcode: Dict[str, bytes],
+    profile: ImageProfile,
+    executor: Optional[Executor] = None,
+) -> Dict[str, EncodedImage]:
+    """
+    :param to_transcode: path -> raw image
+    :param profile: how the images should be prepared
+    :param executor: the process pool to transcode on, without one the
+        images are transcoded on this thread
+    :return: the transcoded image for each path
+    """
+    profiles = [profile] * len(to_transcode)
+    if executor is not None and to_transcode:
+        results = executor.map(
+            transcode_image, to_transcode.values(), profiles
+        )
+        return dict(zip(to_transcode, results))
+    return {
+        image_path: transcode_image(data, profile)
+        for image_path, data in to_transcode.items()
+    }
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    """
+    An image ready to be embedded in an epub, without its bytes: they are
+    read from where they are stored when the epub is written.
+    """
+
+    media_type: str
+    # the DerivedImageCache file of the transcoded image, None when the
+    # source image is embedded as it is
+    derived_path: Optional[str] = None
+    # the transcoded image, only kept in memory when there is no cache to
+    # leave it in
+    content: Optional[bytes] = None
+
+
+def prepare_images(
+    image_paths: Iterable[str],
+    workers: int = 1,
+    profile: ImageProfile = ORIGINAL_PROFILE,
+    cache: Optional[DerivedImageCache] = None,
+    executor: Optional[Executor] = None,
+    read: Callable[[str], bytes] = read_file,
+    open_image: Callable[[str], BinaryIO] = open_file,
+) -> Dict[str, PreparedImage]:
+    """
+    Make every image of a book embeddable in an epub, keeping no image in
+    memory.  With the original profile, formats the readers support are
+    passed through untouched and anything else (webp, bmp, tiff...) is
+    transcoded to a JPEG, or a PNG if it has transparency.  Other profiles
+    resize and recompress every raster image.
+
+    Images that can be passed through are only sniffed from their first
+    bytes, and transcoded images are left in the cache.  The images needing
+    transcoding are read and transcoded a few batches at a time, so memory
+    does not grow with their number.  The output is identical whatever the
+    worker count.
+
+    :param image_paths: the local paths of the images, duplicates are only
+        prepared once
+    :param workers: how many processes to transcode with, 1 transcodes on
+        the calling thread
+    :param profile: how the images should be prepared
+    :param cache: where transcoded images are kept.  Without one, the
+        transcoded images are held in memory.
+    :param executor: an existing process pool to transcode on, instead of
+        starting one for this call
+    :param read: loads the raw image of a path to transcode it, e.g. from
+        the image store the paths came from
+    :param open_image: opens the raw image of a path, to sniff its format
+        (and hash it for the cache) without loading all of it
+    :return: how to embed each path
+    """
+    prepared: Dict[str, PreparedImage] = {}
+    to_transcode: List[str] = []
+    digests: Dict[str, str] = {}
+    for image_path in dict.fromkeys(image_paths):
+        with open_image(image_path) as f:
+            header = f.read(SNIFF_SIZE)
+            image_format = sniff_format(header)
+            if not needs_transcoding(image_format, profile):
+                prepared[image_path] = PreparedImage(
+                    EPUB_MEDIA_TYPES[image_format]
+                )
+                continue
+            if cache is not None:
+                digest = hashlib.sha256(header)
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                digests[image_path] = digest.hexdigest()
+
+        if cache is not None:
+            located = cache.locate(digests[image_path], profile.settings)
+            if located is not None:
+                derived_path, media_type = located
+                prepared[image_path] = PreparedImage(media_type, derived_path)
+                continue
+        to_transcode.append(image_path)
+
+    if not to_transcode:
+        return prepared
+
+    pool = executor
+    if pool is None and workers > 1 and len(to_transcode) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(to_transcode)))
+    batch_size = TRANSCODE_BATCH_SIZE * (workers if pool is not None else 1)
+    try:
+        for start in range(0, len(to_transcode), batch_size):
+            batch = {
+                image_path: read(image_path)
+                for image_path in to_transcode[start : start + batch_size]
+            }
+            encoded = _transcode_all(batch, profile, pool)
+            for image_path, (content, media_type) in encoded.items():
+                if cache is None:
+                    prepared[image_path] = PreparedImage(
+                        media_type, content=content
+                    )
+                    continue
+                derived_path = cache.put(
+                    digests[image_path], profile.settings, content, media_type
+                )
+                prepared[image_path] = PreparedImage(media_type, derived_path)
+    finally:
+        if pool is not executor:
+            pool.shutdown()
+    return prepared
@@ -0,0 +1,256 @@
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak memory is left out of the report
+    resource = None
+
+# the BuildMetrics (and chapter) the current thread is working for
+_active = threading.local()
+
+
+@dataclass
+class ChapterMetrics:
+    key: float
+    url: str
+    # wall clock seconds spent fetching and parsing the chapter
+    seconds: float = 0.0
+    # stage -> seconds, see BuildMetrics.stages
+    stages: Dict[str, float] = field(
+        default_factory=lambda: defaultdict(float)
+    )
+    # counter -> value, see BuildMetrics.counters
+    counters: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "url": self.url,
+            "seconds": self.seconds,
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+        }
+
+
+class BuildMetrics:
+    """
+    Timings and counters collected during a `Scraper.run`, for the build as
+    a whole and per chapter.
+
+    Stages are timed where the work happens and can nest: e.g.
+    parse_chapter_text includes the image_fetch of the chapter's images, and
+    book includes image_encode.  Stage times are summed across the worker
+    threads, so they can add up to more than the wall clock time.
+
+    Code only records into the metrics that are active on its thread, see
+    `activate`, `timed` and `count`.  Without any, nothing is recorded.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.wall_seconds = 0.0
+        # stage -> seconds
+        self.stages: Dict[str, float] = defaultdict(float)
+        # counter -> value
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.chapters: Dict[float, ChapterMetrics] = {}
+        # anything else the report should include, e.g. the http stats
+        self.extra: Dict[str, Any] = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def finish(self) -> None:
+        """
+        Stop the wall clock.
+        """
+        self.wall_seconds = time.perf_counter() - self._start
+
+    def add_time(
+        self, stage: str, seconds: float, chapter: Optional[ChapterMetrics]
+    ) -> None:
+        with self._lock:
+            self.stages[stage] += seconds
+            if chapter is not None:
+                chapter.stages[stage] += seconds
+
+    def add_count(
+        self, name: str, value: int, chapter: Optional[ChapterMetrics]
+    ) -> None:
+        with self._lock:
+            self.counters[name] += value
+            if chapter is not None:
+                chapter.counters[name] += value
+
+    @contextmanager
+    def activate(
+        self, key: Optional[float] = None, url: str = ""
+    ) -> Iterator[Optional[ChapterMetrics]]:
+        """
+        Record everything the current thread does inside the block into
+        these metrics, and into the chapter's if a key is given.
+
+        :param key: the chapter being processed
+        :param url: its url
+        :return: the chapter's metrics, if any
+        """
+        chapter = None
+        if key is not None:
+            chapter = ChapterMetrics(key, url)
+            with self._lock:
+                self.chapters[key] = chapter
+        saved = getattr(_active, "state", None)
+        _active.state = self, chapter
+        start = time.perf_counter()
+        try:
+            yield chapter
+        finally:
+            if chapter is not None:
+                chapter.seconds = time.perf_counter() - start
+            _active.state = saved
+
+    def cache_hit_ratios(self) -> Dict[str, Optional[float]]:
+        """
+        :return: the share of lookups answered without downloading (a 304
+            counts as a hit) or parsing, for each cache
+        """
+        c = self.counters
+
+        def ratio(hits: int, misses: int) -> Optional[float]:
+            return hits / (hits + misses) if hits + misses else None
+
+        return {
+            "pages": ratio(
+                c["pages_cached"] + c["pages_not_modified"],
+                c["pages_downloaded"],
+            ),
+            "images": ratio(
+                c["images_cached"] + c["images_not_modified"],
+                c["images_downloaded"],
+            ),
+            "chapters": ratio(c["chapters_cached"], c["chapters_parsed"]),
+            "derived_images": ratio(
+                c["derived_images_cached"], c["derived_images_transcoded"]
+            ),
+        }
+
+    @staticmethod
+    def peak_memory() -> Dict[str, Optional[int]]:
+        """
+        :return: the peak resident memory in bytes of this process and of
+            its (image transcoding) child processes
+        """
+        if resource is None:
+            return {"self_bytes": None, "children_bytes": None}
+        # linux reports KiB, macOS bytes
+        unit = 1 if sys.platform == "darwin" else 1024
+        return {
+            "self_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            * unit,
+            "children_bytes": resource.getrusage(
+                resource.RUSAGE_CHILDREN
+            ).ru_maxrss
+            * unit,
+        }
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        :return: the json serializable report
+        """
+        with self._lock:
+            chapters = [c.as_dict() for c in self.chapters.values()]
+            report = {
+                "started_at": self.started_at,
+                "wall_seconds": self.wall_seconds,
+                "stages": dict(self.stages),
+                "counters": dict(self.counters),
+            }
+        report["cache_hit_ratios"] = self.cache_hit_ratios()
+        report["peak_memory"] = self.peak_memory()
+        report.update(self.extra)
+        report["chapters"] = chapters
+        return report
+
+    def write(self, path: str) -> None:
+        """
+        :param path: where to write the report, as json
+        """
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=1)
+
+    def summary(self) -> str:
+        """
+        :return: a one line description of where the time went
+        """
+        stages = ", ".join(
+            f"{stage} {seconds:.2f}s"
+            for stage, seconds in sorted(
+                self.stages.items(), key=lambda item: -item[1]
+            )
+        )
+        slowest = sorted(self.chapters.values(), key=lambda c: -c.seconds)[:3]
+        slowest = ", ".join(f"{c.key} ({c.seconds:.2f}s)" for c in slowest)
+        return (
+            f"built in {self.wall_seconds:.2f}s: {stages}. "
+            f"Slowest chapters: {slowest or 'none'}"
+        )
+
+
+def current() -> Tuple[Optional[BuildMetrics], Optional[ChapterMetrics]]:
+    """
+    :return: the metrics active on this thread and the chapter being
+        processed, (None, None) outside of a build
+    """
+    return getattr(_active, "state", None) or (None, None)
+
+
+@contextmanager
+def activate(
+    metrics: Optional[BuildMetrics], key: Optional[float] = None, url: str = ""
+) -> Iterator[None]:
+    """
+    `BuildMetrics.activate`, doing nothing if there are no metrics.  Used
+    to carry the build's metrics over to a worker thread.
+    """
+    if metrics is None:
+        yield
+        return
+    with metrics.activate(key, url):
+        yield
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Add the time spent in the block to a stage of the active metrics.
+
+    :param stage: the stage name
+    """
+    metrics, chapter = current()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(stage, time.perf_counter() - start, chapter)
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Add to a counter of the active metrics.
+
+    :param name: the counter name
+    :param value: how much to add
+    """
+    metrics, chapter = current()
+    if metrics is not None:
+        metrics.add_count(name, value, chapter)
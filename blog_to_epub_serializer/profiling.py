@@ -0,0 +1,168 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# (file name, line number, function name), as pstats names functions
+Function = Tuple[str, int, str]
+
+
+def _label(func: Function) -> str:
+    """
+    :return: the frame name of the function in a collapsed stack
+    """
+    file_name, line, name = func
+    if file_name == "~":
+        # a builtin, e.g. <method 'find_all' of ...>
+        label = name
+    else:
+        label = f"{name} ({os.path.basename(file_name)}:{line})"
+    # ; separates the frames of a collapsed stack
+    return label.replace(";", ",")
+
+
+class ParseProfiler:
+    """
+    Runs the parsing methods of a Scraper (parse_chapter_text and
+    add_preface_chapters) under cProfile and adds up the results of every
+    chapter.  See Scraper.PROFILE_PARSING.
+
+    The profiled calls run one at a time (cProfile cannot profile several
+    threads at once), and include any image downloads parse_chapter_text
+    makes, under fetch_and_save_img.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+
+    def runcall(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        :param func: the method to profile
+        :return: what it returns
+        """
+        with self._lock:
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                self.calls += 1
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+
+    @property
+    def stats(self) -> Optional[pstats.Stats]:
+        """
+        :return: the profile of every call so far, None before the first
+        """
+        return self._stats
+
+    def report(self, limit: int = 40) -> str:
+        """
+        :param limit: how many functions to list per table
+        :return: the functions with the most time spent in them, then those
+            with the most time spent in them and what they call
+        """
+        if self._stats is None:
+            return "Nothing was profiled\n"
+        out = io.StringIO()
+        self._stats.stream = out
+        out.write(f"{self.calls} profiled calls\n\n")
+        for sort in ("tottime", "cumulative"):
+            out.write(f"Sorted by {sort}:\n")
+            self._stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def hotspots(self, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        :param limit: how many functions to return
+        :return: the functions with the most time spent in their own code,
+            with that time in seconds
+        """
+        if self._stats is None:
+            return []
+        own = sorted(
+            (
+                (_label(func), entry[2])
+                for func, entry in self._stats.stats.items()
+            ),
+            key=lambda item: -item[1],
+        )
+        return own[:limit]
+
+    def collapsed_stacks(self, min_seconds: float = 1e-5) -> Dict[str, int]:
+        """
+        The profile as collapsed stacks, the input format of flamegraph.pl
+        and speedscope.
+
+        cProfile only records which function called which, not whole
+        stacks, so the time of a function called from several places is
+        split between them in proportion to the time each caller spent in
+        it.
+
+        :param min_seconds: branches with less time than this are left out
+        :return: "root;caller;function" -> microseconds spent in the
+            function's own code along that stack
+        """
+        if self._stats is None:
+            return {}
+        entries = self._stats.stats
+        # caller -> callee -> seconds spent in callee from that caller
+        callees: Dict[Function, Dict[Function, float]] = defaultdict(dict)
+        roots = []
+        for func, (_, _, _, _, callers) in entries.items():
+            if not callers:
+                roots.append(func)
+            for caller, (_, _, _, cumulative) in callers.items():
+                callees[caller][func] = cumulative
+
+        stacks: Dict[str, int] = defaultdict(int)
+
+        def walk(func: Function, share: float, path: List[Function]):
+            _, _, own, cumulative, _ = entries[func]
+            stack = ";".join(_label(f) for f in path)
+            if own * share >= min_seconds:
+                stacks[stack] += round(own * share * 1_000_000)
+            for callee, seconds in callees[func].items():
+                # recursion is folded into the first call
+                if callee in path or seconds * share < min_seconds:
+                    continue
+                callee_cumulative = entries[callee][3]
+                if callee_cumulative > 0:
+                    walk(
+                        callee,
+                        seconds * share / callee_cumulative,
+                        path + [callee],
+                    )
+
+        for root in roots:
+            walk(root, 1.0, [root])
+        return dict(stacks)
+
+    def write(self, path_prefix: str) -> List[str]:
+        """
+        Write the profile as {prefix}.txt (the report), {prefix}.prof (for
+        pstats or snakeviz) and {prefix}.collapsed (for flame graphs).
+
+        :param path_prefix: the path of the files, without extension
+        :return: the paths written
+        """
+        paths = [f"{path_prefix}.txt", f"{path_prefix}.prof"]
+        with open(paths[0], "w") as f:
+            f.write(self.report())
+        if self._stats is None:
+            return paths[:1]
+        self._stats.dump_stats(paths[1])
+        paths.append(f"{path_prefix}.collapsed")
+        with open(paths[2], "w") as f:
+            for stack, microseconds in sorted(self.collapsed_stacks().items()):
+                f.write(f"{stack} {microseconds}\n")
+        return paths
@@ -0,0 +1,185 @@
+"""
+The serializers the project can build.
+
+A serializer module defines its Scraper subclass and `blog_map`, then
+declares the book with `register`.  Nothing is downloaded or built until the
+book is: the cover url is only fetched by `Serializer.scraper()`.
+"""
+import glob
+import importlib.util
+import os
+import sys
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Type
+
+if TYPE_CHECKING:
+    from blog_to_epub_serializer.metrics import BuildMetrics
+    from blog_to_epub_serializer.scraper import Scraper
+
+# where the committed serializers live, in relation to repo base
+SERIALIZERS_DIR = "serializers"
+
+# name -> every registered serializer
+_registry: Dict[str, "Serializer"] = {}
+
+
+@dataclass(frozen=True)
+class Serializer:
+    """
+    A book, and how to build it.  See `register`.
+    """
+
+    name: str
+    scraper_class: Type["Scraper"]
+    title: str
+    author: str
+    blog_map: Dict[float, str]
+    epub_name: str
+    # the local path of the cover image
+    cover_img_path: Optional[str] = None
+    # or where to download it from, when the book is built
+    cover_img_url: Optional[str] = None
+
+    @property
+    def epub_path(self) -> str:
+        """
+        :return: where the book is written
+        """
+        from blog_to_epub_serializer.scraper import LOCAL_CACHE
+
+        return f"{LOCAL_CACHE}/{self.epub_name}"
+
+    def scraper(self) -> "Scraper":
+        """
+        Create the Scraper of the book, downloading its cover first if it
+        has a cover_img_url.
+
+        :return: the scraper, ready to `run`
+        """
+        cover_img_path = self.cover_img_path
+        if self.cover_img_url:
+            cover_img_path = self.scraper_class.fetch_and_save_img(
+                self.cover_img_url
+            )
+        return self.scraper_class(
+            title=self.title,
+            author=self.author,
+            blog_map=self.blog_map,
+            epub_name=self.epub_name,
+            cover_img_path=cover_img_path,
+        )
+
+    def chapter_map(self) -> Dict[float, str]:
+        """
+        :return: the chapters a `build --discover` builds, the blog_map and
+            those discovered so far (see Scraper.chapter_map)
+        """
+        # no cover is needed to read the map, so none is downloaded
+        return self.scraper_class(
+            title=self.title,
+            author=self.author,
+            blog_map=self.blog_map,
+            epub_name=self.epub_name,
+        ).chapter_map()
+
+    def build(self, **kwargs) -> "BuildMetrics":
+        """
+        Build the book.
+
+        :param kwargs: the Scraper.run arguments
+        :return: the metrics of the build
+        """
+        return self.scraper().run(**kwargs)
+
+
+def register(
+    name: str,
+    scraper_class: Type["Scraper"],
+    title: str,
+    author: str,
+    blog_map: Dict[float, str],
+    epub_name: str,
+    cover_img_path: Optional[str] = None,
+    cover_img_url: Optional[str] = None,
+) -> Serializer:
+    """
+    Declare a book.  Registering a name again replaces the earlier entry
+    (e.g. when a serializer script is also loaded as a module).
+
+    :param name: what the book is called on the command line
+    :param scraper_class: the Scraper subclass that parses its posts
+    :param title: used in the epub metadata
+    :param author: used in the epub metadata
+    :param blog_map: chapter numbers (float) to post urls
+    :param epub_name: the local file name that will be created
+    :param cover_img_path: the local path of the cover image, if any
+    :param cover_img_url: the url of the cover image, downloaded when the
+        book is built, if any
+    :return: the registered serializer
+    """
+    serializer = Serializer(
+        name=name,
+        scraper_class=scraper_class,
+        title=title,
+        author=author,
+        blog_map=blog_map,
+        epub_name=epub_name,
+        cover_img_path=cover_img_path,
+        cover_img_url=cover_img_url,
+    )
+    _registry[name] = serializer
+    return serializer
+
+
+def load_serializer(serializer_path: str) -> List[Serializer]:
+    """
+    Import a serializer module, registering what it declares.
+
+    :param serializer_path: the path to one of the serializers/*.py files
+    :return: the serializers it registered
+    """
+    name = os.path.splitext(os.path.basename(serializer_path))[0]
+    spec = importlib.util.spec_from_file_location(
+        name.replace("-", "_"), serializer_path
+    )
+    module = importlib.util.module_from_spec(spec)
+    # inspect looks classes up by module name, Scraper.code_fingerprint
+    # needs it
+    sys.modules[spec.name] = module
+    before = dict(_registry)
+    spec.loader.exec_module(module)
+    return [
+        serializer
+        for name, serializer in _registry.items()
+        if before.get(name) is not serializer
+    ]
+
+
+def discover(directory: str = SERIALIZERS_DIR) -> List[Serializer]:
+    """
+    Load every serializer module of a directory.
+
+    :param directory: where the serializer modules are
+    :return: the serializers they registered
+    """
+    serializers = []
+    for serializer_path in sorted(glob.glob(f"{directory}/*.py")):
+        if os.path.basename(serializer_path) != "__init__.py":
+            serializers.extend(load_serializer(serializer_path))
+    return serializers
+
+
+def get(name: str) -> Serializer:
+    """
+    :param name: the name a serializer was registered under
+    :return: the serializer
+    :raise KeyError: if there is none by that name
+    """
+    return _registry[name]
+
+
+def all_serializers() -> List[Serializer]:
+    """
+    :return: every registered serializer, by name
+    """
+    return [_registry[name] for name in sorted(_registry)]
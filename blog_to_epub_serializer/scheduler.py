@@ -0,0 +1,331 @@
+import email.utils
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Mapping, Optional, TypeVar
+from urllib.parse import urlparse
+
+from blog_to_epub_serializer import metrics
+
+logger = logging.getLogger("scheduler")
+
+T = TypeVar("T")
+
+# statuses a host answers with when it wants fewer requests
+THROTTLE_STATUSES = frozenset([429, 503])
+
+
+@dataclass(frozen=True)
+class HostPolicy:
+    """
+    How hard a domain (and its subdomains) may be crawled.
+    """
+
+    # requests per second, refilled into a token bucket.  None does not
+    # limit the rate, only the concurrency.
+    rate: Optional[float] = 2.0
+    # requests that may be sent back to back after a quiet spell
+    burst: int = 4
+    # requests in flight at once
+    concurrency: int = 4
+    # the rate is never cut below this when the host struggles
+    min_rate: float = 0.2
+    # a throttled request (429/503) is sent again up to this many times,
+    # after waiting out its Retry-After
+    max_retries: int = 3
+    # seconds to wait after a throttled response without a Retry-After,
+    # doubled for every throttle in a row
+    backoff: float = 2.0
+    # the rate is cut when the latency of the host's responses grows past
+    # this many times the fastest it has answered
+    slow_factor: float = 3.0
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    :param value: a Retry-After header, seconds or an http date
+    :return: the seconds to wait, None if there was no usable header
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+class HostState:
+    """
+    The token bucket, concurrency slots and adaptive rate of one domain.
+    """
+
+    # how quickly the latency average follows new responses
+    LATENCY_WEIGHT = 0.2
+    # the rate is changed at most this often, in seconds
+    ADJUST_INTERVAL = 1.0
+    # responses quicker than this many seconds never count as slow
+    SLOW_LATENCY = 0.5
+
+    def __init__(self, domain: str, policy: HostPolicy):
+        self.domain = domain
+        self.policy = policy
+        # the current rate, between min_rate and policy.rate
+        self.rate = policy.rate
+        self.tokens = float(policy.burst)
+        self.slots = threading.BoundedSemaphore(policy.concurrency)
+        # nothing is sent before this time.monotonic(), set by Retry-After
+        # and backoffs
+        self.blocked_until = 0.0
+        self.latency: Optional[float] = None
+        self.fastest: Optional[float] = None
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self._throttles_in_a_row = 0
+        self._refilled_at = time.monotonic()
+        self._adjusted_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait_for_turn(self) -> None:
+        """
+        Block until the domain is not backing off and a token is available,
+        then take the token.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.rate is not None:
+                    self.tokens = min(
+                        self.tokens + (now - self._refilled_at) * self.rate,
+                        float(self.policy.burst),
+                    )
+                self._refilled_at = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.rate is None:
+                    return
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def record_success(self, latency: float) -> None:
+        """
+        :param latency: seconds until the response started arriving
+        """
+        with self._lock:
+            self.requests += 1
+            self._throttles_in_a_row = 0
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.LATENCY_WEIGHT * (latency - self.latency)
+            if self.fastest is None or self.latency < self.fastest:
+                self.fastest = self.latency
+            if (
+                self.latency > self.SLOW_LATENCY
+                and self.latency > self.fastest * self.policy.slow_factor
+            ):
+                self._slow_down(f"latency is up to {self.latency:.2f}s")
+            else:
+                self._speed_up()
+
+    def record_throttle(self, retry_after: Optional[float]) -> float:
+        """
+        The domain answered 429/503: stop sending to it for a while.
+
+        :param retry_after: the seconds the response asked for, if any
+        :return: the seconds every request to the domain now waits
+        """
+        with self._lock:
+            self.requests += 1
+            self.throttled += 1
+            self._throttles_in_a_row += 1
+            if retry_after is None:
+                retry_after = self.policy.backoff * 2 ** (
+                    self._throttles_in_a_row - 1
+                )
+            self.blocked_until = max(
+                self.blocked_until, time.monotonic() + retry_after
+            )
+            # a throttle always counts, however recently the rate changed
+            self._adjusted_at = 0.0
+            self._slow_down("throttled")
+            return retry_after
+
+    def record_error(self) -> None:
+        """
+        The request failed without a response (timeout, connection reset)
+        or with a server error.
+        """
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            self._slow_down("request failed")
+
+    def _slow_down(self, reason: str) -> None:
+        """
+        Halve the rate (with the lock held)
+        """
+        now = time.monotonic()
+        if now - self._adjusted_at < self.ADJUST_INTERVAL:
+            return
+        self._adjusted_at = now
+        current = self.rate
+        if current is None:
+            # unlimited hosts are capped at what they managed so far
+            current = self.policy.concurrency / (self.latency or 1.0)
+        self.rate = max(current / 2, self.policy.min_rate)
+        logger.info(f"{self.domain}: {reason}, rate cut to {self.rate:.2f}/s")
+
+    def _speed_up(self) -> None:
+        """
+        Raise the rate by a tenth of the policy's, up to the policy's (with
+        the lock held)
+        """
+        now = time.monotonic()
+        if self.rate is None or now - self._adjusted_at < self.ADJUST_INTERVAL:
+            return
+        self._adjusted_at = now
+        if self.policy.rate is None:
+            # no ceiling, so it grows by a tenth of itself instead
+            self.rate *= 1.1
+        else:
+            self.rate = min(
+                self.rate + self.policy.rate / 10, self.policy.rate
+            )
+
+    def __str__(self) -> str:
+        rate = "unlimited" if self.rate is None else f"{self.rate:.2f}/s"
+        latency = "-" if self.latency is None else f"{self.latency:.2f}s"
+        return (
+            f"{self.domain}: {self.requests} requests at {rate}, "
+            f"latency {latency}, {self.throttled} throttled, "
+            f"{self.errors} errors"
+        )
+
+
+class CrawlScheduler:
+    """
+    Spaces out the requests to each domain: at most `concurrency` in flight,
+    at most `rate` per second, and none while the domain asked (with a
+    Retry-After) or seems to need a break.  The rate is halved when a
+    domain throttles, fails or slows down, and climbs back to its policy's
+    while it keeps up.  Shared by every Scraper, so concurrent builds
+    respect the same limits.
+
+    Usage:
+        scheduler = CrawlScheduler(
+            hosts={"ilona-andrews.com": HostPolicy(rate=1.0)}
+        )
+        response = scheduler.fetch(url, lambda: client.get(url))
+    """
+
+    def __init__(
+        self,
+        default: HostPolicy = HostPolicy(),
+        hosts: Optional[Mapping[str, HostPolicy]] = None,
+    ):
+        """
+        :param default: the policy of every domain not in hosts, applied per
+            host name
+        :param hosts: domain -> its policy, which also covers its subdomains
+            (e.g. "googleusercontent.com" for lh3.googleusercontent.com)
+        """
+        self.default = default
+        self.hosts = dict(hosts or {})
+        self._states: Dict[str, HostState] = {}
+        self._lock = threading.Lock()
+
+    def state(self, url: str) -> HostState:
+        """
+        :param url: a url about to be requested
+        :return: the state of the domain it belongs to
+        """
+        host = urlparse(url).hostname or ""
+        domain, policy = host, self.default
+        for name, host_policy in self.hosts.items():
+            if host == name or host.endswith(f".{name}"):
+                domain, policy = name, host_policy
+                break
+        with self._lock:
+            state = self._states.get(domain)
+            if state is None:
+                state = HostState(domain, policy)
+                self._states[domain] = state
+        return state
+
+    def fetch(self, url: str, send: Callable[[], T]) -> T:
+        """
+        Send a request once its domain allows it.  A throttled request is
+        sent again after the wait the domain asked for.
+
+        :param url: the url requested
+        :param send: makes the request and returns the response (or a tuple
+            starting with it, like HttpClient.download).  It is called again
+            for every retry.  Error statuses should raise, with the response
+            attached (requests.HTTPError).
+        :return: what send returned
+        """
+        state = self.state(url)
+        attempt = 0
+        while True:
+            with state.slots:
+                with metrics.timed("rate_limit"):
+                    state.wait_for_turn()
+                start = time.perf_counter()
+                try:
+                    result = send()
+                except Exception as e:
+                    response = getattr(e, "response", None)
+                    status = getattr(response, "status_code", None)
+                    if status not in THROTTLE_STATUSES:
+                        if status is None or status >= 500:
+                            state.record_error()
+                        else:
+                            # e.g. a 404, the host is fine
+                            state.record_success(time.perf_counter() - start)
+                        raise
+                    headers = getattr(response, "headers", {}) or {}
+                    wait = state.record_throttle(
+                        retry_after_seconds(headers.get("Retry-After"))
+                    )
+                    metrics.count("requests_throttled")
+                    if attempt >= state.policy.max_retries:
+                        raise
+                    attempt += 1
+                    logger.warning(
+                        f"{url} was throttled ({status}), retrying in "
+                        f"{wait:.1f}s"
+                    )
+                    continue
+            state.record_success(self._latency(result, start))
+            return result
+
+    @staticmethod
+    def _latency(result: Any, start: float) -> float:
+        """
+        :param result: what the request returned
+        :param start: time.perf_counter() when it was sent
+        :return: seconds until the response headers arrived when known
+            (downloads are not slow just for being big), otherwise until
+            the request returned
+        """
+        response = result[0] if isinstance(result, tuple) else result
+        elapsed = getattr(response, "elapsed", None)
+        if elapsed is not None:
+            return elapsed.total_seconds()
+        return time.perf_counter() - start
+
+    @property
+    def stats(self) -> str:
+        with self._lock:
+            states = list(self._states.values())
+        return "; ".join(str(state) for state in states) or "no requests"
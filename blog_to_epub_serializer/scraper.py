@@ -1,27 +1,264 @@
+import hashlib
+import inspect
 import logging
+import math
 import os
+import re
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict
+from itertools import islice
 from pathlib import Path
-from typing import Dict, List, Optional
-
-import requests
-from bs4 import BeautifulSoup
-from ebooklib import epub
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Union,
+)
 
 from blog_to_epub_serializer.book_utils import Chapter, Book
+from blog_to_epub_serializer.cache import (
+    ChapterCache,
+    DerivedImageCache,
+    ImageStore,
+    PageStore,
+    Validators,
+)
+from blog_to_epub_serializer import metrics
+from blog_to_epub_serializer.contents import BookContents, ChapterEntry
+from blog_to_epub_serializer.discovery import (
+    STRATEGIES,
+    DiscoveryState,
+    Post,
+    default_source,
+    find_next_link,
+    new_posts,
+    normalize_url,
+    parse_feed,
+    parse_sitemap,
+)
+from blog_to_epub_serializer.image_utils import ImageProfile, get_profile
+from blog_to_epub_serializer.metrics import BuildMetrics
+from blog_to_epub_serializer.profiling import ParseProfiler
+from blog_to_epub_serializer.scheduler import CrawlScheduler, HostPolicy
+
+# requests, bs4, ebooklib and Pillow are imported when they are first used,
+# so importing a serializer (e.g. to list them) does not load them
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+    from blog_to_epub_serializer.http_client import HttpClient
+    from blog_to_epub_serializer.sqlite_cache import (
+        SqliteCache,
+        SqliteImageStore,
+        SqlitePageStore,
+    )
 
 logger = logging.getLogger("scraper")
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
 
 LOCAL_CACHE = f"local_cache"
 
+# Scraper subclass -> code_fingerprint, the source does not change while the
+# process is running
+_fingerprints: Dict[type, Optional[str]] = {}
+
+# while `_process_chapter` parses a chapter, its thread's `images` collects
+# the urls given to fetch_and_save_img -> where they were stored
+_recorded_images = threading.local()
+
+# while `run` builds a book, its threads' `urls` collects the image urls
+# revalidated so far, so an image shared by many chapters is only asked
+# about once per build
+_revalidated = threading.local()
+
+
+@contextmanager
+def _revalidating_once(urls: Optional[Set[str]]) -> Iterator[None]:
+    """
+    Record the image urls revalidated on this thread inside the block into
+    urls, and skip the ones already in it.
+
+    :param urls: the urls revalidated by the build so far, None to always
+        revalidate stale images
+    """
+    saved = getattr(_revalidated, "urls", None)
+    _revalidated.urls = urls
+    try:
+        yield
+    finally:
+        _revalidated.urls = saved
+
+
+def _fingerprint_globals(func, digest) -> None:
+    """
+    Add the module level values and functions a method refers to into the
+    fingerprint digest.  Modules and classes are left out, they are either
+    libraries or part of the fingerprint already.
+
+    :param func: the method
+    :param digest: the hashlib digest being built
+    """
+    names = set()
+    codes = [func.__code__]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(c for c in code.co_consts if inspect.iscode(c))
+
+    for name in sorted(names):
+        if name not in func.__globals__:
+            continue
+        value = func.__globals__[name]
+        if inspect.isfunction(value):
+            digest.update(inspect.getsource(value).encode())
+        elif isinstance(value, (set, frozenset)):
+            digest.update(f"{name}={sorted(value, key=repr)!r}".encode())
+        elif isinstance(value, (str, bytes, int, float, list, tuple, dict)):
+            digest.update(f"{name}={value!r}".encode())
+
+
+class _SharedHttpClient:
+    """
+    The default Scraper.HTTP_CLIENT: an HttpClient created on first use,
+    then shared by every Scraper that does not set its own.
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: the HttpClient arguments
+        """
+        self.kwargs = kwargs
+        self._client: Optional["HttpClient"] = None
+        self._lock = threading.Lock()
+
+    def __get__(self, instance, owner) -> "HttpClient":
+        with self._lock:
+            if self._client is None:
+                from blog_to_epub_serializer.http_client import HttpClient
+
+                self._client = HttpClient(**self.kwargs)
+        return self._client
+
 
 class Scraper:
     # directories in relation to repo base
     SCRAPER_CACHE = LOCAL_CACHE
 
+    # number of chapters fetched and parsed at the same time by `run`
+    FETCH_WORKERS = 8
+    # how many requests may be in flight against a single host at once
+    MAX_REQUESTS_PER_HOST = 4
+    # processes used to transcode images into epub formats, 1 transcodes on
+    # the main thread.  None uses every cpu.
+    IMAGE_WORKERS: Optional[int] = None
+    # how images are prepared for the target device, one of
+    # image_utils.PROFILES ("original", "tablet", "e-ink") or an ImageProfile
+    IMAGE_PROFILE: Union[str, ImageProfile] = "original"
+
+    # pooled http session used for every page and image download.  Shared by
+    # all Scrapers, override in a subclass to change timeouts or retries.
+    # 429 and 503 are not retried by the client, CRAWL_SCHEDULER retries them
+    # once the host's Retry-After has passed.
+    HTTP_CLIENT: "HttpClient" = _SharedHttpClient(
+        pool_maxsize=MAX_REQUESTS_PER_HOST, retry_statuses=(500, 502, 504)
+    )
+    # how often and how many requests are sent to each domain, slowing down
+    # when a domain throttles, fails or answers slower (see
+    # scheduler.CrawlScheduler).  Shared by every Scraper, so concurrent
+    # builds respect the same limits; replace it (or add to its hosts) to
+    # crawl a domain harder or gentler.
+    CRAWL_SCHEDULER = CrawlScheduler(
+        default=HostPolicy(concurrency=MAX_REQUESTS_PER_HOST),
+        hosts={
+            # blogger's image cdn, built to serve many images quickly
+            "googleusercontent.com": HostPolicy(
+                rate=10.0, burst=10, concurrency=MAX_REQUESTS_PER_HOST
+            ),
+            "bp.blogspot.com": HostPolicy(
+                rate=10.0, burst=10, concurrency=MAX_REQUESTS_PER_HOST
+            ),
+        },
+    )
+
+    # images bigger than this many bytes are refused (fetch_and_save_img
+    # raises http_client.ResponseTooLarge), None accepts any size
+    MAX_IMAGE_SIZE: Optional[int] = 50 * 1024 * 1024
+
+    # seconds a cached page or image is trusted before `run` asks the server
+    # whether it changed (a conditional request, answered by a cheap 304 when
+    # it did not).  None never revalidates, 0 revalidates on every run (an
+    # image used by many chapters is revalidated once per run).
+    REVALIDATE_AFTER: Optional[float] = None
+
+    # content addressed image storage shared by every Scraper, so an image is
+    # stored once however many chapters and books use it
+    IMAGE_STORE = ImageStore(f"{LOCAL_CACHE}/images")
+    # transcoded images kept between builds, keyed by the source image and
+    # the profile settings.  Set to None to always transcode.
+    DERIVED_IMAGE_CACHE: Optional[DerivedImageCache] = DerivedImageCache(
+        f"{LOCAL_CACHE}/derived"
+    )
+    # keep the downloaded pages and images in this single SQLite file,
+    # instead of soup_{key}.html files and the IMAGE_STORE directory.  e.g.
+    # SqliteCache(f"{LOCAL_CACHE}/cache.sqlite3")
+    CACHE_DB: Optional["SqliteCache"] = None
+
+    # write a json report of where the build's time went (see
+    # metrics.BuildMetrics) next to the epub, as {epub name}.metrics.json
+    WRITE_METRICS = True
+    # profile every parse_chapter_text and add_preface_chapters call with
+    # cProfile and write the combined profile next to the epub, as
+    # {epub name}.parse-profile.txt (the slowest functions),
+    # .parse-profile.prof (for pstats/snakeviz) and .parse-profile.collapsed
+    # (for flamegraph.pl/speedscope).  Chapters are always parsed, the parsed
+    # chapter cache is not read.  Slows the parsing down noticeably.
+    PROFILE_PARSING = False
+
+    # where `run(discover=True)` looks for chapters published after the
+    # blog_map was written: "feed" (the blog's RSS or Atom feed), "sitemap",
+    # or "next" (follow the "Next" link of the latest chapter).  None never
+    # looks.  See discover_chapters.
+    DISCOVERY: Optional[str] = None
+    # the feed or sitemap to read, defaults to where WordPress (or Blogger)
+    # serves it on the site of the latest chapter
+    DISCOVERY_URL: Optional[str] = None
+    # a regex the url or title of a post matches when it is a chapter of
+    # this serial, e.g. r"/chapter-".  None takes every new post.
+    CHAPTER_PATTERN: Optional[str] = None
+    # a regex matching the text of the link to the next chapter, for pages
+    # without an <a rel="next">
+    NEXT_LINK_PATTERN = r"^\W*next\b"
+    # the most chapters a single discovery adds, in case a feed or a chain
+    # of "Next" links leads somewhere unexpected
+    MAX_DISCOVERED = 50
+
+    # reuse the parsed output of chapters whose html and parsing code did
+    # not change since the last build
+    CACHE_PARSED_CHAPTERS = True
+
+    # the BeautifulSoup tree builder pages are parsed with.  "lxml" (C, and
+    # already installed with EbookLib) is much faster than the pure python
+    # "html.parser", but can build a different tree from broken html;
+    # "html5lib" is the slowest but most browser-like.  Only switch a
+    # serializer once `python -m benchmarks.parser_backends` reports its
+    # chapters are identical.
+    HTML_PARSER = "html.parser"
+    # the part of the page parse_chapter_text needs, as SoupStrainer
+    # arguments, e.g. {"name": "article"} or {"class_": "post"}.  Only the
+    # matching elements (and everything inside them) are built into the soup,
+    # the rest of the page is skipped.  None parses the whole page.
+    # (ignored by "html5lib")
+    PARSE_ONLY: Optional[Dict[str, Any]] = None
+
     def __init__(
         self,
         title: str,
@@ -43,86 +280,884 @@ class Scraper:
         # this should be the local path of the image
         self.cover_img_path = cover_img_path
 
-    def run(self, use_cache: bool = True) -> None:
+    def run(
+        self,
+        use_cache: bool = True,
+        workers: Optional[int] = None,
+        image_workers: Optional[int] = None,
+        profile: Union[str, ImageProfile, None] = None,
+        stream: bool = False,
+        fetch_executor: Optional[Executor] = None,
+        image_executor: Optional[Executor] = None,
+        discover: bool = False,
+        update: bool = False,
+    ) -> BuildMetrics:
         """
         Start the scraper. Will grab all html + image files, then process and
         save them into an epub.
 
+        Chapters are fetched and parsed concurrently, but are always added to
+        the book in `blog_map` order, so the epub matches a sequential run.
+        Chapters found by earlier discoveries follow the blog_map.
+
         :param use_cache: whether to pull everything fresh from the internet
             or use locally downloaded files
+        :param workers: how many chapters to fetch and parse at the same
+            time.  Defaults to FETCH_WORKERS, use 1 for a sequential run.
+        :param image_workers: how many processes transcode images.  Defaults
+            to IMAGE_WORKERS, use 1 to transcode on the main thread.
+        :param profile: the output profile for the images, e.g. "e-ink".
+            Defaults to IMAGE_PROFILE.
+        :param stream: write each chapter into the epub as soon as it is
+            parsed and release it, instead of holding the whole book in
+            memory.  Recommended for serials with thousands of posts.
+        :param fetch_executor: a thread pool shared with other builds to
+            fetch and parse the chapters on, instead of one of `workers`
+            threads started for this build
+        :param image_executor: a process pool shared with other builds to
+            transcode the images on, instead of one of `image_workers`
+            processes started for this build
+        :param discover: look for chapters published since the last build
+            first, see `discover_chapters`
+        :param update: only add the chapters that are not in the epub yet
+            to it, copying everything else across from the epub as it is.
+            The whole book is built when the epub's chapters changed (or it
+            was built with other settings, see `contents_settings`).
+            Chapters already in the epub are not revalidated.
+        :return: the timings, cache hits and transfers of the build
         """
-        chapters = []
-        preface_chapters = self.add_preface_chapters()
-        if preface_chapters:
-            chapters = preface_chapters
-        for key, url in self.blog_map.items():
-            logger.info(f"Processing {key} at url {url}")
-            soup = None
-            if use_cache:
-                try:
-                    soup = self.read_soup_from_file(key)
-                    logger.info(f"Loaded cached file for {key}")
-                except FileNotFoundError:
-                    # if local file not found, then look for
-                    logger.warning(
-                        f"Could not find a file for {key}, fetching from web"
+        image_workers = (
+            image_workers or self.IMAGE_WORKERS or os.cpu_count() or 1
+        )
+        build_metrics = BuildMetrics()
+        profiler = ParseProfiler() if self.PROFILE_PARSING else None
+        http_before = self.HTTP_CLIENT.stats
+        image_cache = self.DERIVED_IMAGE_CACHE
+        if image_cache is not None:
+            derived_before = image_cache.hits, image_cache.misses
+
+        epub_path = f"{LOCAL_CACHE}/{self.epub_name}"
+        profile = get_profile(profile or self.IMAGE_PROFILE)
+        settings = self.contents_settings(profile)
+        with build_metrics.activate(), _revalidating_once(set()):
+            if discover:
+                with metrics.timed("discover"):
+                    self.discover_chapters()
+            chapter_map = self.chapter_map()
+            previous = new_chapters = None
+            if update:
+                previous = self._previous_contents(epub_path, settings)
+            if previous is not None:
+                new_chapters = previous.new_chapters(chapter_map)
+                if new_chapters is None:
+                    logger.info(
+                        f"The chapters of {epub_path} changed, building it "
+                        f"again"
                     )
-                    pass
-            if not use_cache or not soup:
-                soup = self.fetch_page(url, key)
-            chapter = self.parse_chapter_text(soup, key)
-            chapters.append(chapter)
+            with metrics.timed("book"):
+                book = Book(
+                    self.title,
+                    self.author,
+                    cover_img_path=self.cover_img_path,
+                    image_workers=image_workers,
+                    image_profile=profile,
+                    image_cache=image_cache,
+                    read_image=self.image_store().read,
+                    open_image=self.image_store().open,
+                    image_executor=image_executor,
+                )
+            if new_chapters is not None:
+                chapters = self._iter_chapters(
+                    use_cache,
+                    workers,
+                    profiler,
+                    fetch_executor,
+                    new_chapters,
+                    preface=False,
+                )
+                contents = self._update_epub(
+                    book, epub_path, previous, new_chapters, chapters
+                )
+            else:
+                # the epub is about to be replaced, its contents are unknown
+                # until it is complete
+                BookContents.remove(epub_path)
+                chapters = self._iter_chapters(
+                    use_cache, workers, profiler, fetch_executor, chapter_map
+                )
+                self._write_epub(book, epub_path, chapters, stream)
+                contents = self._book_contents(book, chapter_map, settings)
+            if settings is not None:
+                contents.save(epub_path)
+        build_metrics.finish()
+
+        http_after = self.HTTP_CLIENT.stats
+        build_metrics.extra["http"] = {
+            name: value - getattr(http_before, name)
+            for name, value in asdict(http_after).items()
+        }
+        logger.info(f"HTTP: {http_after}")
+        logger.info(f"Hosts: {self.CRAWL_SCHEDULER.stats}")
+        if image_cache is not None:
+            build_metrics.counters["derived_images_cached"] = (
+                image_cache.hits - derived_before[0]
+            )
+            build_metrics.counters["derived_images_transcoded"] = (
+                image_cache.misses - derived_before[1]
+            )
+            logger.info(f"Image cache: {image_cache.stats}")
+
+        logger.info(f"{self.title} {build_metrics.summary()}")
+        report_prefix = os.path.splitext(epub_path)[0]
+        if self.WRITE_METRICS:
+            build_metrics.extra["title"] = self.title
+            build_metrics.extra["epub"] = epub_path
+            metrics_path = f"{report_prefix}.metrics.json"
+            build_metrics.write(metrics_path)
+            logger.info(f"Build metrics written to {metrics_path}")
+        if profiler is not None:
+            hotspots = ", ".join(
+                f"{name} {seconds:.3f}s"
+                for name, seconds in profiler.hotspots(5)
+            )
+            logger.info(f"Parsing hotspots: {hotspots}")
+            paths = profiler.write(f"{report_prefix}.parse-profile")
+            logger.info(f"Parsing profile written to {', '.join(paths)}")
+        return build_metrics
+
+    def _write_epub(
+        self,
+        book: Book,
+        epub_path: str,
+        chapters: Iterator[Chapter],
+        stream: bool = False,
+    ) -> None:
+        """
+        Add the chapters to the book and write it to a new epub.
+
+        :param book: the book, without chapters
+        :param epub_path: the epub to create
+        :param chapters: every chapter of the book
+        :param stream: write each chapter as soon as it is added
+        """
+        if stream:
+            # the chapters are written as they are added, so book includes
+            # most of write_epub here
+            with book.stream_to(epub_path):
+                for chapter in chapters:
+                    with metrics.timed("book"):
+                        book.add_chapter(chapter)
+            return
+
+        chapters = list(chapters)
+        with metrics.timed("book"):
+            book.add_chapters(chapters)
+            book.finish_book()
+
+        # save book to file
+        from blog_to_epub_serializer.epub_writer import write_epub
+
+        with metrics.timed("write_epub"):
+            write_epub(epub_path, book.ebook, {})
+
+    def _update_epub(
+        self,
+        book: Book,
+        epub_path: str,
+        previous: BookContents,
+        new_chapters: Dict[float, str],
+        chapters: Iterator[Chapter],
+    ) -> BookContents:
+        """
+        Add new chapters to an epub: the chapters and images it holds are
+        copied across as they are stored, only the new ones are encoded and
+        compressed.
 
-        book = Book(
+        :param book: the book, without chapters
+        :param epub_path: the epub to add to
+        :param previous: what the epub holds
+        :param new_chapters: the chapters to add, chapter number -> url
+        :param chapters: those chapters, parsed
+        :return: what the epub holds now
+        """
+        if not new_chapters:
+            logger.info(f"{epub_path} is up to date")
+            return previous
+        from blog_to_epub_serializer.epub_writer import (
+            FileItem,
+            missing_items,
+            update_epub,
+        )
+
+        chapters = list(chapters)
+        with metrics.timed("book"):
+            book.add_previous_chapters(previous.chapters)
+            book.add_chapters(chapters)
+            book.finish_book()
+        # the images the epub holds already are the same, they are named by
+        # their content (and the cover did not change, see
+        # contents_settings)
+        images = {
+            item.file_name
+            for item in book.ebook.get_items()
+            if isinstance(item, FileItem)
+        }
+        copied = previous.file_names | (
+            images - missing_items(epub_path, images)
+        )
+        with metrics.timed("write_epub"):
+            update_epub(epub_path, book.ebook, copied, {})
+        logger.info(
+            f"Added {len(chapters)} chapters to {epub_path}, copied "
+            f"{len(previous.chapters)}"
+        )
+        metrics.count("chapters_copied", len(previous.chapters))
+        return BookContents(
+            previous.settings,
+            previous.chapters
+            + [
+                ChapterEntry.from_chapter(chapter, url)
+                for chapter, url in zip(chapters, new_chapters.values())
+            ],
+        )
+
+    @staticmethod
+    def _book_contents(
+        book: Book, chapter_map: Dict[float, str], settings: Optional[str]
+    ) -> BookContents:
+        """
+        :param book: a book that was written
+        :param chapter_map: the posts its chapters were parsed from
+        :param settings: see `contents_settings`
+        :return: what its epub holds
+        """
+        chapters = book.chapters or []
+        # the preface chapters come first, they have no url
+        prefaces = len(chapters) - len(chapter_map)
+        urls = [None] * prefaces + list(chapter_map.values())
+        return BookContents(
+            settings,
+            [
+                ChapterEntry.from_chapter(chapter, url)
+                for chapter, url in zip(chapters, urls)
+            ],
+        )
+
+    def contents_settings(self, profile: ImageProfile) -> Optional[str]:
+        """
+        :param profile: the image profile of the build
+        :return: a digest of everything the chapters already written to the
+            epub depend on: the metadata, the cover, the image profile and
+            the parsing code.  An epub is only updated by a build with the
+            same settings.  None when the parsing code cannot be
+            fingerprinted.
+        """
+        fingerprint = self.code_fingerprint()
+        if fingerprint is None:
+            return None
+        digest = hashlib.sha256()
+        for value in (
+            ChapterCache.VERSION,
             self.title,
             self.author,
-            cover_img_path=self.cover_img_path,
-            chapters=chapters,
+            self.cover_img_path,
+            profile.settings,
+            fingerprint,
+        ):
+            digest.update(f"{value!r}\n".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _previous_contents(
+        epub_path: str, settings: Optional[str]
+    ) -> Optional[BookContents]:
+        """
+        :param epub_path: the epub about to be built
+        :param settings: see `contents_settings`
+        :return: what the epub holds, None if it cannot be updated
+        """
+        from blog_to_epub_serializer.epub_writer import missing_items
+
+        previous = BookContents.load(epub_path)
+        if previous is None or not os.path.isfile(epub_path):
+            logger.info(f"{epub_path} was not built yet, building it")
+        elif settings is None or previous.settings != settings:
+            logger.info(
+                f"{epub_path} was built with other settings, building it "
+                f"again"
+            )
+        elif missing_items(epub_path, previous.file_names):
+            logger.warning(
+                f"{epub_path} does not match its contents, building it "
+                f"again"
+            )
+        else:
+            return previous
+        return None
+
+    def _iter_chapters(
+        self,
+        use_cache: bool = True,
+        workers: Optional[int] = None,
+        profiler: Optional[ParseProfiler] = None,
+        executor: Optional[Executor] = None,
+        chapter_map: Optional[Dict[float, str]] = None,
+        preface: bool = True,
+    ) -> Iterator[Chapter]:
+        """
+        The preface chapters, then every chapter of the `chapter_map`,
+        fetched and parsed on a pool of threads but yielded in its order.
+
+        :param use_cache: whether to look for locally downloaded files first
+        :param workers: how many chapters to fetch and parse at the same time
+        :param profiler: profiles the parsing, if given
+        :param executor: the thread pool to fetch and parse on, instead of
+            one of `workers` threads
+        :param chapter_map: the chapters to fetch and parse, defaults to the
+            `chapter_map`
+        :param preface: whether to start with the preface chapters
+        :return: the parsed chapters
+        """
+        if preface:
+            with metrics.timed("parse_chapter_text"):
+                if profiler is not None:
+                    preface_chapters = profiler.runcall(
+                        self.add_preface_chapters
+                    )
+                else:
+                    preface_chapters = self.add_preface_chapters()
+            if preface_chapters:
+                yield from preface_chapters
+
+        workers = workers or self.FETCH_WORKERS
+        if chapter_map is None:
+            chapter_map = self.chapter_map()
+        # the worker threads record into the metrics of the build, if any
+        build_metrics, _ = metrics.current()
+        # and share the images it revalidated
+        revalidated = getattr(_revalidated, "urls", None)
+
+        def process_chapter(key: float, url: str) -> Chapter:
+            with metrics.activate(build_metrics, key, url):
+                with _revalidating_once(revalidated):
+                    return self._process_chapter(key, url, use_cache, profiler)
+
+        if executor is not None:
+            yield from self._bounded_map(
+                executor, process_chapter, chapter_map, 2 * workers
+            )
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from self._bounded_map(
+                executor, process_chapter, chapter_map, 2 * workers
+            )
+
+    @staticmethod
+    def _bounded_map(
+        executor: Executor,
+        process_chapter: Callable[[float, str], Chapter],
+        chapter_map: Dict[float, str],
+        window: int,
+    ) -> Iterator[Chapter]:
+        """
+        Like executor.map, but only submits a chapter when there are fewer
+        than `window` chapters waiting to be yielded, so at most that many
+        parsed chapters are held in memory.
+
+        :param executor: the thread pool to fetch and parse on
+        :param process_chapter: fetches and parses a chapter
+        :param chapter_map: the chapters, in the order to yield them
+        :param window: how many chapters to run ahead of the one yielded
+        :return: the parsed chapters, in chapter_map order regardless of
+            which chapter finishes downloading first
+        """
+        chapters = iter(chapter_map.items())
+        pending: Deque[Future] = deque()
+        try:
+            for key, url in islice(chapters, window):
+                pending.append(executor.submit(process_chapter, key, url))
+            while pending:
+                chapter = pending.popleft().result()
+                for key, url in islice(chapters, 1):
+                    pending.append(executor.submit(process_chapter, key, url))
+                yield chapter
+        finally:
+            # the caller stopped early, or a chapter failed
+            for future in pending:
+                future.cancel()
+
+    def chapter_map(self) -> Dict[float, str]:
+        """
+        :return: the blog_map, followed by the chapters discovered since it
+            was written (leaving out any that were added to it by hand)
+        """
+        chapters = dict(self.blog_map)
+        known = {normalize_url(url) for url in chapters.values()}
+        state = DiscoveryState.load(self.SCRAPER_CACHE)
+        for key, url in state.chapters.items():
+            if key not in chapters and normalize_url(url) not in known:
+                chapters[key] = url
+        return chapters
+
+    def discover_chapters(self) -> Dict[float, str]:
+        """
+        Look for chapters that are not in the `chapter_map` yet, the
+        DISCOVERY way, and remember them for the next builds.  They are
+        numbered after its latest chapter, in publication order.  Only the
+        feed or sitemap is requested (a 304 if it did not change), or the
+        latest chapter and the new ones ("next"), so `run` downloads
+        nothing but the new chapters.
+
+        :return: the new chapters, chapter number -> url, numbered by
+            `chapter_key`
+        """
+        if self.DISCOVERY is None:
+            logger.warning(f"{type(self).__name__} has no DISCOVERY set")
+            return {}
+        if self.DISCOVERY not in STRATEGIES:
+            raise ValueError(
+                f"DISCOVERY must be one of {', '.join(STRATEGIES)}, "
+                f"not {self.DISCOVERY!r}"
+            )
+        state = DiscoveryState.load(self.SCRAPER_CACHE)
+        chapters = self.chapter_map()
+        if not chapters:
+            logger.warning(f"{self.title} has no chapter to start from")
+            return {}
+
+        if self.DISCOVERY == "next":
+            found = self._follow_next_links(chapters)
+        else:
+            source = self.DISCOVERY_URL or default_source(
+                self.DISCOVERY, list(chapters.values())[-1]
+            )
+            known = {normalize_url(url) for url in chapters.values()}
+            posts = new_posts(
+                self._read_listing(source, state),
+                known,
+                self.CHAPTER_PATTERN,
+            )
+            found = {}
+            previous_key = max(chapters)
+            for post in posts[: self.MAX_DISCOVERED]:
+                previous_key = self._new_chapter_key(
+                    post, previous_key, chapters
+                )
+                found[previous_key] = chapters[previous_key] = post.url
+
+        for key, url in found.items():
+            logger.info(f"Discovered chapter {key} at {url}")
+        metrics.count("chapters_discovered", len(found))
+        state.chapters.update(found)
+        state.save()
+        return found
+
+    def chapter_key(self, post: Post, previous_key: float) -> float:
+        """
+        Number a discovered chapter.  Override to read the number from the
+        post, e.g. to number "part 2" posts x.5 like the blog_map does.
+
+        :param post: the url and (from feeds) title of the new chapter
+        :param previous_key: the number of the chapter before it
+        :return: the chapter number, greater than previous_key
+        """
+        return float(math.floor(previous_key) + 1)
+
+    def _new_chapter_key(
+        self, post: Post, previous_key: float, chapters: Dict[float, str]
+    ) -> float:
+        """
+        `chapter_key`, falling back to the next whole number when it gives a
+        number that does not come after previous_key or is taken
+
+        :param post: the new chapter
+        :param previous_key: the number of the chapter before it
+        :param chapters: the chapters numbered so far
+        :return: the chapter number
+        """
+        key = self.chapter_key(post, previous_key)
+        if key <= previous_key or key in chapters:
+            fallback = float(math.floor(previous_key) + 1)
+            logger.warning(
+                f"chapter_key gave {key} for {post.url} after "
+                f"{previous_key}, using {fallback}"
+            )
+            key = fallback
+        return key
+
+    @classmethod
+    def _read_listing(cls, url: str, state: DiscoveryState) -> List[Post]:
+        """
+        Read the posts of a feed or a sitemap, following a sitemap index
+        into its sitemaps.
+
+        :param url: the feed or sitemap
+        :param state: holds the validators of the feeds and sitemaps read
+            before
+        :return: the posts, in the order listed.  Empty if the feed or
+            sitemap did not change since it was read last.
+        """
+        content = cls._fetch_listing(url, state)
+        if content is None:
+            logger.info(f"{url} did not change")
+            return []
+        if cls.DISCOVERY == "feed":
+            return parse_feed(content)
+        posts, sitemaps = parse_sitemap(content)
+        for sitemap in sitemaps:
+            # the index changed, so one of these did: read them all in full
+            posts.extend(parse_sitemap(cls._fetch_listing(sitemap))[0])
+        return posts
+
+    @classmethod
+    def _fetch_listing(
+        cls, url: str, state: Optional[DiscoveryState] = None
+    ) -> Optional[bytes]:
+        """
+        :param url: a feed or sitemap
+        :param state: where its validators are kept, to only download it if
+            it changed.  None always downloads it.
+        :return: its content, None if it did not change
+        """
+        validators = state.sources.get(url) if state is not None else None
+        headers = validators.conditional_headers() if validators else {}
+        with metrics.timed("fetch"):
+            response = cls.CRAWL_SCHEDULER.fetch(
+                url, lambda: cls.HTTP_CLIENT.get(url, headers=headers)
+            )
+        if response.status_code == 304 and validators is not None:
+            return None
+        if state is not None:
+            state.sources[url] = Validators.from_response(response)
+        return response.content
+
+    def _follow_next_links(
+        self, chapters: Dict[float, str]
+    ) -> Dict[float, str]:
+        """
+        Follow the "Next" links from the latest chapter, caching every new
+        chapter's page on the way so `run` does not download it again.
+
+        :param chapters: the known chapters, new ones are added to it
+        :return: the new chapters
+        """
+        key = max(chapters)
+        url = chapters[key]
+        known = {normalize_url(url) for url in chapters.values()}
+        # the latest chapter gained its "Next" link after it was cached
+        html = self.fetch_page_html(url, key, revalidate=True)
+        found = {}
+        while len(found) < self.MAX_DISCOVERED:
+            next_url = find_next_link(
+                html, url, self.NEXT_LINK_PATTERN, self.HTML_PARSER
+            )
+            if next_url is None or normalize_url(next_url) in known:
+                break
+            if self.CHAPTER_PATTERN and not re.search(
+                self.CHAPTER_PATTERN, next_url, re.IGNORECASE
+            ):
+                logger.info(f"{next_url} does not look like a chapter")
+                break
+            key = self._new_chapter_key(Post(next_url), key, chapters)
+            url = found[key] = chapters[key] = next_url
+            known.add(normalize_url(url))
+            html = self.fetch_page_html(url, key)
+        return found
+
+    def _process_chapter(
+        self,
+        key: float,
+        url: str,
+        use_cache: bool = True,
+        profiler: Optional[ParseProfiler] = None,
+    ) -> Chapter:
+        """
+        Load a single chapter from the cache or the web and parse it.  Runs
+        inside the `run` worker pool.
+
+        :param key: the chapter number this page represents
+        :param url: the blog page that contains the chapter to ingest
+        :param use_cache: whether to look for a locally downloaded file first
+        :param profiler: profiles parse_chapter_text, if given.  The parsed
+            chapter cache is not read then, so every chapter is parsed.
+        :return: the parsed Chapter
+        """
+        logger.info(f"Processing {key} at url {url}")
+        html = None
+        with metrics.timed("cache_lookup"):
+            stale = use_cache and self.page_store().is_stale(
+                key, self.REVALIDATE_AFTER
+            )
+        if stale:
+            logger.info(f"Revalidating cached file for {key}")
+            html = self.fetch_page_html(url, key, revalidate=True)
+        elif use_cache:
+            try:
+                with metrics.timed("cache_lookup"):
+                    html = self.read_page_from_file(key)
+                metrics.count("pages_cached")
+                logger.info(f"Loaded cached file for {key}")
+            except FileNotFoundError:
+                # if local file not found, then look for
+                logger.warning(
+                    f"Could not find a file for {key}, fetching from web"
+                )
+                pass
+        if not use_cache or not html:
+            html = self.fetch_page_html(url, key)
+
+        chapter_cache = self.chapter_cache()
+        cache_key = None
+        if chapter_cache is not None:
+            with metrics.timed("cache_lookup"):
+                cache_key = chapter_cache.key(html, self.code_fingerprint())
+                cached = None
+                # the images are not fetched again when the parsing is
+                # skipped, check the ones that are due instead
+                image_current = None
+                if self.REVALIDATE_AFTER is not None:
+                    image_current = self._image_is_current
+                if profiler is None:
+                    cached = chapter_cache.get(
+                        key,
+                        cache_key,
+                        self.image_store().exists,
+                        image_current,
+                    )
+                if cached is not None:
+                    logger.info(f"Parsing of {key} is unchanged, using cache")
+                    metrics.count("chapters_cached")
+                    return Chapter.from_dict(cached)
+
+        with metrics.timed("parse"):
+            soup = self.make_soup(html, encoding=self.page_encoding(key))
+        _recorded_images.images = images = {}
+        try:
+            with metrics.timed("parse_chapter_text"):
+                if profiler is not None:
+                    chapter = profiler.runcall(
+                        self.parse_chapter_text, soup, key
+                    )
+                else:
+                    chapter = self.parse_chapter_text(soup, key)
+        finally:
+            _recorded_images.images = None
+        # the chapter holds its rendered html, the tree is full of parent and
+        # sibling cycles that would otherwise wait for the garbage collector
+        soup.decompose()
+        metrics.count("chapters_parsed")
+        if chapter_cache is not None:
+            with metrics.timed("cache_lookup"):
+                chapter_cache.put(key, cache_key, chapter.to_dict(), images)
+        return chapter
+
+    @classmethod
+    def _image_is_current(cls, url: str, path: str) -> bool:
+        """
+        Revalidate an image of a cached chapter, if it is due (see
+        REVALIDATE_AFTER)
+
+        :param url: the image url
+        :param path: where the chapter found it stored
+        :return: True if the url still holds that image
+        """
+        return cls.fetch_and_save_img(url) == path
+
+    def chapter_cache(self) -> Optional[ChapterCache]:
+        """
+        :return: where this Scraper's parsed chapters are cached, None when
+            CACHE_PARSED_CHAPTERS is off or the parsing code cannot be
+            fingerprinted
+        """
+        if not self.CACHE_PARSED_CHAPTERS or not self.code_fingerprint():
+            return None
+        return ChapterCache(f"{self.SCRAPER_CACHE}/chapters")
+
+    @classmethod
+    def code_fingerprint(cls) -> Optional[str]:
+        """
+        A hash of everything the parsing of this Scraper depends on: the
+        source of every subclass between it and Scraper, plus the module
+        level functions and values (e.g. lists of chapters to treat
+        differently) their methods use.
+
+        :return: the hex digest, or None if the source is not available
+        """
+        if cls in _fingerprints:
+            return _fingerprints[cls]
+
+        # the parser backend changes the tree parse_chapter_text works on
+        digest = hashlib.sha256(cls.HTML_PARSER.encode())
+        try:
+            for klass in cls.__mro__:
+                if klass is Scraper or not issubclass(klass, Scraper):
+                    continue
+                digest.update(inspect.getsource(klass).encode())
+                for attr in vars(klass).values():
+                    func = getattr(attr, "__func__", attr)
+                    if inspect.isfunction(func):
+                        _fingerprint_globals(func, digest)
+            fingerprint = digest.hexdigest()
+        except (OSError, TypeError):
+            logger.warning(
+                f"Could not read the source of {cls.__name__}, "
+                f"parsed chapters will not be cached"
+            )
+            fingerprint = None
+        _fingerprints[cls] = fingerprint
+        return fingerprint
+
+    @classmethod
+    def page_store(cls) -> Union[PageStore, "SqlitePageStore"]:
+        """
+        :return: where this Scraper's pages are cached, CACHE_DB if set,
+            otherwise files in SCRAPER_CACHE
+        """
+        if cls.CACHE_DB is not None:
+            return cls.CACHE_DB.pages(cls.SCRAPER_CACHE)
+        return PageStore(cls.SCRAPER_CACHE)
+
+    @classmethod
+    def image_store(cls) -> Union[ImageStore, "SqliteImageStore"]:
+        """
+        :return: where downloaded images are kept, CACHE_DB if set,
+            otherwise IMAGE_STORE
+        """
+        if cls.CACHE_DB is not None:
+            return cls.CACHE_DB.images
+        return cls.IMAGE_STORE
+
+    @classmethod
+    def page_path(cls, key: float) -> str:
+        """
+        The local path a chapter's html is cached at (when CACHE_DB is not
+        used)
+
+        :param key: the chapter number this page represents
+        :return: the path inside SCRAPER_CACHE
+        """
+        return PageStore(cls.SCRAPER_CACHE).path(key)
+
+    @classmethod
+    def make_soup(
+        cls,
+        html: Union[str, bytes],
+        parser: Optional[str] = None,
+        encoding: Optional[str] = None,
+    ) -> "BeautifulSoup":
+        """
+        Parse a page's html, or just the PARSE_ONLY part of it
+
+        :param html: the page, as text or as the bytes the server sent
+        :param parser: the BeautifulSoup tree builder to use, defaults to
+            HTML_PARSER
+        :param encoding: the charset the server declared for the bytes.
+            Without it the parser looks for a <meta charset> or guesses.
+        :return: html/beautifulsoup loaded page
+        """
+        from bs4 import BeautifulSoup, SoupStrainer
+
+        parse_only = None
+        if cls.PARSE_ONLY is not None:
+            parse_only = SoupStrainer(**cls.PARSE_ONLY)
+        if isinstance(html, str):
+            # already decoded
+            encoding = None
+        return BeautifulSoup(
+            html,
+            parser or cls.HTML_PARSER,
+            parse_only=parse_only,
+            from_encoding=encoding,
         )
-        book.finish_book()
 
-        # save book to file
-        epub.write_epub(f"{LOCAL_CACHE}/{self.epub_name}", book.ebook, {})
+    @classmethod
+    def read_page_from_file(cls, key: float) -> bytes:
+        """
+        Given the chapter key, read the saved html
 
-        pass
+        :param key: the chapter number page to retrieve
+        :return: the html of the page, as the server sent it
+        """
+        return cls.page_store().read(key)
+
+    @classmethod
+    def page_encoding(cls, key: float) -> Optional[str]:
+        """
+        :param key: the chapter number of a saved page
+        :return: the charset the server declared for the page, if any
+        """
+        validators = cls.page_store().validators(key)
+        return validators.encoding if validators else None
 
     @classmethod
     def read_soup_from_file(
         cls,
         key: float,
-    ) -> BeautifulSoup:
+    ) -> "BeautifulSoup":
         """
         Given the chapter key, fetch the saved html
 
         :param key: the chapter number page to retrieve
         :return: html/beautifulsoup loaded page
         """
-        with open(f"{cls.SCRAPER_CACHE}/soup_{key}.html", "r") as f:
-            soup = BeautifulSoup(f.read(), "html.parser")
-        return soup
+        return cls.make_soup(
+            cls.read_page_from_file(key), encoding=cls.page_encoding(key)
+        )
 
     @classmethod
-    def fetch_page(cls, url: str, key: float) -> BeautifulSoup:
+    def fetch_page(
+        cls, url: str, key: float, revalidate: bool = False
+    ) -> "BeautifulSoup":
         """
         Fetch the page from url and save to the SOUP_DIR
 
         :param url: the blog page that contains the chapter to ingest
         :param key: the chapter number this page represents
+        :param revalidate: only download the page if it changed since it was
+            cached, otherwise load the cached copy
         :return: html/beautifulsoup loaded page
         """
-        # confirm the directory exists, creating any intermediates required
-        if not os.path.exists(cls.SCRAPER_CACHE):
-            os.makedirs(cls.SCRAPER_CACHE)
-            logger.info(f"Created directory path {cls.SCRAPER_CACHE}")
+        html = cls.fetch_page_html(url, key, revalidate)
+        return cls.make_soup(html, encoding=cls.page_encoding(key))
 
-        response = requests.get(url)
-        with open(f"{cls.SCRAPER_CACHE}/soup_{key}.html", "w") as f:
-            f.write(response.text)
+    @classmethod
+    def fetch_page_html(
+        cls, url: str, key: float, revalidate: bool = False
+    ) -> bytes:
+        """
+        Fetch the page from url and save to the SOUP_DIR
 
-        return BeautifulSoup(response.text, "html.parser")
+        :param url: the blog page that contains the chapter to ingest
+        :param key: the chapter number this page represents
+        :param revalidate: only download the page if it changed since it was
+            cached, otherwise load the cached copy
+        :return: the html of the page, as the server sent it
+        """
+        page_store = cls.page_store()
+        validators = page_store.validators(key) if revalidate else None
+        headers = validators.conditional_headers() if validators else {}
+        with metrics.timed("fetch"):
+            response = cls.CRAWL_SCHEDULER.fetch(
+                url, lambda: cls.HTTP_CLIENT.get(url, headers=headers)
+            )
+
+            if response.status_code == 304 and validators is not None:
+                logger.info(f"Cached file for {key} is still current")
+                metrics.count("pages_not_modified")
+                page_store.touch(key)
+                return cls.read_page_from_file(key)
+
+            metrics.count("pages_downloaded")
+            metrics.count("page_bytes", len(response.content))
+            # kept undecoded, the parser decodes it once with the declared
+            # charset (see page_encoding)
+            page_store.write(
+                url, key, response.content, Validators.from_response(response)
+            )
+            return response.content
 
     def parse_chapter_text(
-        self, soup: BeautifulSoup, chapter_idx: float
+        self, soup: "BeautifulSoup", chapter_idx: float
     ) -> Chapter:
         """
         Method to parse the beautiful soup and edit its contents.  Should
@@ -147,30 +1182,100 @@ class Scraper:
         """
         Given an image url, download and save the file to local storage.
 
+        Images are kept in the shared image store and named by their content,
+        so an image referenced by several chapters (or several books) is only
+        downloaded, stored and added to the epub once.
+
         :param src: url source of the image to be downloaded and saved
-        :param key: the chapter this image relates to. (this is used to prevent
-            multiple images sharing the same name across different chapters)
-        :return: the local path the image was downloaded to
+        :param key: the chapter this image relates to. (only used to pick up
+            images saved under SCRAPER_CACHE/{key} by earlier versions)
+        :return: the local path the image was downloaded to (a path inside
+            CACHE_DB if it is set, read it with image_store().read)
+        """
+        with metrics.timed("image_fetch"):
+            path = cls._fetch_and_save_img(src, key)
+        recorded = getattr(_recorded_images, "images", None)
+        if recorded is not None:
+            recorded[src] = path
+        return path
+
+    @classmethod
+    def _fetch_and_save_img(cls, src: str, key: Optional[float]) -> str:
+        """
+        `fetch_and_save_img`, without the timing
+        """
+        store = cls.image_store()
+        revalidated = getattr(_revalidated, "urls", None)
+        with store.url_lock(src):
+            stored_path = store.lookup(src)
+            if stored_path:
+                validators = store.validators(src)
+                if not validators.is_stale(cls.REVALIDATE_AFTER) or (
+                    revalidated is not None and src in revalidated
+                ):
+                    metrics.count("images_cached")
+                    return stored_path
+                logger.info(f"Revalidating stored image {src}")
+                headers = validators.conditional_headers()
+            else:
+                # move images cached before the store existed into it,
+                # rather than downloading them again
+                legacy_path = cls._legacy_img_path(src, key)
+                if os.path.isfile(legacy_path):
+                    with open(legacy_path, "rb") as f:
+                        content = f.read()
+                    metrics.count("images_cached")
+                    return store.put(
+                        src, content, Validators.load(legacy_path)
+                    )
+                logger.info(f"Could not find image {src}. Fetching from web.")
+                headers = {}
+
+            # streamed to a temp file next to the store, so a failed
+            # download never ends up stored as a truncated image
+            os.makedirs(store.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=store.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+
+                    def send():
+                        # a retried download starts the file over
+                        f.seek(0)
+                        f.truncate()
+                        return cls.HTTP_CLIENT.download(
+                            src,
+                            f,
+                            max_size=cls.MAX_IMAGE_SIZE,
+                            headers=headers,
+                        )
+
+                    file, download = cls.CRAWL_SCHEDULER.fetch(src, send)
+                if revalidated is not None:
+                    revalidated.add(src)
+                if file.status_code == 304:
+                    metrics.count("images_not_modified")
+                    store.touch(src)
+                    return stored_path
+                metrics.count("images_downloaded")
+                metrics.count("image_bytes", download.size)
+                return store.put_file(
+                    src, tmp_path, Validators.from_response(file)
+                )
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    @classmethod
+    def _legacy_img_path(cls, src: str, key: Optional[float] = None) -> str:
+        """
+        Where images used to be saved, before the IMAGE_STORE
+
+        :param src: url source of the image
+        :param key: the chapter this image relates to
+        :return: the old SCRAPER_CACHE/{key}/{filename} path
         """
-        # determine the full directory path, if supplied a key
         directory = cls.SCRAPER_CACHE
         if key:
             directory = f"{directory}/{key}"
-
-        # confirm the directory exists, creating any intermediates required
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-            logger.info(f"Created directory path {directory}")
-
         filename = src.split("/")[-1]
-        full_file_path = f"{directory}/{filename}"
-        # if a file does not already exist at the name designated
-        # - download and store it
-        if not os.path.isfile(full_file_path):
-            logger.info(
-                f"Could not find file {full_file_path}. Fetching from web."
-            )
-            file = requests.get(src)
-            with open(full_file_path, "wb") as f:
-                f.write(file.content)
-        return full_file_path
+        return f"{directory}/{filename}"
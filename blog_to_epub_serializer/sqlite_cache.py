@@ -0,0 +1,462 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional
+from urllib.parse import urlparse
+
+from blog_to_epub_serializer.cache import Validators
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    compressed INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    chapter_key REAL NOT NULL,
+    sha256 TEXT NOT NULL REFERENCES blobs (sha256),
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    encoding TEXT,
+    PRIMARY KEY (scope, chapter_key)
+);
+CREATE TABLE IF NOT EXISTS images (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL REFERENCES blobs (sha256),
+    ext TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_sha256 ON images (sha256);
+"""
+
+# rebuilds a pages table that was keyed by url, which let two books (or two
+# chapters) with the same url overwrite each other's page
+MIGRATE_PAGES = """
+BEGIN;
+CREATE TABLE pages_by_chapter (
+    url TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    chapter_key REAL NOT NULL,
+    sha256 TEXT NOT NULL REFERENCES blobs (sha256),
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    encoding TEXT,
+    PRIMARY KEY (scope, chapter_key)
+);
+INSERT INTO pages_by_chapter
+    SELECT url, scope, chapter_key, sha256, etag, last_modified, fetched_at,
+        encoding
+    FROM pages;
+DROP TABLE pages;
+ALTER TABLE pages_by_chapter RENAME TO pages;
+COMMIT;
+"""
+
+# the prefix of the paths SqliteImageStore hands out.  They are never opened
+# as files, only used as the image names inside the epub and read back
+# through `SqliteImageStore.read`.
+IMAGE_PREFIX = "images"
+
+
+class SqliteCache:
+    """
+    A single SQLite file holding every downloaded page and image, an
+    alternative to the loose files of PageStore and ImageStore that is
+    faster on network filesystems and easy to copy between machines.
+
+    Pages are addressed by book (scope) and chapter number, like the files
+    of PageStore, and images by url.  Their bytes are stored once per
+    distinct content, zlib compressed when that makes them smaller.  Every
+    write is a single transaction, so an interrupted build never leaves a
+    half written entry behind.
+
+    Usage:
+        class MyScraper(Scraper):
+            CACHE_DB = SqliteCache(f"{LOCAL_CACHE}/cache.sqlite3")
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # sqlite connections can not be shared between threads
+        self._local = threading.local()
+        self.images = SqliteImageStore(self)
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        :return: this thread's connection, opened (and the schema created)
+            on first use
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            # readers do not block the writer, and the other way round
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # name -> position in the primary key (0 if not part of it)
+            columns = {
+                row[1]: row[5]
+                for row in conn.execute("PRAGMA table_info(pages)")
+            }
+            if "encoding" not in columns:
+                # created before pages kept their charset
+                conn.execute("ALTER TABLE pages ADD COLUMN encoding TEXT")
+            if columns["url"]:
+                # created when pages were keyed by url
+                conn.executescript(MIGRATE_PAGES)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Commit everything done inside the block at once, or nothing if it
+        raises.
+        """
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def pages(self, scope: str) -> "SqlitePageStore":
+        """
+        :param scope: keeps the chapter keys of different books apart,
+            usually the Scraper's SCRAPER_CACHE
+        :return: the page store of that book
+        """
+        return SqlitePageStore(self, scope)
+
+    def put_blob(self, conn: sqlite3.Connection, content: bytes) -> str:
+        """
+        Store bytes, unless identical bytes are stored already.
+
+        :param conn: the connection of the current transaction
+        :param content: the bytes to store
+        :return: their sha256 hex digest
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        exists = conn.execute(
+            "SELECT 1 FROM blobs WHERE sha256 = ?", (digest,)
+        ).fetchone()
+        if exists:
+            return digest
+
+        compressed = zlib.compress(content)
+        # images are mostly compressed already, keep those as they are
+        is_compressed = len(compressed) < len(content)
+        conn.execute(
+            "INSERT INTO blobs (sha256, compressed, size, content) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                digest,
+                is_compressed,
+                len(content),
+                compressed if is_compressed else content,
+            ),
+        )
+        return digest
+
+    def get_blob(self, digest: str) -> Optional[bytes]:
+        """
+        :param digest: the sha256 hex digest of the bytes
+        :return: the stored bytes, or None if there are none
+        """
+        row = (
+            self.connection()
+            .execute(
+                "SELECT compressed, content FROM blobs WHERE sha256 = ?",
+                (digest,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        is_compressed, content = row
+        return zlib.decompress(content) if is_compressed else content
+
+
+class SqlitePageStore:
+    """
+    The cached html of a Scraper's chapters, kept in a SqliteCache.  Has the
+    same interface as cache.PageStore.
+    """
+
+    def __init__(self, db: SqliteCache, scope: str):
+        self.db = db
+        self.scope = scope
+
+    def _row(self, key: float, columns: str) -> Optional[tuple]:
+        return (
+            self.db.connection()
+            .execute(
+                f"SELECT {columns} FROM pages "
+                f"WHERE scope = ? AND chapter_key = ?",
+                (self.scope, key),
+            )
+            .fetchone()
+        )
+
+    def read(self, key: float) -> bytes:
+        """
+        :param key: the chapter number the page represents
+        :return: the cached html, undecoded
+        :raises FileNotFoundError: if the page is not cached
+        """
+        row = self._row(key, "sha256")
+        content = self.db.get_blob(row[0]) if row else None
+        if content is None:
+            raise FileNotFoundError(f"{self.scope} {key} is not cached")
+        return content
+
+    def exists(self, key: float) -> bool:
+        """
+        :param key: the chapter number the page represents
+        :return: True if the page is cached
+        """
+        return self._row(key, "1") is not None
+
+    def validators(self, key: float) -> Optional[Validators]:
+        """
+        :param key: the chapter number the page represents
+        :return: the http validators the page was cached with
+        """
+        row = self._row(key, "url, etag, last_modified, fetched_at, encoding")
+        return Validators(*row) if row else None
+
+    def is_stale(self, key: float, max_age: Optional[float]) -> bool:
+        """
+        :param key: the chapter number the page represents
+        :param max_age: seconds a cached page is trusted for
+        :return: True if the page is cached and older than max_age
+        """
+        validators = self.validators(key)
+        return validators is not None and validators.is_stale(max_age)
+
+    def write(
+        self, url: str, key: float, html: bytes, validators: Validators
+    ) -> None:
+        """
+        Cache a freshly downloaded page.
+
+        :param url: the url the page was downloaded from
+        :param key: the chapter number the page represents
+        :param html: the page, as sent by the server
+        :param validators: the http validators of the response
+        """
+        with self.db.transaction() as conn:
+            digest = self.db.put_blob(conn, html)
+            # replaces the chapter's page, even if it moved to a new url
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (url, scope, chapter_key, "
+                "sha256, etag, last_modified, fetched_at, encoding) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    self.scope,
+                    key,
+                    digest,
+                    validators.etag,
+                    validators.last_modified,
+                    validators.fetched_at,
+                    validators.encoding,
+                ),
+            )
+
+    def touch(self, key: float) -> None:
+        """
+        Record that the server just confirmed the cached page (a 304).
+
+        :param key: the chapter number the page represents
+        """
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE pages SET fetched_at = ? "
+                "WHERE scope = ? AND chapter_key = ?",
+                (time.time(), self.scope, key),
+            )
+
+
+class SqliteImageStore:
+    """
+    Downloaded images kept in a SqliteCache.  Has the same interface as
+    cache.ImageStore, but the paths it returns only exist inside the
+    database: read them with `read`, not `open`.  Paths of real files (a
+    cover shipped with a serializer) are read from disk as usual.
+    """
+
+    def __init__(self, db: SqliteCache):
+        self.db = db
+        self._lock = threading.Lock()
+        self._url_locks = {}
+
+    def url_lock(self, url: str) -> threading.Lock:
+        """
+        A lock per url, so concurrent chapters referencing the same image
+        only download it once.
+
+        :param url: the image url
+        :return: the lock guarding that url
+        """
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    @staticmethod
+    def image_path(digest: str, ext: str) -> str:
+        return f"{IMAGE_PREFIX}/{digest}{ext}"
+
+    @staticmethod
+    def _digest(path: str) -> Optional[str]:
+        """
+        :param path: an image path
+        :return: the digest it refers to, None if it is not one of ours
+        """
+        directory, name = os.path.split(path)
+        if directory != IMAGE_PREFIX:
+            return None
+        return os.path.splitext(name)[0]
+
+    def _row(self, url: str, columns: str) -> Optional[tuple]:
+        return (
+            self.db.connection()
+            .execute(f"SELECT {columns} FROM images WHERE url = ?", (url,))
+            .fetchone()
+        )
+
+    def lookup(self, url: str) -> Optional[str]:
+        """
+        :param url: the image url
+        :return: the path of the stored image, or None if the url was never
+            stored
+        """
+        row = self._row(url, "sha256, ext")
+        return self.image_path(*row) if row else None
+
+    def validators(self, url: str) -> Optional[Validators]:
+        """
+        :param url: the image url
+        :return: the http validators the image was stored with
+        """
+        row = self._row(url, "url, etag, last_modified, fetched_at")
+        return Validators(*row) if row else None
+
+    def put(
+        self, url: str, content: bytes, validators: Optional[Validators]
+    ) -> str:
+        """
+        Store the image bytes (if no identical image is stored yet) and
+        point the url at them.
+
+        :param url: the url the image was downloaded from
+        :param content: the image bytes
+        :param validators: the http validators of the response, if any
+        :return: the path of the stored image
+        """
+        validators = validators or Validators(url=url, fetched_at=time.time())
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        with self.db.transaction() as conn:
+            digest = self.db.put_blob(conn, content)
+            conn.execute(
+                "INSERT OR REPLACE INTO images (url, sha256, ext, etag, "
+                "last_modified, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    digest,
+                    ext,
+                    validators.etag,
+                    validators.last_modified,
+                    validators.fetched_at,
+                ),
+            )
+        return self.image_path(digest, ext)
+
+    def put_file(
+        self, url: str, tmp_path: str, validators: Optional[Validators]
+    ) -> str:
+        """
+        Store a fully downloaded temp file and point the url at it.
+
+        :param url: the url the image was downloaded from
+        :param tmp_path: the downloaded file.  It no longer exists
+            afterwards.
+        :param validators: the http validators of the response, if any
+        :return: the path of the stored image
+        """
+        # sqlite takes blobs whole, the image is only in memory for the
+        # duration of the insert
+        with open(tmp_path, "rb") as f:
+            content = f.read()
+        os.remove(tmp_path)
+        return self.put(url, content, validators)
+
+    @property
+    def directory(self) -> str:
+        """
+        Where downloads are written before they are stored, next to the
+        database.
+        """
+        return os.path.dirname(self.db.path) or "."
+
+    def touch(self, url: str) -> None:
+        """
+        Record that the server just confirmed the stored image (a 304).
+
+        :param url: the image url
+        """
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE images SET fetched_at = ? WHERE url = ?",
+                (time.time(), url),
+            )
+
+    def exists(self, path: str) -> bool:
+        """
+        :param path: a path returned by `put` or `lookup`, or a local file
+        :return: True if the image is still stored
+        """
+        digest = self._digest(path)
+        if digest is not None:
+            row = (
+                self.db.connection()
+                .execute("SELECT 1 FROM blobs WHERE sha256 = ?", (digest,))
+                .fetchone()
+            )
+            if row is not None:
+                return True
+        return os.path.isfile(path)
+
+    def read(self, path: str) -> bytes:
+        """
+        :param path: a path returned by `put` or `lookup`, or a local file
+        :return: the image bytes
+        """
+        digest = self._digest(path)
+        content = self.db.get_blob(digest) if digest is not None else None
+        if content is None:
+            with open(path, "rb") as f:
+                return f.read()
+        return content
+
+    def open(self, path: str) -> BinaryIO:
+        """
+        :param path: a path returned by `put` or `lookup`, or a local file
+        :return: the image, opened for reading in binary.  Blobs are
+            decompressed into memory, local files are opened.
+        """
+        digest = self._digest(path)
+        content = self.db.get_blob(digest) if digest is not None else None
+        if content is None:
+            return open(path, "rb")
+        return io.BytesIO(content)
@@ -2,21 +2,27 @@
 This scraper pulls Sea of the Wind, Shore of the Maze - the second
 Twelve Kingdoms novel translated by https://tu-shu-guan.blogspot.com/
 """
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 from urllib.parse import urljoin
 
-from bs4 import BeautifulSoup
-
 from blog_to_epub_serializer.book_utils import Chapter
+from blog_to_epub_serializer.cli import build_one
+from blog_to_epub_serializer.registry import register
 from blog_to_epub_serializer.scraper import Scraper, LOCAL_CACHE
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
 
 class HillsOfSilverRuinScraper(Scraper):
     SCRAPER_CACHE = f"{LOCAL_CACHE}/hills-of-silver-ruin"
+    # only the main column is parsed, on both the book pages and the
+    # glossary blog post
+    PARSE_ONLY = {"id": "main"}
 
     # override parent functions
     def parse_chapter_text(
-        self, soup: BeautifulSoup, chapter_idx: float
+        self, soup: "BeautifulSoup", chapter_idx: float
     ) -> Chapter:
         # glossary is on a different website, and should be parsed differently
         if chapter_idx == 34.0:
@@ -56,7 +62,7 @@ class HillsOfSilverRuinScraper(Scraper):
         )
 
     def parse_glossary(
-        self, soup: BeautifulSoup, chapter_idx: float
+        self, soup: "BeautifulSoup", chapter_idx: float
     ) -> Chapter:
         post = soup.find(id="main")
         chapter_title = post.find("h2").text.strip()
@@ -231,16 +237,16 @@ blog_map[
 title = "Hills of Silver Ruin, a Pitch Black Moon"
 author = "Fuyumi Ono"
 epub_name = f"{title} - {author}.epub"
-cover_img_path = HillsOfSilverRuinScraper.fetch_and_save_img(
-    "https://www.eugenewoodbury.com/moon/image/moon1.jpg"
-)
 
-scraper = HillsOfSilverRuinScraper(
+serializer = register(
+    "hills-of-silver-ruin",
+    HillsOfSilverRuinScraper,
     title=title,
     author=author,
-    cover_img_path=cover_img_path,
     blog_map=blog_map,
     epub_name=epub_name,
+    cover_img_url="https://www.eugenewoodbury.com/moon/image/moon1.jpg",
 )
 
-scraper.run()
+if __name__ == "__main__":
+    build_one(serializer)
@@ -1,16 +1,21 @@
-from typing import Dict
-
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING, Dict
 
 from blog_to_epub_serializer.book_utils import Chapter
+from blog_to_epub_serializer.cli import build_one
+from blog_to_epub_serializer.registry import register
 from blog_to_epub_serializer.scraper import Scraper, LOCAL_CACHE
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
 
 class InnkeeperScraper(Scraper):
     SCRAPER_CACHE = f"{LOCAL_CACHE}/innkeeper"
+    # only the post itself is parsed, not the sidebars and comments
+    PARSE_ONLY = {"name": "article"}
 
     def parse_chapter_text(
-        self, soup: BeautifulSoup, chapter_idx: float
+        self, soup: "BeautifulSoup", chapter_idx: float
     ) -> Chapter:
         article = soup.article
         chapter_title = article.h1.text
@@ -82,7 +87,7 @@ blog_map: Dict[float, str] = {
     25.5: "https://www.ilona-andrews.com/2022/chapter-25-parts-2-and-3/",
     26: "https://ilona-andrews.com/2022/chapter-26-part-1/",
     26.5: "https://ilona-andrews.com/2022/chapter-26-part-2-and-3/",
-    27: "https://ilona-andrews.com/2022/chapter-27-the-grand-finale/"
+    27: "https://ilona-andrews.com/2022/chapter-27-the-grand-finale/",
 }
 
 title = "Innkeeper Chronicles - Sweep of the Heart"
@@ -90,12 +95,15 @@ author = "Ilona Andrews"
 cover_img_path = f"{LOCAL_CACHE}/innkeeper/A-dahl-cover-art-chop.jpg"
 epub_name = "Sweep of the Heart.epub"
 
-scraper = InnkeeperScraper(
+serializer = register(
+    "innkeeper",
+    InnkeeperScraper,
     title=title,
     author=author,
-    cover_img_path=cover_img_path,
     blog_map=blog_map,
     epub_name=epub_name,
+    cover_img_path=cover_img_path,
 )
 
-scraper.run()
+if __name__ == "__main__":
+    build_one(serializer)
@@ -2,20 +2,25 @@
 This scraper pulls Sea of the Wind, Shore of the Maze - the second
 Twelve Kingdoms novel translated by https://tu-shu-guan.blogspot.com/
 """
-from typing import Dict, List, Optional
-
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING, Dict, List, Optional
 
 from blog_to_epub_serializer.book_utils import Chapter
+from blog_to_epub_serializer.cli import build_one
+from blog_to_epub_serializer.registry import register
 from blog_to_epub_serializer.scraper import Scraper, LOCAL_CACHE
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
 
 class SeaOftheWindScraper(Scraper):
     SCRAPER_CACHE = f"{LOCAL_CACHE}/seaofthewind"
+    # only the blog post is parsed, not the sidebars and comments
+    PARSE_ONLY = {"class_": "post"}
 
     # override parent functions
     def parse_chapter_text(
-        self, soup: BeautifulSoup, chapter_idx: float
+        self, soup: "BeautifulSoup", chapter_idx: float
     ) -> Chapter:
         post = soup.find(class_="post")
         post_title = post.h3.text.strip()
@@ -245,16 +250,16 @@ blog_map: Dict[float, str] = {
 title = "Sea of the Wind, Shore of the Maze"
 author = "Fuyumi Ono"
 epub_name = f"{title} - {author}.epub"
-cover_img_path = SeaOftheWindScraper.fetch_and_save_img(
-    "https://lh6.googleusercontent.com/_4ORonPYBrqQ/Tb-vcZrNy0I/AAAAAAAAAGQ/tDmNk4bolyk/s800/jkcover02a.jpg"
-)
 
-scraper = SeaOftheWindScraper(
+serializer = register(
+    "sea-of-the-wind",
+    SeaOftheWindScraper,
     title=title,
     author=author,
-    cover_img_path=cover_img_path,
     blog_map=blog_map,
     epub_name=epub_name,
+    cover_img_url="https://lh6.googleusercontent.com/_4ORonPYBrqQ/Tb-vcZrNy0I/AAAAAAAAAGQ/tDmNk4bolyk/s800/jkcover02a.jpg",
 )
 
-scraper.run()
+if __name__ == "__main__":
+    build_one(serializer)
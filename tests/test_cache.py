@@ -0,0 +1,208 @@
+import glob
+import json
+import logging
+import os
+import random
+
+import pytest
+from bs4 import BeautifulSoup
+
+from benchmarks.standin import offline
+from benchmarks.synthetic import (
+    SyntheticScraper,
+    image_url,
+    make_image,
+    synthetic_book,
+)
+from blog_to_epub_serializer import scraper as scraper_module
+from blog_to_epub_serializer.book_utils import Chapter
+from blog_to_epub_serializer.cache import ChapterCache
+
+# read by Prefixed.parse_chapter_text, so it is part of its fingerprint
+TITLE_PREFIX = "Chapter"
+
+CHAPTERS = 6
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.INFO)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def new_process(monkeypatch):
+    """
+    Forget the fingerprints computed so far, as the next run of the cli
+    would.
+    """
+
+    def forget():
+        monkeypatch.setattr(scraper_module, "_fingerprints", {})
+
+    return forget
+
+
+class Quiet(SyntheticScraper):
+    WRITE_METRICS = False
+
+
+class Prefixed(Quiet):
+    def parse_chapter_text(
+        self, soup: BeautifulSoup, chapter_idx: float
+    ) -> Chapter:
+        chapter = super().parse_chapter_text(soup, chapter_idx)
+        chapter.title = f"{TITLE_PREFIX} {chapter.title}"
+        return chapter
+
+
+class AlwaysRevalidating(Quiet):
+    REVALIDATE_AFTER = 0
+
+
+def build(scraper_class, blog_map):
+    metrics = scraper_class("Serial", "A", blog_map, "serial.epub").run(
+        image_workers=1
+    )
+    return metrics.counters
+
+
+def cached_entries():
+    """
+    :return: chapter key -> the chapter cache entry, of the synthetic serial
+    """
+    entries = {}
+    for path in glob.glob(f"{SyntheticScraper.SCRAPER_CACHE}/chapters/*"):
+        with open(path) as f:
+            entries[
+                float(os.path.basename(path)[: -len(".json")])
+            ] = json.load(f)
+    return entries
+
+
+def test_key_depends_on_the_html_and_the_fingerprint(tmp_path):
+    cache = ChapterCache(str(tmp_path))
+    key = cache.key(b"<p>one</p>", "code")
+    assert key == cache.key(b"<p>one</p>", "code")
+    assert key != cache.key(b"<p>two</p>", "code")
+    assert key != cache.key(b"<p>one</p>", "other code")
+
+
+def test_get_misses_when_an_image_is_missing(tmp_path):
+    cache = ChapterCache(str(tmp_path))
+    image_path = tmp_path / "a.jpg"
+    image_path.write_bytes(b"jpeg")
+    chapter = {"title": "Chapter 1", "image_paths": [str(image_path)]}
+    cache.put(1.0, "key", chapter, {"https://example.com/a.jpg": "a.jpg"})
+
+    assert cache.get(1.0, "key") == chapter
+    assert cache.get(1.0, "other key") is None
+    image_path.unlink()
+    assert cache.get(1.0, "key") is None
+
+
+def test_get_misses_when_an_image_is_out_of_date(tmp_path):
+    cache = ChapterCache(str(tmp_path))
+    chapter = {"title": "Chapter 1", "image_paths": []}
+    images = {"https://example.com/a.jpg": "a.jpg"}
+    cache.put(1.0, "key", chapter, images)
+
+    assert cache.get(1.0, "key", image_current=lambda url, path: True) == (
+        chapter
+    )
+    assert cache.get(1.0, "key", image_current=lambda url, path: False) is (
+        None
+    )
+
+
+def test_get_misses_when_the_image_urls_were_not_recorded(tmp_path):
+    cache = ChapterCache(str(tmp_path))
+    chapter = {"title": "Chapter 1", "image_paths": []}
+    with open(cache.path(1.0), "w") as f:
+        json.dump({"key": "key", "chapter": chapter}, f)
+
+    assert cache.get(1.0, "key") == chapter
+    assert cache.get(1.0, "key", image_current=lambda url, path: True) is (
+        None
+    )
+
+
+def test_changed_page_html_is_parsed_again():
+    scraper, corpus = synthetic_book(chapters=CHAPTERS, images=2)
+    with offline(corpus):
+        assert build(Quiet, scraper.blog_map)["chapters_parsed"] == CHAPTERS
+        page_path = Quiet.page_store().path(3.0)
+        with open(page_path, "rb") as f:
+            html = f.read()
+        with open(page_path, "wb") as f:
+            f.write(html.replace(b"</h1>", b" (edited)</h1>"))
+        counters = build(Quiet, scraper.blog_map)
+
+    assert counters["chapters_parsed"] == 1
+    assert counters["chapters_cached"] == CHAPTERS - 1
+
+
+def test_changed_parse_chapter_text_is_parsed_again():
+    scraper, corpus = synthetic_book(chapters=CHAPTERS, images=2)
+    assert Prefixed.code_fingerprint() != Quiet.code_fingerprint()
+    with offline(corpus):
+        build(Quiet, scraper.blog_map)
+        # Prefixed stands in for Quiet after its parse_chapter_text changed
+        counters = build(Prefixed, scraper.blog_map)
+        again = build(Prefixed, scraper.blog_map)
+
+    assert counters["chapters_parsed"] == CHAPTERS
+    assert again["chapters_cached"] == CHAPTERS
+
+
+def test_changed_module_global_is_parsed_again(monkeypatch, new_process):
+    scraper, corpus = synthetic_book(chapters=CHAPTERS, images=2)
+    fingerprint = Prefixed.code_fingerprint()
+    with offline(corpus):
+        build(Prefixed, scraper.blog_map)
+        monkeypatch.setitem(globals(), "TITLE_PREFIX", "Part")
+        new_process()
+        assert Prefixed.code_fingerprint() != fingerprint
+        counters = build(Prefixed, scraper.blog_map)
+
+    assert counters["chapters_parsed"] == CHAPTERS
+
+
+def test_missing_stored_image_is_parsed_again():
+    scraper, corpus = synthetic_book(chapters=CHAPTERS, images=2)
+    with offline(corpus):
+        build(Quiet, scraper.blog_map)
+        entries = cached_entries()
+        image_path = next(
+            path
+            for entry in entries.values()
+            for path in entry["chapter"]["image_paths"]
+        )
+        using = sum(
+            image_path in entry["chapter"]["image_paths"]
+            for entry in entries.values()
+        )
+        os.remove(image_path)
+        counters = build(Quiet, scraper.blog_map)
+        assert os.path.isfile(image_path)
+
+    assert counters["chapters_parsed"] == using
+    assert counters["chapters_cached"] == CHAPTERS - using
+
+
+def test_out_of_date_image_is_parsed_again():
+    scraper, corpus = synthetic_book(chapters=CHAPTERS, images=2)
+    url = image_url(1)
+    with offline(corpus):
+        build(AlwaysRevalidating, scraper.blog_map)
+        using = sum(
+            url in entry["images"] for entry in cached_entries().values()
+        )
+        assert 0 < using < CHAPTERS
+        # the same url now serves another image
+        corpus.add(url, make_image(random.Random(1), 1), "image/jpeg")
+        counters = build(AlwaysRevalidating, scraper.blog_map)
+
+    assert counters["chapters_parsed"] == using
+    assert counters["chapters_cached"] == CHAPTERS - using
@@ -0,0 +1,37 @@
+from blog_to_epub_serializer.cli import plan_builds
+from blog_to_epub_serializer.discovery import DiscoveryState
+from blog_to_epub_serializer.registry import Serializer
+from blog_to_epub_serializer.scraper import Scraper
+
+SITE = "https://serial.example.com"
+
+
+def test_dry_run_counts_discovered_chapters(tmp_path, capsys):
+    scraper_class = type(
+        "Serial", (Scraper,), {"SCRAPER_CACHE": str(tmp_path)}
+    )
+    serializer = Serializer(
+        name="serial",
+        scraper_class=scraper_class,
+        title="Serial",
+        author="Author",
+        blog_map={1.0: f"{SITE}/ch-1/", 2.0: f"{SITE}/ch-2/"},
+        epub_name="serial.epub",
+        # never downloaded to count the chapters
+        cover_img_url=f"{SITE}/cover.jpg",
+    )
+    state = DiscoveryState.load(str(tmp_path))
+    state.chapters = {2.0: f"{SITE}/ch-2/", 3.0: f"{SITE}/ch-3/"}
+    state.save()
+    page_store = scraper_class.page_store()
+    for key in (1.0, 3.0):
+        with open(page_store.path(key), "wb") as f:
+            f.write(b"<html></html>")
+
+    plan_builds([serializer], use_cache=True)
+    plan_builds([serializer], use_cache=False)
+
+    assert capsys.readouterr().out.splitlines() == [
+        f"serial: 3 chapters, 1 to download -> {serializer.epub_path}",
+        f"serial: 3 chapters, 3 to download -> {serializer.epub_path}",
+    ]
@@ -0,0 +1,281 @@
+from typing import Dict, Optional
+
+from blog_to_epub_serializer.discovery import (
+    DiscoveryState,
+    Post,
+    find_next_link,
+    new_posts,
+    normalize_url,
+    parse_feed,
+    parse_sitemap,
+)
+from blog_to_epub_serializer.scraper import Scraper
+
+SITE = "https://serial.example.com"
+
+
+def chapter_url(number) -> str:
+    return f"{SITE}/ch-{number}/"
+
+
+def sitemap(lastmods: Dict[str, str]) -> bytes:
+    urls = "".join(
+        f"<url><loc>{url}</loc><lastmod>{lastmod}</lastmod></url>"
+        for url, lastmod in lastmods.items()
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f"{urls}</urlset>"
+    ).encode()
+
+
+def rss(posts) -> bytes:
+    items = "".join(
+        f"<item><title>{title}</title><link>{url}</link></item>"
+        for url, title in posts
+    )
+    return (
+        '<?xml version="1.0"?><rss version="2.0">'
+        f"<channel><title>Serial</title>{items}</channel></rss>"
+    ).encode()
+
+
+def page(next_link: str = "") -> bytes:
+    return (
+        f"<html><body><article><p>text</p></article>{next_link}"
+        '<a href="/about/">About</a></body></html>'
+    ).encode()
+
+
+def known(*urls: str):
+    return {normalize_url(url) for url in urls}
+
+
+def test_new_posts_ignores_the_order_of_sitemap_lastmods():
+    # ch-2 was edited after ch-3 and ch-4 were published
+    posts, _ = parse_sitemap(
+        sitemap(
+            {
+                chapter_url(1): "2024-01-01",
+                chapter_url(2): "2024-03-01",
+                chapter_url(3): "2024-01-03",
+                chapter_url(4): "2024-01-04",
+            }
+        )
+    )
+    found = new_posts(posts, known(chapter_url(1), chapter_url(2)), "/ch-")
+    assert [post.url for post in found] == [chapter_url(3), chapter_url(4)]
+
+
+def test_new_posts_orders_by_the_numbers_in_the_url():
+    posts = [
+        Post(chapter_url(10)),
+        Post(chapter_url("9-part-2")),
+        Post(chapter_url(9)),
+        Post(f"{SITE}/epilogue/", "Epilogue"),
+        Post(chapter_url("9-part-1")),
+    ]
+    found = new_posts(posts, set())
+    assert [post.url for post in found] == [
+        chapter_url(9),
+        chapter_url("9-part-1"),
+        chapter_url("9-part-2"),
+        chapter_url(10),
+        f"{SITE}/epilogue/",
+    ]
+
+
+def test_new_posts_falls_back_to_the_title():
+    posts = [
+        Post(f"{SITE}/the-end/", "Chapter 12"),
+        Post(f"{SITE}/a-beginning/", "Chapter 11"),
+    ]
+    found = new_posts(posts, set())
+    assert [post.title for post in found] == ["Chapter 11", "Chapter 12"]
+
+
+def test_new_posts_skips_known_duplicate_and_unmatched_posts():
+    posts = [
+        Post(chapter_url(1)),
+        Post("http://www.serial.example.com/ch-2"),
+        Post(chapter_url(2)),
+        Post(f"{SITE}/news/", "News"),
+        Post(f"{SITE}/a-post/", "Ch-3 is here"),
+    ]
+    found = new_posts(posts, known(chapter_url(1)), "ch-")
+    assert [post.url for post in found] == [
+        "http://www.serial.example.com/ch-2",
+        f"{SITE}/a-post/",
+    ]
+
+
+def test_parse_sitemap():
+    posts, sitemaps = parse_sitemap(
+        sitemap({chapter_url(2): "2024-02-01", chapter_url(1): ""})
+    )
+    assert sitemaps == []
+    assert posts == [
+        Post(chapter_url(2), modified="2024-02-01"),
+        Post(chapter_url(1)),
+    ]
+
+
+def test_parse_sitemap_index():
+    index = (
+        '<?xml version="1.0"?>'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f"<sitemap><loc>{SITE}/post-sitemap.xml</loc></sitemap>"
+        f"<sitemap><loc>{SITE}/page-sitemap.xml</loc></sitemap>"
+        "</sitemapindex>"
+    ).encode()
+    assert parse_sitemap(index) == (
+        [],
+        [f"{SITE}/post-sitemap.xml", f"{SITE}/page-sitemap.xml"],
+    )
+
+
+def test_parse_rss_feed_oldest_first():
+    posts = parse_feed(
+        rss([(chapter_url(2), "Chapter 2"), (chapter_url(1), "Chapter 1")])
+    )
+    assert posts == [
+        Post(chapter_url(1), "Chapter 1"),
+        Post(chapter_url(2), "Chapter 2"),
+    ]
+
+
+def test_parse_atom_feed_uses_the_alternate_link():
+    feed = (
+        '<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom">'
+        "<entry><title>Chapter 2</title>"
+        f'<link rel="replies" href="{SITE}/ch-2/#comments"/>'
+        f'<link rel="alternate" href="{chapter_url(2)}"/></entry>'
+        "<entry><title>Chapter 1</title>"
+        f'<link href="{chapter_url(1)}"/></entry>'
+        "</feed>"
+    ).encode()
+    assert parse_feed(feed) == [
+        Post(chapter_url(1), "Chapter 1"),
+        Post(chapter_url(2), "Chapter 2"),
+    ]
+
+
+def test_find_next_link():
+    rel_next = page('<a rel="next" href="/ch-3/">Onwards</a>')
+    assert find_next_link(rel_next, chapter_url(2), r"^\W*next\b") == (
+        chapter_url(3)
+    )
+    by_text = page(f'<a href="{chapter_url(3)}">Next &gt;&gt;</a>')
+    assert find_next_link(by_text, chapter_url(2), r"^\W*next\b") == (
+        chapter_url(3)
+    )
+    assert find_next_link(page(), chapter_url(2), r"^\W*next\b") is None
+
+
+class FakeScraper(Scraper):
+    """
+    Serves the feed, sitemap and pages from class attributes instead of the
+    network.
+    """
+
+    CHAPTER_PATTERN = r"/ch-"
+    listing: bytes = b""
+    pages: Dict[str, bytes] = {}
+
+    @classmethod
+    def _fetch_listing(
+        cls, url: str, state: Optional[DiscoveryState] = None
+    ) -> Optional[bytes]:
+        return cls.listing
+
+    @classmethod
+    def fetch_page_html(
+        cls, url: str, key: float, revalidate: bool = False
+    ) -> bytes:
+        return cls.pages[url]
+
+
+def fake_scraper(tmp_path, discovery: str, **attributes) -> FakeScraper:
+    scraper_class = type(
+        "Serial",
+        (FakeScraper,),
+        dict(attributes, DISCOVERY=discovery, SCRAPER_CACHE=str(tmp_path)),
+    )
+    blog_map = {1.0: chapter_url(1), 2.0: chapter_url(2)}
+    return scraper_class("Serial", "Author", blog_map, "serial.epub")
+
+
+def test_discover_from_feed(tmp_path):
+    scraper = fake_scraper(
+        tmp_path,
+        "feed",
+        listing=rss(
+            [
+                (chapter_url(4), "Chapter 4"),
+                (f"{SITE}/news/", "News"),
+                (chapter_url(3), "Chapter 3"),
+                (chapter_url(2), "Chapter 2"),
+            ]
+        ),
+    )
+    assert scraper.discover_chapters() == {
+        3.0: chapter_url(3),
+        4.0: chapter_url(4),
+    }
+    # remembered for the next builds
+    assert DiscoveryState.load(str(tmp_path)).chapters == {
+        3.0: chapter_url(3),
+        4.0: chapter_url(4),
+    }
+    assert list(scraper.chapter_map()) == [1.0, 2.0, 3.0, 4.0]
+    assert scraper.discover_chapters() == {}
+
+
+def test_discover_from_sitemap(tmp_path):
+    scraper = fake_scraper(
+        tmp_path,
+        "sitemap",
+        listing=sitemap(
+            {
+                chapter_url(1): "2024-01-01",
+                chapter_url(2): "2024-03-01",
+                chapter_url(3): "2024-01-03",
+                chapter_url(4): "2024-01-04",
+            }
+        ),
+    )
+    assert scraper.discover_chapters() == {
+        3.0: chapter_url(3),
+        4.0: chapter_url(4),
+    }
+
+
+def test_discover_by_following_next_links(tmp_path):
+    scraper = fake_scraper(
+        tmp_path,
+        "next",
+        pages={
+            chapter_url(2): page('<a href="/ch-3/">Next &gt;&gt;</a>'),
+            chapter_url(3): page('<a href="/ch-4/">Next chapter</a>'),
+            # leads out of the serial
+            chapter_url(4): page(f'<a href="{SITE}/news/">Next</a>'),
+        },
+    )
+    assert scraper.discover_chapters() == {
+        3.0: chapter_url(3),
+        4.0: chapter_url(4),
+    }
+
+
+def test_discover_stops_at_max_discovered(tmp_path):
+    scraper = fake_scraper(
+        tmp_path,
+        "next",
+        MAX_DISCOVERED=1,
+        pages={
+            chapter_url(2): page('<a href="/ch-3/">Next</a>'),
+            chapter_url(3): page('<a href="/ch-4/">Next</a>'),
+        },
+    )
+    assert scraper.discover_chapters() == {3.0: chapter_url(3)}
@@ -0,0 +1,202 @@
+import io
+import logging
+import zipfile
+from typing import Dict
+
+import pytest
+from ebooklib import epub
+
+from benchmarks.standin import offline
+from benchmarks.synthetic import SyntheticScraper, synthetic_book
+from blog_to_epub_serializer.epub_writer import (
+    DATA_DESCRIPTOR_FLAG,
+    copy_zip_entry,
+    missing_items,
+    update_epub,
+    write_epub,
+)
+from blog_to_epub_serializer.scraper import LOCAL_CACHE
+
+# entries that hold the book's uid, which every build generates anew
+GENERATED = {"EPUB/content.opf", "EPUB/toc.ncx"}
+
+
+class Unseekable(io.RawIOBase):
+    """
+    A write only stream that can not seek, so ZipFile writes every entry
+    with a data descriptor, the way a zip streamed over a pipe is.
+    """
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        return self.buffer.write(b)
+
+
+def entries(path) -> Dict[str, bytes]:
+    with zipfile.ZipFile(path) as z:
+        assert z.testzip() is None
+        return {name: z.read(name) for name in z.namelist()}
+
+
+def streamed_zip(files: Dict[str, bytes]) -> bytes:
+    """
+    :param files: name -> content, the "mimetype" is stored, the rest is
+        deflated
+    :return: a zip of them whose entries all use data descriptors
+    """
+    stream = Unseekable()
+    with zipfile.ZipFile(stream, "w") as z:
+        for name, content in files.items():
+            compress_type = zipfile.ZIP_DEFLATED
+            if name == "mimetype":
+                compress_type = zipfile.ZIP_STORED
+            z.writestr(name, content, compress_type)
+    return stream.buffer.getvalue()
+
+
+def test_copy_zip_entry_copies_data_descriptor_entries(tmp_path):
+    files = {
+        "mimetype": b"application/epub+zip",
+        "EPUB/ch_1.xhtml": b"<p>one</p>" * 1000,
+        "EPUB/ch_2.xhtml": b"<p>two</p>" * 10,
+    }
+    source = zipfile.ZipFile(io.BytesIO(streamed_zip(files)))
+    for info in source.infolist():
+        assert info.flag_bits & DATA_DESCRIPTOR_FLAG
+
+    target_path = tmp_path / "copy.zip"
+    with zipfile.ZipFile(target_path, "w") as target:
+        target.writestr("before.txt", b"written")
+        for name in files:
+            copy_zip_entry(source, target, name)
+        target.writestr("after.txt", b"written too", zipfile.ZIP_DEFLATED)
+
+    copied = entries(target_path)
+    assert copied == dict(
+        {"before.txt": b"written"}, **files, **{"after.txt": b"written too"}
+    )
+    with zipfile.ZipFile(target_path) as target:
+        assert list(copied) == target.namelist()
+        for name in files:
+            info = target.getinfo(name)
+            # the data is copied as it is, not compressed again
+            assert info.compress_type == source.getinfo(name).compress_type
+            assert info.compress_size == source.getinfo(name).compress_size
+            assert not info.flag_bits & DATA_DESCRIPTOR_FLAG
+
+
+def test_copy_zip_entry_refuses_a_truncated_entry(tmp_path):
+    data = streamed_zip({"a.txt": b"x" * 1000})
+    source = zipfile.ZipFile(io.BytesIO(data))
+    source.getinfo("a.txt").compress_size += 10**6
+    with zipfile.ZipFile(tmp_path / "copy.zip", "w") as target:
+        with pytest.raises(zipfile.BadZipFile):
+            copy_zip_entry(source, target, "a.txt")
+
+
+def make_book(chapters: int) -> epub.EpubBook:
+    book = epub.EpubBook()
+    book.set_identifier("serial")
+    book.set_title("Serial")
+    book.set_language("en")
+    items = []
+    for number in range(1, chapters + 1):
+        item = epub.EpubHtml(
+            title=f"Chapter {number}", file_name=f"ch_{number}.xhtml"
+        )
+        item.content = f"<h1>Chapter {number}</h1><p>text</p>"
+        book.add_item(item)
+        items.append(item)
+    book.toc = items
+    book.spine = ["nav"] + items
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    return book
+
+
+def rewrite_streamed(path) -> None:
+    """
+    Write the epub at path again with data descriptors on every entry.
+    """
+    data = streamed_zip(entries(path))
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_update_epub_round_trip(tmp_path):
+    path = str(tmp_path / "serial.epub")
+    write_epub(path, make_book(2), {})
+    rewrite_streamed(path)
+    before = entries(path)
+
+    update_epub(path, make_book(3), {"ch_1.xhtml", "ch_2.xhtml"}, {})
+
+    after = entries(path)
+    reference_path = str(tmp_path / "reference.epub")
+    write_epub(reference_path, make_book(3), {})
+    reference = entries(reference_path)
+    assert list(after) == list(reference)
+    for name in ("EPUB/ch_1.xhtml", "EPUB/ch_2.xhtml"):
+        assert after[name] == before[name]
+    for name in set(reference) - GENERATED:
+        assert after[name] == reference[name], name
+    with zipfile.ZipFile(path) as z:
+        assert not any(
+            info.flag_bits & DATA_DESCRIPTOR_FLAG for info in z.infolist()
+        )
+    # nothing is left behind next to the epub
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "reference.epub",
+        "serial.epub",
+    ]
+
+
+def test_update_epub_keeps_the_epub_when_it_fails(tmp_path):
+    path = str(tmp_path / "serial.epub")
+    write_epub(path, make_book(2), {})
+    before = entries(path)
+    # ch_3 is not in the epub to copy it from
+    with pytest.raises(KeyError):
+        update_epub(path, make_book(3), {"ch_1.xhtml", "ch_3.xhtml"}, {})
+    assert entries(path) == before
+    assert [p.name for p in tmp_path.iterdir()] == ["serial.epub"]
+
+
+def test_missing_items(tmp_path):
+    path = str(tmp_path / "serial.epub")
+    write_epub(path, make_book(2), {})
+    assert missing_items(path, ["ch_1.xhtml", "ch_3.xhtml"]) == {"ch_3.xhtml"}
+    assert missing_items(str(tmp_path / "none.epub"), ["ch_1.xhtml"]) == {
+        "ch_1.xhtml"
+    }
+
+
+def test_run_update_matches_a_full_build():
+    logging.disable(logging.INFO)
+    try:
+        scraper, corpus = synthetic_book(chapters=12, images=4)
+        keys = list(scraper.blog_map)
+
+        def serial(chapters: int, epub_name: str) -> SyntheticScraper:
+            blog_map = {key: scraper.blog_map[key] for key in keys[:chapters]}
+            return SyntheticScraper("Serial", "A", blog_map, epub_name)
+
+        with offline(corpus):
+            serial(9, "serial.epub").run(image_workers=1)
+            build = serial(12, "serial.epub").run(image_workers=1, update=True)
+            serial(12, "full.epub").run(image_workers=1)
+            updated = entries(f"{LOCAL_CACHE}/serial.epub")
+            full = entries(f"{LOCAL_CACHE}/full.epub")
+    finally:
+        logging.disable(logging.NOTSET)
+
+    assert build.counters["chapters_copied"] == 9
+    assert build.counters["chapters_parsed"] == 3
+    assert list(updated) == list(full)
+    for name in set(full) - GENERATED:
+        assert updated[name] == full[name], name
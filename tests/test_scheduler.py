@@ -0,0 +1,148 @@
+import time
+
+import pytest
+import requests
+
+from blog_to_epub_serializer import scheduler
+from blog_to_epub_serializer.scheduler import (
+    CrawlScheduler,
+    HostPolicy,
+    HostState,
+    retry_after_seconds,
+)
+
+
+class FakeClock:
+    """
+    Stands in for time.monotonic and time.sleep, so waits take no time and
+    can be checked.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(scheduler.time, "sleep", clock.sleep)
+    return clock
+
+
+def throttled(status: int, retry_after=None) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return requests.HTTPError(response=response)
+
+
+def test_bucket_allows_a_burst_then_spaces_requests(clock):
+    state = HostState("example.com", HostPolicy(rate=2.0, burst=3))
+    for _ in range(3):
+        state.wait_for_turn()
+    assert clock.sleeps == []
+
+    state.wait_for_turn()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_bucket_refills_while_idle_up_to_the_burst(clock):
+    state = HostState("example.com", HostPolicy(rate=1.0, burst=2))
+    state.wait_for_turn()
+    state.wait_for_turn()
+    clock.now += 60
+    state.wait_for_turn()
+    state.wait_for_turn()
+    assert clock.sleeps == []
+    state.wait_for_turn()
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_unlimited_rate_never_waits(clock):
+    state = HostState("example.com", HostPolicy(rate=None, burst=1))
+    for _ in range(10):
+        state.wait_for_turn()
+    assert clock.sleeps == []
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds("7") == 7.0
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds("soon") is None
+    date = time.strftime(
+        "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30)
+    )
+    assert 25 < retry_after_seconds(date) <= 30
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_fetch_waits_out_retry_after(clock):
+    crawl = CrawlScheduler(HostPolicy(rate=None))
+    responses = [throttled(429, "5"), "page"]
+
+    def send():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert crawl.fetch("https://example.com/1", send) == "page"
+    assert clock.sleeps == [pytest.approx(5.0)]
+    state = crawl.state("https://example.com/2")
+    assert state.throttled == 1
+    assert state.rate is not None
+
+
+def test_fetch_backs_off_without_retry_after(clock):
+    crawl = CrawlScheduler(HostPolicy(rate=None, backoff=2.0, max_retries=2))
+
+    def send():
+        raise throttled(503)
+
+    with pytest.raises(requests.HTTPError):
+        crawl.fetch("https://example.com/1", send)
+    # doubled for every throttle in a row, the last one is not waited for
+    assert clock.sleeps == [pytest.approx(2.0), pytest.approx(4.0)]
+    assert crawl.state("https://example.com/1").throttled == 3
+
+
+def test_throttle_halves_the_rate(clock):
+    crawl = CrawlScheduler(HostPolicy(rate=4.0, min_rate=1.5))
+    state = crawl.state("https://example.com/1")
+    state.record_throttle(1.0)
+    assert state.rate == 2.0
+    state.record_throttle(1.0)
+    assert state.rate == 1.5
+
+
+def test_other_errors_are_not_retried(clock):
+    crawl = CrawlScheduler(HostPolicy(rate=None))
+    calls = []
+
+    def send():
+        calls.append(1)
+        raise throttled(404)
+
+    with pytest.raises(requests.HTTPError):
+        crawl.fetch("https://example.com/1", send)
+    assert len(calls) == 1
+    assert crawl.state("https://example.com/1").throttled == 0
+
+
+def test_subdomains_share_their_domain_policy():
+    cdn = HostPolicy(rate=10.0, burst=10)
+    crawl = CrawlScheduler(hosts={"googleusercontent.com": cdn})
+    state = crawl.state("https://lh3.googleusercontent.com/a.jpg")
+    assert state is crawl.state("https://lh4.googleusercontent.com/b.jpg")
+    assert state.policy is cdn
+    assert crawl.state("https://example.com/").policy is crawl.default
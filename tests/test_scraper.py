@@ -0,0 +1,43 @@
+import logging
+
+import pytest
+
+from benchmarks.standin import offline
+from benchmarks.synthetic import SyntheticScraper, image_url, synthetic_book
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    logging.disable(logging.INFO)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+class AlwaysRevalidating(SyntheticScraper):
+    REVALIDATE_AFTER = 0
+    WRITE_METRICS = False
+
+
+def test_shared_image_is_revalidated_once_per_run():
+    scraper, corpus = synthetic_book(chapters=12, images=1)
+    # the stand-in sends no validators, every revalidation is a download
+    references = sum(
+        body.count(image_url(0).encode())
+        for url, (body, _) in corpus.responses.items()
+        if url in scraper.blog_map.values()
+    )
+    assert references > 1
+
+    def build():
+        return AlwaysRevalidating(
+            "Serial", "A", scraper.blog_map, "serial.epub"
+        ).run(image_workers=1)
+
+    with offline(corpus):
+        first = build()
+        second = build()
+
+    assert first.counters["images_downloaded"] == 1
+    assert first.counters["images_cached"] == references - 1
+    # asked again on the next run, but only once
+    assert second.counters["images_downloaded"] == 1